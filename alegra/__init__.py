@@ -1,6 +1,13 @@
+from alegra.alegra_object import AlegraObject
+from alegra.alegra_object import ListObject
+from alegra.error import AlegraError
+from alegra.resources import BankAccount
+from alegra.resources import Bill
+from alegra.resources import Category
 from alegra.resources import Contact
 from alegra.resources import Invoice
 from alegra.resources import Item
+from alegra.resources import Payment
 from alegra.resources import Retention
 from alegra.resources import Tax
 
@@ -9,3 +16,20 @@ user = None
 token = None
 api_base = "https://api.alegra.com/api"
 api_version = "v1"
+
+# Connection pooling.
+pool_connections = 10
+pool_maxsize = 10
+max_retries = 3
+request_timeout = 60  # Seconds to wait for each response; None waits forever.
+
+# Rate limiting, shared by every request made with the same credentials.
+# Without a rate, requests are only paced by the server's rate-limit headers
+# and 429 responses.
+requests_per_second = None
+request_burst = None  # Requests sent at once before pacing starts.
+retry_backoff = 0.5   # Base of the jittered exponential backoff, in seconds.
+max_retry_delay = 30
+
+# Transport used by async resource methods (defaults to the pooled sessions).
+async_transport = None
@@ -0,0 +1,133 @@
+from alegra.error import AlegraError
+
+
+def raise_for_response(response):
+    """Raises AlegraError for a non-2xx response."""
+    if 200 <= response.status_code < 300:
+        return
+    try:
+        body = response.json()
+    except ValueError:
+        body = None
+    message = body.get("message") if isinstance(body, dict) else None
+    if not message:
+        message = str(response.text if body is None else body)[:500]
+    raise AlegraError(message, response=response, body=body)
+
+
+class AlegraObject(object):
+    """Object returned by the Alegra API.
+
+    The response body is decoded once, on first access, and kept. Fields
+    can be read as items (``bill["id"]``) or attributes (``bill.id``).
+    ``status_code``, ``headers``, ``text`` and ``json()`` mirror the raw
+    response, so code written against ``requests.Response`` keeps working
+    without decoding the body again.
+    """
+
+    __slots__ = ("_response", "_data")
+
+    _UNDECODED = object()
+
+    def __init__(self, response):
+        self._response = response
+        self._data = self._UNDECODED
+
+    @classmethod
+    def from_response(cls, response):
+        """Wraps a response, raising AlegraError if it is not 2xx."""
+        raise_for_response(response)
+        return cls(response)
+
+    @property
+    def data(self):
+        """Returns the decoded response body."""
+        if self._data is self._UNDECODED:
+            # Deletions and some updates answer without a body, with 204
+            # or any other 2xx status.
+            self._data = (
+                self._response.json() if self._response.content else {}
+            )
+        return self._data
+
+    def json(self):
+        return self.data
+
+    @property
+    def response(self):
+        return self._response
+
+    @property
+    def status_code(self):
+        return self._response.status_code
+
+    @property
+    def headers(self):
+        return self._response.headers
+
+    @property
+    def text(self):
+        return self._response.text
+
+    def get(self, key, default=None):
+        data = self.data
+        return data.get(key, default) if isinstance(data, dict) else default
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __getattr__(self, name):
+        # Only called for names that are not slots, properties or methods,
+        # or when a property itself raised AttributeError.
+        if not name.startswith("_") and not hasattr(type(self), name):
+            data = self.data
+            if isinstance(data, dict) and name in data:
+                return data[name]
+        raise AttributeError(
+            "{!r} object has no attribute {!r}".format(
+                type(self).__name__, name,
+            )
+        )
+
+    def __repr__(self):
+        return "<{} status={}>".format(
+            type(self).__name__, self._response.status_code,
+        )
+
+
+class ListObject(AlegraObject):
+    """Page of records returned by a list request.
+
+    Iterating, indexing and ``len()`` work on the records, which are kept
+    as the plain dicts decoded from the body, without a wrapper per record.
+    Responses requested with ``metadata=true`` expose ``metadata``.
+    """
+
+    __slots__ = ()
+
+    @property
+    def records(self):
+        data = self.data
+        if isinstance(data, dict):
+            data = data.get("data", [])
+        return data if isinstance(data, list) else []
+
+    @property
+    def metadata(self):
+        data = self.data
+        return data.get("metadata") if isinstance(data, dict) else None
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    def __contains__(self, record):
+        return record in self.records
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
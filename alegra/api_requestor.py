@@ -1,10 +1,124 @@
 import alegra
 import base64
+import random
+import threading
+import time
 
-from requests import request
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# Rate-limit headers, as sent by Alegra and by common API gateways.
+RATE_LIMIT_REMAINING_HEADERS = (
+    "X-Rate-Limit-Remaining",
+    "X-RateLimit-Remaining",
+    "RateLimit-Remaining",
+)
+RATE_LIMIT_RESET_HEADERS = (
+    "X-Rate-Limit-Reset",
+    "X-RateLimit-Reset",
+    "RateLimit-Reset",
+)
+# Server errors are only retried for methods that are safe to repeat.
+RETRY_SERVER_ERRORS = (500, 502, 503, 504)
+IDEMPOTENT_METHODS = ("get", "head", "options", "put", "delete")
+
+
+def header_seconds(headers, names):
+    """Returns the first numeric header of ``names``, or None."""
+    for name in names:
+        try:
+            return float(headers.get(name))
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def retry_delay(response, attempt):
+    """Returns the jittered seconds to wait before retrying a response.
+
+    ``Retry-After`` is honored when present; otherwise the delay is drawn
+    from an exponential backoff window ("full jitter"), so clients throttled
+    together do not retry together.
+    """
+    jitter = random.uniform(
+        0, min(alegra.retry_backoff * 2 ** attempt, alegra.max_retry_delay),
+    )
+    retry_after = header_seconds(response.headers, ("Retry-After",))
+    if retry_after is not None:
+        return min(retry_after, alegra.max_retry_delay) + jitter / 2
+    return jitter
+
+
+class RateLimiter(object):
+    """Token bucket pacing the requests made with one set of credentials.
+
+    Up to ``burst`` requests go out at once, then ``requests_per_second``.
+    Each request reserves a token and waits the returned delay, so queued
+    requests are spaced out in the order they arrived. The bucket also
+    follows the server: it never holds more tokens than the remaining
+    requests a response reports, and when none remain or the server
+    answers 429 every request waits for the reset. Without a rate only the
+    server paces requests.
+    """
+
+    def __init__(self, requests_per_second=None, burst=None):
+        self.rate = requests_per_second
+        self.capacity = burst or max(1, requests_per_second or 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Takes a token, returning the seconds to wait before sending."""
+        with self.lock:
+            now = time.monotonic()
+            delay = max(0, self.blocked_until - now)
+            if self.rate:
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated) * self.rate,
+                )
+                self.updated = now
+                self.tokens -= 1
+                if self.tokens < 0:
+                    delay = max(delay, -self.tokens / self.rate)
+            return delay
+
+    def block(self, seconds):
+        """Holds every request for ``seconds``."""
+        with self.lock:
+            self.blocked_until = max(
+                self.blocked_until, time.monotonic() + seconds,
+            )
+
+    def update(self, headers):
+        """Adapts the bucket to the rate-limit headers of a response."""
+        remaining = header_seconds(headers, RATE_LIMIT_REMAINING_HEADERS)
+        if remaining is None:
+            return
+        if self.rate:
+            with self.lock:
+                self.tokens = min(self.tokens, remaining)
+        if remaining < 1:
+            reset = header_seconds(headers, RATE_LIMIT_RESET_HEADERS)
+            if reset is not None and reset > 1e9:
+                # An epoch timestamp rather than seconds until the reset.
+                reset -= time.time()
+            self.block(min(max(reset or 1, 0), alegra.max_retry_delay))
 
 
 class APIRequestor(object):
+    # Sessions are shared by every requestor using the same api_base and
+    # credentials so consecutive calls reuse warm keep-alive connections.
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+    # Rate limiters are shared the same way, so every thread using some
+    # credentials draws from a single request budget.
+    _rate_limiters = {}
+
     def __init__(self, user=None, token=None, api_base=None, api_version=None):
         self.user = user or alegra.user
         self.token = token or alegra.token
@@ -18,18 +132,142 @@ class APIRequestor(object):
         authorization_code = base64.b64encode(user_token).decode("utf-8")
         return "Basic {}".format(authorization_code)
 
-    def request(self, method, url, **kwargs):
-        """Injects auth headers."""
-        headers = {
+    def session_key(self):
+        """Returns the key used to share sessions between requestors."""
+        return (
+            self.api_base,
+            self.user,
+            self.token,
+            alegra.pool_connections,
+            alegra.pool_maxsize,
+            alegra.max_retries,
+        )
+
+    @property
+    def session(self):
+        """Returns the pooled session for these credentials."""
+        key = self.session_key()
+        session = self._sessions.get(key)
+        if session is None:
+            with self._sessions_lock:
+                session = self._sessions.get(key)
+                if session is None:
+                    session = self.build_session()
+                    self._sessions[key] = session
+        return session
+
+    def rate_limiter_key(self):
+        """Returns the key used to share rate limiters between requestors."""
+        return (
+            self.api_base,
+            self.user,
+            self.token,
+            alegra.requests_per_second,
+            alegra.request_burst,
+        )
+
+    @property
+    def rate_limiter(self):
+        """Returns the rate limiter for these credentials."""
+        key = self.rate_limiter_key()
+        limiter = self._rate_limiters.get(key)
+        if limiter is None:
+            with self._sessions_lock:
+                limiter = self._rate_limiters.get(key)
+                if limiter is None:
+                    limiter = RateLimiter(
+                        requests_per_second=alegra.requests_per_second,
+                        burst=alegra.request_burst,
+                    )
+                    self._rate_limiters[key] = limiter
+        return limiter
+
+    def build_session(self):
+        """Builds a keep-alive session with a sized pool.
+
+        The adapter retries connection errors; throttled and failed
+        responses are retried by ``request`` with the rate limiter.
+        """
+        retries = Retry(
+            total=alegra.max_retries,
+            backoff_factor=0.3,
+            status_forcelist=(),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=alegra.pool_connections,
+            pool_maxsize=alegra.pool_maxsize,
+            max_retries=retries,
+        )
+        session = Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @classmethod
+    def close_sessions(cls):
+        """Closes every pooled session and its connections."""
+        with cls._sessions_lock:
+            sessions = list(cls._sessions.values())
+            cls._sessions.clear()
+            cls._rate_limiters.clear()
+        for session in sessions:
+            session.close()
+
+    def request_headers(self, headers=None):
+        """Returns auth headers updated with the given headers."""
+        request_headers = {
             "Authorization": self.authorization_header(),
             "content-type": "application/json",
         }
-        headers.update(kwargs.pop("headers", {}))  # Updates headers.
-        # More info:
-        # https://requests.readthedocs.io/en/master/api/#requests.request
-        return request(
-            method,
-            url="{}/{}".format(self.api_url, url),
-            headers=headers,
-            **kwargs
-        )
+        request_headers.update(headers or {})  # Updates headers.
+        return request_headers
+
+    def request_url(self, url):
+        """Returns the absolute url for a resource url."""
+        return "{}/{}".format(self.api_url, url)
+
+    def retry_after_response(self, method, response, attempt):
+        """Returns seconds to wait before retrying a response, or None.
+
+        Throttled requests (429) are retried for every method, since the
+        server did not process them, and hold back every request with
+        these credentials. Server errors are retried for idempotent
+        methods only.
+        """
+        limiter = self.rate_limiter
+        limiter.update(response.headers)
+        status = response.status_code
+        if attempt >= alegra.max_retries:
+            return None
+        if status == 429:
+            delay = retry_delay(response, attempt)
+            limiter.block(delay)
+            return delay
+        if (status in RETRY_SERVER_ERRORS and
+                method.lower() in IDEMPOTENT_METHODS):
+            return retry_delay(response, attempt)
+        return None
+
+    def request(self, method, url, **kwargs):
+        """Injects auth headers, paces and retries the request."""
+        headers = self.request_headers(kwargs.pop("headers", {}))
+        kwargs.setdefault("timeout", alegra.request_timeout)
+        attempt = 0
+        while True:
+            delay = self.rate_limiter.reserve()
+            if delay:
+                time.sleep(delay)
+            # More info:
+            # https://requests.readthedocs.io/en/master/api/#requests.Session.request
+            response = self.session.request(
+                method,
+                url=self.request_url(url),
+                headers=headers,
+                **kwargs
+            )
+            delay = self.retry_after_response(method, response, attempt)
+            if delay is None:
+                return response
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,150 @@
+import alegra
+import asyncio
+import functools
+import threading
+import weakref
+
+from alegra.api_requestor import APIRequestor
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SessionTransport(object):
+    """Sends requests through the pooled sessions from a bounded thread pool.
+
+    The thread pool is sized like the connection pool, so the number of
+    requests in flight never exceeds the connections available.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or alegra.pool_maxsize
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                    )
+        return self._executor
+
+    async def request(self, requestor, method, url, **kwargs):
+        loop = asyncio.get_running_loop()
+        send = functools.partial(
+            requestor.session.request,
+            method,
+            url=url,
+            **kwargs
+        )
+        return await loop.run_in_executor(self.executor, send)
+
+    async def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+class HTTPXTransport(object):
+    """Sends requests with an ``httpx.AsyncClient``.
+
+    Requires the optional ``httpx`` package. Unless a client is given, one
+    is created for each event loop on first use, since a client's
+    connections are bound to the loop they were opened on.
+    """
+
+    def __init__(self, client=None, max_connections=None):
+        self.max_connections = max_connections or alegra.pool_maxsize
+        self._client = client
+        self._clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """Returns the client for the running event loop."""
+        if self._client is not None:
+            return self._client
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._clients.get(loop)
+            if client is None:
+                client = self._clients[loop] = self._create_client()
+        return client
+
+    def _create_client(self):
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError(
+                "HTTPXTransport requires httpx. Install it with "
+                "`pip install httpx`."
+            )
+        return httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+        )
+
+    async def request(self, requestor, method, url, **kwargs):
+        return await self.client.request(method, url, **kwargs)
+
+    async def close(self):
+        """Closes the given client, or the running event loop's."""
+        if self._client is not None:
+            client, self._client = self._client, None
+        else:
+            with self._lock:
+                client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+class AsyncAPIRequestor(APIRequestor):
+    _default_transport = None
+    _transport_lock = threading.Lock()
+
+    def __init__(self, user=None, token=None, api_base=None, api_version=None,
+                 transport=None):
+        super(AsyncAPIRequestor, self).__init__(
+            user=user,
+            token=token,
+            api_base=api_base,
+            api_version=api_version,
+        )
+        self.transport = (
+            transport or alegra.async_transport or self.default_transport()
+        )
+
+    @classmethod
+    def default_transport(cls):
+        """Returns the transport shared by every async requestor."""
+        if cls._default_transport is None:
+            with cls._transport_lock:
+                if cls._default_transport is None:
+                    cls._default_transport = SessionTransport()
+        return cls._default_transport
+
+    async def request(self, method, url, **kwargs):
+        """Injects auth headers, paces and retries the request."""
+        headers = self.request_headers(kwargs.pop("headers", {}))
+        kwargs.setdefault("timeout", alegra.request_timeout)
+        attempt = 0
+        while True:
+            delay = self.rate_limiter.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            response = await self.transport.request(
+                self,
+                method,
+                url=self.request_url(url),
+                headers=headers,
+                **kwargs
+            )
+            delay = self.retry_after_response(method, response, attempt)
+            if delay is None:
+                return response
+            await asyncio.sleep(delay)
+            attempt += 1
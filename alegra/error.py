@@ -0,0 +1,21 @@
+from requests import HTTPError
+
+
+class AlegraError(HTTPError):
+    """Error response from the Alegra API.
+
+    Subclasses ``requests.HTTPError``, so ``except HTTPError`` handlers keep
+    working. ``response`` is the raw response, ``body`` its decoded JSON
+    (None when it is not JSON) and ``message`` Alegra's error message.
+    """
+
+    def __init__(self, message, response=None, body=None):
+        super(AlegraError, self).__init__(
+            "Alegra API error {}: {}".format(
+                getattr(response, "status_code", None), message,
+            ),
+            response=response,
+        )
+        self.message = message
+        self.body = body
+        self.status_code = getattr(response, "status_code", None)
@@ -1,5 +1,9 @@
+from alegra.resources.bank_account import BankAccount
+from alegra.resources.bill import Bill
+from alegra.resources.category import Category
 from alegra.resources.contact import Contact
 from alegra.resources.invoice import Invoice
 from alegra.resources.item import Item
+from alegra.resources.payment import Payment
 from alegra.resources.retention import Retention
 from alegra.resources.tax import Tax
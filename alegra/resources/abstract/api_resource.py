@@ -1,4 +1,6 @@
+from alegra.alegra_object import AlegraObject
 from alegra.api_requestor import APIRequestor
+from alegra.async_api_requestor import AsyncAPIRequestor
 
 
 class APIResource:
@@ -17,7 +19,24 @@ class APIResource:
             url=url,
             params=params,
         )
-        return response
+        return AlegraObject.from_response(response)
+
+    @classmethod
+    async def aretrieve(cls, resource_id, user=None, token=None, api_base=None,
+                        api_version=None, **params):
+        requestor = AsyncAPIRequestor(
+            user=user,
+            token=token,
+            api_base=api_base,
+            api_version=api_version,
+        )
+        url = cls.class_url() + str(resource_id)
+        response = await requestor.request(
+            method="get",
+            url=url,
+            params=params,
+        )
+        return AlegraObject.from_response(response)
 
     @classmethod
     def class_url(cls):
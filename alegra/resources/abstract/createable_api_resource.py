@@ -1,5 +1,7 @@
+from alegra.alegra_object import AlegraObject
 from alegra.resources.abstract.api_resource import APIResource
 from alegra.api_requestor import APIRequestor
+from alegra.async_api_requestor import AsyncAPIRequestor
 
 
 class CreateableAPIResource(APIResource):
@@ -18,4 +20,21 @@ class CreateableAPIResource(APIResource):
             url=url,
             json=json,
         )
-        return response
+        return AlegraObject.from_response(response)
+
+    @classmethod
+    async def acreate(cls, user=None, token=None, api_base=None,
+                      api_version=None, **json):
+        requestor = AsyncAPIRequestor(
+            user=user,
+            token=token,
+            api_base=api_base,
+            api_version=api_version,
+        )
+        url = cls.class_url()
+        response = await requestor.request(
+            method="post",
+            url=url,
+            json=json,
+        )
+        return AlegraObject.from_response(response)
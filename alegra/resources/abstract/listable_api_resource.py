@@ -1,5 +1,10 @@
+from alegra.alegra_object import ListObject
 from alegra.resources.abstract.api_resource import APIResource
 from alegra.api_requestor import APIRequestor
+from alegra.async_api_requestor import AsyncAPIRequestor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 
 
 class ListableAPIResource(APIResource):
@@ -18,4 +23,145 @@ class ListableAPIResource(APIResource):
             url=url,
             params=params,
         )
-        return response
+        return ListObject.from_response(response)
+
+    @classmethod
+    async def alist(cls, user=None, token=None, api_base=None,
+                    api_version=None, **params):
+        requestor = AsyncAPIRequestor(
+            user=user,
+            token=token,
+            api_base=api_base,
+            api_version=api_version,
+        )
+        url = cls.class_url()
+        response = await requestor.request(
+            method="get",
+            url=url,
+            params=params,
+        )
+        return ListObject.from_response(response)
+
+    @classmethod
+    def list_page(cls, start, limit, user=None, token=None, api_base=None,
+                  api_version=None, **params):
+        """Returns the records of one page, raising for error responses."""
+        return cls.list(
+            user=user,
+            token=token,
+            api_base=api_base,
+            api_version=api_version,
+            start=start,
+            limit=limit,
+            **params
+        ).records
+
+    @classmethod
+    def list_iter(cls, page_size=30, start=0, max_pages=None, prefetch=False,
+                  user=None, token=None, api_base=None, api_version=None,
+                  **params):
+        """Yields records lazily, requesting one page at a time.
+
+        With ``prefetch`` the next page is requested in the background
+        while the current one is consumed. Iteration stops at the first
+        short page, after ``max_pages`` pages or when the caller stops
+        consuming the generator.
+        """
+        def fetch(page_start):
+            return cls.list_page(
+                page_start,
+                page_size,
+                user=user,
+                token=token,
+                api_base=api_base,
+                api_version=api_version,
+                **params
+            )
+
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            pages = 0
+            page_start = start
+            pending = executor.submit(fetch, page_start) if prefetch else None
+            while max_pages is None or pages < max_pages:
+                page = pending.result() if prefetch else fetch(page_start)
+                pages += 1
+                page_start += page_size
+                last_page = len(page) < page_size or (
+                    max_pages is not None and pages >= max_pages
+                )
+                if prefetch and not last_page:
+                    pending = executor.submit(fetch, page_start)
+                for record in page:
+                    yield record
+                if last_page:
+                    break
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    auto_paging_iter = list_iter
+
+    @classmethod
+    def list_all(cls, page_size=30, max_workers=4, max_pages=None, user=None,
+                 token=None, api_base=None, api_version=None, **params):
+        """Returns every record, requesting pages concurrently.
+
+        The first page is requested with ``metadata=true``; when the total
+        is reported every remaining page is requested at once, otherwise
+        pages are requested in a window of ``max_workers`` until a short
+        page marks the end of the collection. Requests are paced and
+        throttled ones retried by the requestor's rate limiter.
+        """
+        def fetch(index, **extra):
+            return cls.list(
+                user=user,
+                token=token,
+                api_base=api_base,
+                api_version=api_version,
+                start=index * page_size,
+                limit=page_size,
+                **dict(params, **extra)
+            ).data
+
+        first = fetch(0, metadata="true")
+        last_page = None
+        if isinstance(first, dict):
+            total = (first.get("metadata") or {}).get("total")
+            first = first.get("data", [])
+            if total is not None:
+                last_page = max(0, (int(total) - 1) // page_size)
+        if not isinstance(first, list):
+            return []
+        if len(first) < page_size:
+            last_page = 0
+        if max_pages is not None and (
+                last_page is None or last_page >= max_pages):
+            last_page = max_pages - 1
+
+        pages = {0: first}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {}
+            next_index = 1
+            while True:
+                while (len(pending) < max_workers and
+                       (last_page is None or next_index <= last_page)):
+                    pending[executor.submit(fetch, next_index)] = next_index
+                    next_index += 1
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    page = future.result()
+                    pages[index] = page if isinstance(page, list) else []
+                    if len(pages[index]) < page_size and (
+                            last_page is None or index < last_page):
+                        last_page = index
+
+        records = []
+        for index in sorted(pages):
+            if last_page is not None and index > last_page:
+                break
+            records.extend(pages[index])
+        return records
@@ -1,4 +1,6 @@
+from alegra.alegra_object import AlegraObject
 from alegra.api_requestor import APIRequestor
+from alegra.async_api_requestor import AsyncAPIRequestor
 from alegra.resources.abstract.api_resource import APIResource
 
 
@@ -18,4 +20,21 @@ class VoidableAPIResource(APIResource):
             url=url,
             json=json,
         )
-        return response
+        return AlegraObject.from_response(response)
+
+    @classmethod
+    async def avoid(cls, resource_id, user=None, token=None, api_base=None,
+                    api_version=None, **json):
+        requestor = AsyncAPIRequestor(
+            user=user,
+            token=token,
+            api_base=api_base,
+            api_version=api_version,
+        )
+        url = cls.class_url() + str(resource_id) + "/void/"
+        response = await requestor.request(
+            method="post",
+            url=url,
+            json=json,
+        )
+        return AlegraObject.from_response(response)
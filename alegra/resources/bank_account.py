@@ -0,0 +1,5 @@
+from alegra.resources.abstract import ListableAPIResource
+
+
+class BankAccount(ListableAPIResource):
+    OBJECT_NAME = "bank-accounts"
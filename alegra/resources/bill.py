@@ -0,0 +1,15 @@
+from alegra.resources.abstract import CreateableAPIResource
+from alegra.resources.abstract import DeleteableAPIResource
+from alegra.resources.abstract import ListableAPIResource
+from alegra.resources.abstract import UpdateableAPIResource
+from alegra.resources.abstract import VoidableAPIResource
+
+
+class Bill(
+    CreateableAPIResource,
+    DeleteableAPIResource,
+    ListableAPIResource,
+    UpdateableAPIResource,
+    VoidableAPIResource,
+):
+    OBJECT_NAME = "bills"
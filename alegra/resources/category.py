@@ -0,0 +1,13 @@
+from alegra.resources.abstract import CreateableAPIResource
+from alegra.resources.abstract import DeleteableAPIResource
+from alegra.resources.abstract import ListableAPIResource
+from alegra.resources.abstract import UpdateableAPIResource
+
+
+class Category(
+    CreateableAPIResource,
+    DeleteableAPIResource,
+    ListableAPIResource,
+    UpdateableAPIResource,
+):
+    OBJECT_NAME = "categories"
@@ -1,4 +1,6 @@
+from alegra.alegra_object import AlegraObject
 from alegra.api_requestor import APIRequestor
+from alegra.async_api_requestor import AsyncAPIRequestor
 from alegra.resources.abstract import CreateableAPIResource 
 from alegra.resources.abstract import EmailableAPIResource
 from alegra.resources.abstract import ListableAPIResource
@@ -30,4 +32,21 @@ class Invoice(
             url=url,
             json=json,
         )
-        return response
+        return AlegraObject.from_response(response)
+
+    @classmethod
+    async def aopen(cls, resource_id, user=None, token=None, api_base=None,
+                    api_version=None, **json):
+        requestor = AsyncAPIRequestor(
+            user=user,
+            token=token,
+            api_base=api_base,
+            api_version=api_version,
+        )
+        url = cls.class_url() + str(resource_id) + "/open/"
+        response = await requestor.request(
+            method="post",
+            url=url,
+            json=json,
+        )
+        return AlegraObject.from_response(response)
@@ -22,6 +22,7 @@ setuptools.setup(
     packages=setuptools.find_packages(exclude=["tests", "tests.*"]),
     python_requires=">=3.5",
     install_requires=["requests"],
+    extras_require={"httpx": ["httpx"]},
     classifiers=[
         "Development Status :: 4 - Beta",
         "License :: OSI Approved :: MIT License",
@@ -62,5 +62,7 @@ except Exception as e:
 "
 
 # Run gunicorn with current directory in Python path
+# A single worker process keeps the in-memory upload job queue shared;
+# threads let uploads, job polling and other requests run concurrently
 echo "=== DEBUG: Starting gunicorn with fixed path ==="
-exec gunicorn app:app --bind 0.0.0.0:$PORT --workers 1 --timeout 120 
\ No newline at end of file
+exec gunicorn app:app --bind 0.0.0.0:$PORT --workers 1 --threads ${GUNICORN_THREADS:-8} --timeout 120 
\ No newline at end of file
@@ -0,0 +1,11 @@
+import alegra
+
+
+class TestBankAccount:
+    def test_crud(self):
+        # List bank accounts.
+        response = alegra.BankAccount.list()
+        assert response.status_code == 200
+        # Retrieve bank account.
+        response = alegra.BankAccount.retrieve(1)
+        assert response.status_code == 200
@@ -0,0 +1,8 @@
+import alegra
+
+
+class TestBill:
+    def test_crud(self):
+        # List bills.
+        response = alegra.Bill.list()
+        assert response.status_code == 200
@@ -0,0 +1,12 @@
+import alegra
+
+
+class TestCategory:
+    def test_crud(self):
+        # List categories.
+        response = alegra.Category.list()
+        assert response.status_code == 200
+        # Retrieve category.
+        category_id = response.json()[0].get("id")
+        response = alegra.Category.retrieve(category_id)
+        assert response.status_code == 200
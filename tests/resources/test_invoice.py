@@ -1,4 +1,5 @@
 import alegra
+import pytest
 
 
 class TestInvoice:
@@ -45,24 +46,27 @@ class TestInvoice:
         )
         assert response.status_code == 200
         # Send invoice by email.
-        response = alegra.Invoice.email(
-            resource_id=invoice_id,
-            emails=["chaty@yopmail.com"],
-            sendCopyToUser=True,
-            invoiceType="copy",
-        )
-        assert response.status_code == 400
+        with pytest.raises(alegra.AlegraError) as error:
+            alegra.Invoice.email(
+                resource_id=invoice_id,
+                emails=["chaty@yopmail.com"],
+                sendCopyToUser=True,
+                invoiceType="copy",
+            )
+        assert error.value.status_code == 400
         # Open invoice.
-        response = alegra.Invoice.open(
-            resource_id=invoice_id,
-            stamp={
-                "generateStamp": True,
-            }
-        )
-        assert response.status_code == 400
+        with pytest.raises(alegra.AlegraError) as error:
+            alegra.Invoice.open(
+                resource_id=invoice_id,
+                stamp={
+                    "generateStamp": True,
+                }
+            )
+        assert error.value.status_code == 400
         # Void invoice.
-        response = alegra.Invoice.void(
-            resource_id=invoice_id,
-            cause="testing",
-        )
-        assert response.status_code == 400
+        with pytest.raises(alegra.AlegraError) as error:
+            alegra.Invoice.void(
+                resource_id=invoice_id,
+                cause="testing",
+            )
+        assert error.value.status_code == 400
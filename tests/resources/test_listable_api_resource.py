@@ -0,0 +1,116 @@
+import json
+
+import alegra
+import pytest
+import requests
+import time
+
+from alegra.api_requestor import APIRequestor
+from requests import HTTPError
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+
+    def json(self):
+        return self.payload
+
+    @property
+    def content(self):
+        return json.dumps(self.payload).encode("utf-8")
+
+    @property
+    def headers(self):
+        return {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HTTPError(self.status_code, response=self)
+
+
+@pytest.fixture
+def contacts(monkeypatch):
+    records = [{"id": str(i)} for i in range(1, 71)]
+    calls = []
+
+    def fake_request(self, method, url, params=None, **kwargs):
+        calls.append(params)
+        start, limit = params["start"], params["limit"]
+        return FakeResponse(records[start:start + limit])
+
+    monkeypatch.setattr(APIRequestor, "request", fake_request)
+    return records, calls
+
+
+class TestListIter:
+    def test_yields_every_record(self, contacts):
+        records, calls = contacts
+        assert list(alegra.Contact.list_iter()) == records
+        assert [call["start"] for call in calls] == [0, 30, 60]
+
+    def test_prefetch(self, contacts):
+        records, calls = contacts
+        iterator = alegra.Contact.auto_paging_iter(page_size=20, prefetch=True)
+        assert list(iterator) == records
+        assert len(calls) == 4
+
+    def test_early_termination(self, contacts):
+        records, calls = contacts
+        for record in alegra.Contact.list_iter(page_size=10):
+            if record["id"] == "15":
+                break
+        assert len(calls) == 2
+        assert len(list(alegra.Contact.list_iter(max_pages=1))) == 30
+
+    def test_raises_for_error_responses(self, monkeypatch):
+        monkeypatch.setattr(
+            APIRequestor,
+            "request",
+            lambda self, method, url, **kwargs: FakeResponse({}, 401),
+        )
+        with pytest.raises(HTTPError):
+            list(alegra.Contact.list_iter())
+
+
+class TestListAll:
+    def test_probes_for_the_end(self, contacts):
+        records, calls = contacts
+        assert alegra.Contact.list_all(page_size=20, max_workers=3) == records
+        assert calls[0]["metadata"] == "true"
+
+    def test_uses_reported_total(self, monkeypatch):
+        records = [{"id": str(i)} for i in range(1, 101)]
+        calls = []
+
+        def fake_request(self, method, url, params=None, **kwargs):
+            calls.append(params)
+            start, limit = params["start"], params["limit"]
+            page = records[start:start + limit]
+            if params.get("metadata"):
+                return FakeResponse({
+                    "metadata": {"total": len(records)},
+                    "data": page,
+                })
+            return FakeResponse(page)
+
+        monkeypatch.setattr(APIRequestor, "request", fake_request)
+        assert alegra.Contact.list_all(page_size=25) == records
+        assert sorted(call["start"] for call in calls) == [0, 25, 50, 75]
+
+    def test_max_pages(self, contacts):
+        records, calls = contacts
+        assert alegra.Contact.list_all(page_size=10, max_pages=2) == \
+            records[:20]
+
+    def test_requestor_retries_throttled_pages(self, monkeypatch):
+        responses = [FakeResponse({}, 429), FakeResponse([{"id": "1"}])]
+        monkeypatch.setattr(
+            requests.Session,
+            "request",
+            lambda self, method, url=None, **kwargs: responses.pop(0),
+        )
+        monkeypatch.setattr(time, "sleep", lambda seconds: None)
+        assert alegra.Contact.list_all() == [{"id": "1"}]
+        assert responses == []
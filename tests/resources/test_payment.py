@@ -0,0 +1,8 @@
+import alegra
+
+
+class TestPayment:
+    def test_crud(self):
+        # List payments.
+        response = alegra.Payment.list()
+        assert response.status_code == 200
@@ -0,0 +1,98 @@
+import json
+
+import alegra
+import pytest
+
+from alegra.api_requestor import APIRequestor
+from requests import HTTPError
+
+
+class FakeResponse:
+    def __init__(self, payload=None, status_code=200, text=""):
+        self.payload = payload
+        self.status_code = status_code
+        self.headers = {}
+        self.text = text
+        self.content = (text or json.dumps(payload)).encode("utf-8")
+        self.decodes = 0
+
+    def json(self):
+        self.decodes += 1
+        if self.payload is None:
+            raise ValueError("No JSON object could be decoded")
+        return self.payload
+
+
+class TestAlegraObject:
+    def test_decodes_once_on_first_access(self):
+        response = FakeResponse({"id": "7", "name": "Chaty"}, 201)
+        contact = alegra.AlegraObject.from_response(response)
+        assert response.decodes == 0
+        assert contact.id == "7"
+        assert contact["name"] == "Chaty"
+        assert contact.json() == {"id": "7", "name": "Chaty"}
+        assert contact.get("email", "") == ""
+        assert "id" in contact
+        assert contact.status_code == 201
+        assert response.decodes == 1
+
+    def test_empty_body_decodes_to_empty_dict(self):
+        for status_code in (200, 202, 204):
+            response = FakeResponse(status_code=status_code)
+            response.content = b""
+            assert alegra.AlegraObject.from_response(response).data == {}
+            assert response.decodes == 0
+
+    def test_uses_slots(self):
+        contact = alegra.AlegraObject(FakeResponse({"id": "7"}))
+        with pytest.raises(AttributeError):
+            contact.__dict__
+        with pytest.raises(AttributeError):
+            contact.email
+
+    def test_raises_for_error_responses(self):
+        response = FakeResponse({"message": "Contacto no encontrado"}, 404)
+        with pytest.raises(alegra.AlegraError) as error:
+            alegra.AlegraObject.from_response(response)
+        assert isinstance(error.value, HTTPError)
+        assert error.value.status_code == 404
+        assert error.value.message == "Contacto no encontrado"
+        assert error.value.response is response
+
+        with pytest.raises(alegra.AlegraError) as error:
+            alegra.AlegraObject.from_response(
+                FakeResponse(status_code=502, text="Bad Gateway"),
+            )
+        assert error.value.message == "Bad Gateway"
+        assert error.value.body is None
+
+
+class TestListObject:
+    def test_iterates_plain_records(self):
+        records = [{"id": str(i)} for i in range(3)]
+        page = alegra.ListObject.from_response(FakeResponse(records))
+        assert len(page) == 3
+        assert list(page) == records
+        assert page[1] is records[1]
+        assert page.metadata is None
+
+    def test_unwraps_metadata(self):
+        page = alegra.ListObject(FakeResponse({
+            "metadata": {"total": 1},
+            "data": [{"id": "1"}],
+        }))
+        assert page.records == [{"id": "1"}]
+        assert page.metadata == {"total": 1}
+
+    def test_resources_return_objects(self, monkeypatch):
+        responses = {
+            "contacts/": FakeResponse([{"id": "1"}]),
+            "contacts/1": FakeResponse({"id": "1"}),
+        }
+        monkeypatch.setattr(
+            APIRequestor,
+            "request",
+            lambda self, method, url, **kwargs: responses[url],
+        )
+        assert isinstance(alegra.Contact.list(), alegra.ListObject)
+        assert alegra.Contact.retrieve(1).id == "1"
@@ -1,6 +1,37 @@
+import alegra
+import pytest
+
 from alegra import api_requestor
 
 
+class FakeResponse:
+    def __init__(self, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Records the waits of the requestor instead of sleeping."""
+    waits = []
+    monkeypatch.setattr(api_requestor.time, "sleep", waits.append)
+    monkeypatch.setattr(alegra, "retry_backoff", 0.1)
+    yield waits
+    api_requestor.APIRequestor.close_sessions()
+
+
+def queued_requestor(monkeypatch, responses, user="queue@okchaty.com"):
+    requestor = api_requestor.APIRequestor(user=user, token="1")
+    calls = []
+
+    def fake_request(method, url=None, headers=None, **kwargs):
+        calls.append(method)
+        return responses.pop(0)
+
+    monkeypatch.setattr(requestor.session, "request", fake_request)
+    return requestor, calls
+
+
 class TestAPIRequestor:
     def test_authorization_header(self):
         requestor = api_requestor.APIRequestor(
@@ -8,3 +39,99 @@ class TestAPIRequestor:
             token = "tokenejemploapi12345",
         )
         assert requestor.authorization_header() == "Basic ZWplbXBsb2FwaUBhbGVncmEuY29tOnRva2VuZWplbXBsb2FwaTEyMzQ1"
+
+    def test_session_is_shared_per_credentials(self):
+        first = api_requestor.APIRequestor(user="a@okchaty.com", token="1")
+        second = api_requestor.APIRequestor(user="a@okchaty.com", token="1")
+        other = api_requestor.APIRequestor(user="b@okchaty.com", token="2")
+        assert first.session is second.session
+        assert first.session is not other.session
+        session = first.session
+        api_requestor.APIRequestor.close_sessions()
+        assert first.session is not session
+
+    def test_request_uses_pooled_session(self, monkeypatch):
+        requestor = api_requestor.APIRequestor(user="a@okchaty.com", token="1")
+        calls = []
+
+        def fake_request(method, url=None, headers=None, **kwargs):
+            calls.append((method, url, headers, kwargs))
+            return response
+
+        response = FakeResponse()
+        monkeypatch.setattr(requestor.session, "request", fake_request)
+        assert requestor.request(
+            "get", "contacts/", params={"limit": 30},
+        ) is response
+        method, url, headers, kwargs = calls[0]
+        assert method == "get"
+        assert url == "https://api.alegra.com/api/v1/contacts/"
+        assert headers["Authorization"] == requestor.authorization_header()
+        assert kwargs == {
+            "params": {"limit": 30},
+            "timeout": alegra.request_timeout,
+        }
+
+    def test_retries_throttled_requests(self, monkeypatch, sleeps):
+        responses = [
+            FakeResponse(429, {"Retry-After": "2"}),
+            FakeResponse(201),
+        ]
+        requestor, calls = queued_requestor(monkeypatch, responses)
+        response = requestor.request("post", "bills/", json={})
+        assert response.status_code == 201
+        assert calls == ["post", "post"]
+        # Retry-After plus at most half the first backoff window as jitter.
+        assert 2 <= sleeps[0] <= 2.05
+
+    def test_retries_server_errors_of_idempotent_methods(self, monkeypatch,
+                                                         sleeps):
+        responses = [FakeResponse(503), FakeResponse(503), FakeResponse(200)]
+        requestor, calls = queued_requestor(monkeypatch, responses)
+        assert requestor.request("get", "bills/").status_code == 200
+        assert len(calls) == 3
+        assert all(0 <= wait <= 0.4 for wait in sleeps)
+
+        responses = [FakeResponse(503), FakeResponse(201)]
+        requestor, calls = queued_requestor(monkeypatch, responses)
+        assert requestor.request("post", "bills/").status_code == 503
+        assert calls == ["post"]
+
+    def test_gives_up_after_max_retries(self, monkeypatch, sleeps):
+        monkeypatch.setattr(alegra, "max_retries", 2)
+        responses = [FakeResponse(429) for _ in range(4)]
+        requestor, calls = queued_requestor(monkeypatch, responses)
+        assert requestor.request("get", "bills/").status_code == 429
+        assert len(calls) == 3
+
+    def test_rate_limiter_is_shared_per_credentials(self, sleeps):
+        first = api_requestor.APIRequestor(user="a@okchaty.com", token="1")
+        second = api_requestor.APIRequestor(user="a@okchaty.com", token="1")
+        other = api_requestor.APIRequestor(user="b@okchaty.com", token="2")
+        assert first.rate_limiter is second.rate_limiter
+        assert first.rate_limiter is not other.rate_limiter
+        rotated = api_requestor.APIRequestor(user="a@okchaty.com", token="3")
+        assert first.rate_limiter is not rotated.rate_limiter
+
+
+class TestRateLimiter:
+    def test_paces_requests_after_the_burst(self):
+        limiter = api_requestor.RateLimiter(requests_per_second=10, burst=2)
+        delays = [limiter.reserve() for _ in range(4)]
+        assert delays[:2] == [0, 0]
+        assert delays[2] == pytest.approx(0.1, abs=0.01)
+        assert delays[3] == pytest.approx(0.2, abs=0.01)
+
+    def test_follows_rate_limit_headers(self):
+        limiter = api_requestor.RateLimiter(requests_per_second=10, burst=5)
+        limiter.update({"X-Rate-Limit-Remaining": "1"})
+        assert limiter.reserve() == 0
+        assert limiter.reserve() == pytest.approx(0.1, abs=0.01)
+
+        limiter = api_requestor.RateLimiter()
+        assert limiter.reserve() == 0
+        limiter.update({
+            "X-Rate-Limit-Remaining": "0",
+            "X-Rate-Limit-Reset": "3",
+        })
+        assert limiter.reserve() == pytest.approx(3, abs=0.05)
@@ -0,0 +1,161 @@
+import alegra
+import asyncio
+import functools
+import pytest
+
+from alegra import async_api_requestor
+
+
+class FakeResponse(dict):
+    status_code = 200
+    headers = {}
+
+    def json(self):
+        return self
+
+
+class FakeTransport:
+    def __init__(self):
+        self.calls = []
+
+    async def request(self, requestor, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        await asyncio.sleep(0)
+        return FakeResponse(method=method, url=url)
+
+
+class TestAsyncAPIRequestor:
+    def test_request_uses_injected_transport(self):
+        transport = FakeTransport()
+        requestor = async_api_requestor.AsyncAPIRequestor(
+            user="a@okchaty.com",
+            token="1",
+            transport=transport,
+        )
+        response = asyncio.run(
+            requestor.request("get", "contacts/", params={"limit": 30})
+        )
+        assert response["url"] == "https://api.alegra.com/api/v1/contacts/"
+        method, url, kwargs = transport.calls[0]
+        assert kwargs["params"] == {"limit": 30}
+        assert kwargs["headers"]["Authorization"] == \
+            requestor.authorization_header()
+
+    def test_resource_methods_run_concurrently(self, monkeypatch):
+        transport = FakeTransport()
+        monkeypatch.setattr(alegra, "async_transport", transport)
+
+        async def fan_out():
+            return await asyncio.gather(
+                alegra.Contact.alist(limit=30),
+                alegra.Contact.aretrieve(1),
+                alegra.Contact.acreate(name="Chaty"),
+                alegra.Contact.amodify(1, name="Chaty"),
+                alegra.Contact.adelete(1),
+                alegra.Invoice.aemail(2, emails=["chaty@yopmail.com"]),
+                alegra.Invoice.avoid(2, cause="testing"),
+                alegra.Invoice.aopen(2),
+            )
+
+        responses = asyncio.run(fan_out())
+        assert isinstance(responses[0], alegra.ListObject)
+        assert [(r.response["method"], r.response["url"].rsplit("/v1/", 1)[1])
+                for r in responses] == [
+            ("get", "contacts/"),
+            ("get", "contacts/1"),
+            ("post", "contacts/"),
+            ("put", "contacts/1"),
+            ("delete", "contacts/1"),
+            ("post", "invoices/2/email/"),
+            ("post", "invoices/2/void/"),
+            ("post", "invoices/2/open/"),
+        ]
+
+    def test_session_transport_shares_pooled_session(self, monkeypatch):
+        transport = async_api_requestor.SessionTransport(max_workers=2)
+        requestor = async_api_requestor.AsyncAPIRequestor(
+            user="a@okchaty.com",
+            token="1",
+            transport=transport,
+        )
+        monkeypatch.setattr(
+            requestor.session,
+            "request",
+            lambda method, url=None, **kwargs: FakeResponse(
+                method=method, url=url,
+            ),
+        )
+        response = asyncio.run(requestor.request("get", "taxes/"))
+        assert response == {
+            "method": "get",
+            "url": "https://api.alegra.com/api/v1/taxes/",
+        }
+        asyncio.run(transport.close())
+
+    def test_httpx_transport(self):
+        httpx = pytest.importorskip("httpx")
+        client = httpx.AsyncClient(transport=httpx.MockTransport(
+            lambda request: httpx.Response(200, json={"url": str(request.url)})
+        ))
+        requestor = async_api_requestor.AsyncAPIRequestor(
+            user="a@okchaty.com",
+            token="1",
+            transport=async_api_requestor.HTTPXTransport(client=client),
+        )
+        response = asyncio.run(requestor.request("get", "items/1"))
+        assert response.json() == {
+            "url": "https://api.alegra.com/api/v1/items/1",
+        }
+
+    def test_httpx_transport_creates_a_client_per_loop(self, monkeypatch):
+        httpx = pytest.importorskip("httpx")
+        mock = httpx.MockTransport(lambda request: httpx.Response(200))
+        monkeypatch.setattr(
+            httpx,
+            "AsyncClient",
+            functools.partial(httpx.AsyncClient, transport=mock),
+        )
+        transport = async_api_requestor.HTTPXTransport()
+        requestor = async_api_requestor.AsyncAPIRequestor(
+            user="a@okchaty.com",
+            token="1",
+            transport=transport,
+        )
+
+        async def request():
+            response = await requestor.request("get", "items/1")
+            return response.status_code, transport.client
+
+        first = asyncio.run(request())
+        second = asyncio.run(request())
+        assert first[0] == second[0] == 200
+        assert first[1] is not second[1]
+
+        async def close():
+            client = transport.client
+            await transport.close()
+            return client
+
+        assert asyncio.run(close()).is_closed
+
+    def test_retries_throttled_requests(self, monkeypatch):
+        responses = [
+            FakeResponse(),
+            FakeResponse(url="https://api.alegra.com/api/v1/taxes/"),
+        ]
+        responses[0].status_code = 429
+        responses[0].headers = {"Retry-After": "0"}
+
+        class QueueTransport:
+            async def request(self, requestor, method, url, **kwargs):
+                return responses.pop(0)
+
+        monkeypatch.setattr(alegra, "retry_backoff", 0)
+        requestor = async_api_requestor.AsyncAPIRequestor(
+            user="throttled@okchaty.com",
+            token="1",
+            transport=QueueTransport(),
+        )
+        response = asyncio.run(requestor.request("post", "taxes/"))
+        assert response.status_code == 200
+        assert responses == []
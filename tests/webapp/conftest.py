@@ -0,0 +1,25 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# The webapp's modules import each other by plain name
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "webapp",
+))
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    """The webapp, imported without Alegra credentials in a scratch dir"""
+    pytest.importorskip("flask")
+    pytest.importorskip("dotenv")
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(tmp_path_factory.mktemp("webapp"))
+        patch.setenv("ALEGRA_USER", "")
+        patch.setenv("ALEGRA_TOKEN", "")
+        patch.setenv("BATCH_MAX_UNCOMPRESSED_MB", "1")
+        patch.setenv("PARSE_WORKERS", "2")
+        module = importlib.import_module("app")
+    return module
@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+
+import pytest
+
+from ai_cache import AICache
+
+ACCOUNTS = [
+    {"id": 5001, "name": "Materiales", "code": "5.1"},
+    {"id": 5002, "name": "Combustible", "code": "5.2"},
+]
+
+
+def invoice_key(text="Factura FE-0042 Cemento gris 1,130.00", **fields):
+    params = dict(kind="invoice", prompt_version=3, model="openai:gpt-4o",
+                  text=text, expense_accounts=ACCOUNTS)
+    params.update(fields)
+    return AICache.key(**params)
+
+
+def entry(size):
+    return {"description": "x" * size}
+
+
+def entry_size(value):
+    return len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return AICache(str(tmp_path / "ai_cache"))
+
+
+class TestKey:
+    def test_same_content_gives_the_same_key(self):
+        assert invoice_key() == invoice_key(
+            expense_accounts=list(reversed(ACCOUNTS)),
+        )
+
+    @pytest.mark.parametrize("field, value", [
+        ("text", "Factura FE-0043 Cemento gris 1,130.00"),
+        ("kind", "categorization"),
+        ("prompt_version", 4),
+        ("model", "anthropic:claude"),
+        ("expense_accounts", ACCOUNTS[:1]),
+    ])
+    def test_anything_that_changes_the_answer_changes_the_key(
+            self, field, value):
+        assert invoice_key(**{field: value}) != invoice_key()
+
+
+class TestAICache:
+    def test_miss_then_hit(self, cache):
+        key = invoice_key()
+        assert cache.get(key) is None
+        cache.set(key, {"invoice_number": "FE-0042", "total": 1130.0})
+        assert cache.get(key) == {"invoice_number": "FE-0042",
+                                  "total": 1130.0}
+        assert cache.get(invoice_key(text="Factura FE-0043")) is None
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 1)
+
+    def test_entries_survive_a_restart(self, cache):
+        cache.set(invoice_key(), {"total": 1130.0})
+        reopened = AICache(cache.directory)
+        assert reopened.get(invoice_key()) == {"total": 1130.0}
+        assert reopened.stats()["bytes"] == cache.stats()["bytes"]
+
+    def test_least_recently_used_entries_are_evicted(self, tmp_path):
+        cache = AICache(str(tmp_path), max_bytes=3 * entry_size(entry(100)))
+        for key in "abc":
+            cache.set(key, entry(100))
+        cache.get("a")
+        cache.set("d", entry(100))
+        assert cache.get("b") is None
+        assert not os.path.exists(os.path.join(str(tmp_path), "b.json"))
+        assert all(cache.get(key) for key in "acd")
+        assert cache.stats()["bytes"] == 3 * entry_size(entry(100))
+
+    def test_overwriting_an_entry_keeps_the_size_right(self, cache):
+        cache.set("a", entry(100))
+        cache.set("a", entry(10))
+        stats = cache.stats()
+        assert (stats["entries"], stats["bytes"]) == (
+            1, entry_size(entry(10)),
+        )
+
+    def test_unreadable_entry_is_a_miss(self, cache):
+        cache.set("a", entry(10))
+        with open(os.path.join(cache.directory, "a.json"), "w") as f:
+            f.write("{truncated")
+        assert cache.get("a") is None
+        assert cache.stats()["entries"] == 0
+
+    def test_clear(self, cache):
+        cache.set("a", entry(10))
+        cache.set("b", entry(10))
+        cache.clear()
+        assert cache.stats()["entries"] == cache.stats()["bytes"] == 0
+        assert os.listdir(cache.directory) == []
+
+    def test_concurrent_writers(self, tmp_path):
+        cache = AICache(str(tmp_path), max_bytes=20 * entry_size(entry(100)))
+        start = threading.Barrier(8)
+
+        def write(writer):
+            start.wait()
+            for n in range(50):
+                # Every writer also races on the shared keys
+                cache.set("shared-%d" % (n % 5), entry(100))
+                cache.set("writer-%d-%d" % (writer, n), entry(100))
+                cache.get("shared-%d" % (n % 5))
+
+        threads = [threading.Thread(target=write, args=(writer,))
+                   for writer in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        files = sorted(os.listdir(str(tmp_path)))
+        assert all(name.endswith(".json") for name in files)
+        stats = cache.stats()
+        assert stats["bytes"] <= stats["max_bytes"]
+        assert stats["entries"] == len(files) == 20
+        assert stats["bytes"] == sum(
+            os.path.getsize(os.path.join(str(tmp_path), name))
+            for name in files
+        )
+        for name in files:
+            assert cache.get(name[:-5]) == entry(100)
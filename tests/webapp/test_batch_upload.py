@@ -0,0 +1,80 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+
+@pytest.fixture
+def uploads(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.app.config, "UPLOAD_FOLDER", str(tmp_path))
+    return tmp_path
+
+
+class Upload:
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.stream = io.BytesIO(data)
+
+
+def archive(entries):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for name, content in entries.items():
+            zip_file.writestr(name, content)
+    return data.getvalue()
+
+
+class TestParseExecutor:
+    def test_workers_start_with_the_app(self, app):
+        # Forked at import, before any background thread could hold a lock
+        assert len(app.parse_executor._processes) == app.PARSE_WORKERS
+        assert app.get_parse_executor().submit(len, "abc").result() == 3
+
+
+class TestPairBatchFiles:
+    def test_pairs_pdf_with_xml_of_the_same_name(self, app):
+        saved = [
+            ("F001.pdf", "/u/1"),
+            ("f001.XML", "/u/2"),
+            ("F002.pdf", "/u/3"),
+            ("F003.xml", "/u/4"),
+        ]
+        assert app.pair_batch_files(saved) == [
+            ("F001.pdf", "/u/1", "/u/2"),
+            ("F002.pdf", "/u/3", None),
+            ("F003.xml", "/u/4", None),
+        ]
+
+
+class TestSaveBatchFiles:
+    def test_expands_archives(self, app, uploads):
+        saved, skipped = app.save_batch_files([
+            Upload("facturas.zip", archive({
+                "F001.pdf": b"%PDF",
+                "__MACOSX/._F001.pdf": b"",
+                "notas.txt": b"hola",
+            })),
+            Upload("F002.xml", b"<xml/>"),
+        ])
+        assert [filename for filename, _ in saved] == ["F001.pdf", "F002.xml"]
+        assert [entry["filename"] for entry in skipped] == ["notas.txt"]
+        assert len(os.listdir(uploads)) == 2
+
+    def test_skips_archives_past_the_uncompressed_cap(self, app, uploads):
+        entries = {"F001.xml": b"0" * 400000, "F002.xml": b"0" * 400000}
+        saved, skipped = app.save_batch_files([
+            Upload("a.zip", archive(entries)),
+            Upload("b.zip", archive(entries)),
+        ])
+        assert len(saved) == 2
+        assert skipped == [{
+            "filename": "b.zip",
+            "error": "El lote supera 1 MB descomprimidos",
+        }]
+        assert len(os.listdir(uploads)) == 2
+
+    def test_invalid_archive(self, app, uploads):
+        saved, skipped = app.save_batch_files([Upload("a.zip", b"not a zip")])
+        assert saved == []
+        assert skipped[0]["error"] == "Archivo ZIP inválido"
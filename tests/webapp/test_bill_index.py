@@ -0,0 +1,136 @@
+import alegra
+import pytest
+
+from bill_index import BillIndex, bill_key
+
+
+def bill(bill_id, number, total, identification="3101123456",
+         provider_id="5", status="open"):
+    provider = {"id": provider_id}
+    if identification:
+        provider["identification"] = identification
+    return {
+        "id": str(bill_id),
+        "numberTemplate": {"number": number, "fullNumber": "F-" + number},
+        "total": total,
+        "date": "2025-05-24",
+        "status": status,
+        "provider": provider,
+    }
+
+
+@pytest.fixture
+def alegra_bills(monkeypatch):
+    bills = [
+        bill(3, "00100001010000000123", 1130.0),
+        bill(2, "42", 500.0, identification=None),
+        bill(1, "41", 200.0, status="void"),
+    ]
+    monkeypatch.setattr(alegra.Bill, "list_all", lambda: list(bills))
+    monkeypatch.setattr(
+        alegra.Bill,
+        "list_iter",
+        lambda **kwargs: iter(sorted(
+            bills, key=lambda b: int(b["id"]), reverse=True,
+        )),
+    )
+    return bills
+
+
+class TestBillKey:
+    def test_normalizes_vendor_number_and_amount(self):
+        assert bill_key("3-101-123456", "FE-0042", "1130.40") == (
+            "3101123456", "FE42", 1130,
+        )
+        assert bill_key("3101123456", "fe 42", 1129.6) == \
+            bill_key("3-101-123456", "FE-0042", 1130)
+
+    def test_needs_every_field(self):
+        assert bill_key("", "42", 10) is None
+        assert bill_key("3101123456", "", 10) is None
+        assert bill_key("3101123456", "42", "n/a") is None
+
+
+class TestBillIndex:
+    def test_warm_indexes_open_bills(self, alegra_bills):
+        index = BillIndex(resolve_identification=lambda provider_id: "")
+        index.warm()
+        found = index.find("3-101-123456", "100001010000000123", 1130.4)
+        assert found["id"] == "3" and found["source"] == "alegra"
+        assert index.find("3101123456", "F-00100001010000000123", 1130)
+        assert index.find("3101123456", "41", 200) is None
+
+    def test_resolves_provider_identification(self, alegra_bills):
+        resolved = []
+
+        def resolve(provider_id):
+            resolved.append(provider_id)
+            return "109870654"
+
+        index = BillIndex(resolve_identification=resolve)
+        index.warm()
+        assert resolved == ["5"]
+        assert index.find("109870654", "42", 500)["id"] == "2"
+
+    def test_waits_for_identifications_once_per_scan(self, alegra_bills):
+        waits = []
+
+        def wait_ready(timeout):
+            waits.append(timeout)
+            return True
+
+        index = BillIndex(wait_ready=wait_ready, ready_timeout=5)
+        index.warm()
+        index.refresh()
+        assert waits == [5, 5]
+
+    def test_refresh_stops_at_high_water(self, alegra_bills):
+        index = BillIndex()
+        index.warm()
+        # Bills the app added itself do not stop the scan
+        index.add("3101123456", "44", 300, 5)
+        alegra_bills.extend([bill(4, "43", 100.0), bill(5, "44", 300.0)])
+        assert index.refresh() == 2
+        assert index.find("3101123456", "43", 100)["id"] == "4"
+        assert index.refresh() == 0
+
+    def test_full_refresh_drops_voided_bills(self, alegra_bills):
+        index = BillIndex()
+        index.seed([{
+            "vendor_id": "3101123456",
+            "invoice_number": "40",
+            "total": "90.00",
+            "bill_id": "0",
+            "date": "",
+        }])
+        index.warm()
+        alegra_bills[0]["status"] = "void"
+        index.warm()
+        assert index.find("3101123456", "100001010000000123", 1130) is None
+        # Ledger entries older than the listing that Alegra no longer has
+        assert index.find("3101123456", "40", 90) is None
+
+    def test_full_refresh_keeps_bills_added_while_listing(
+            self, alegra_bills, monkeypatch):
+        index = BillIndex()
+
+        def list_all():
+            index.add("3101123456", "45", 250, 9)
+            return list(alegra_bills)
+
+        monkeypatch.setattr(alegra.Bill, "list_all", list_all)
+        index.warm()
+        assert index.find("3101123456", "45", 250)["id"] == "9"
+        assert index.find("3101123456", "100001010000000123", 1130)
+
+    def test_seed_from_ledger(self):
+        index = BillIndex()
+        assert index.seed([{
+            "vendor_id": "3101123456",
+            "invoice_number": "FE-0042",
+            "total": "1130.00",
+            "bill_id": "77",
+            "date": "",
+        }]) == 1
+        assert index.find("3101123456", "FE42", 1130)["source"] == "ledger"
+        assert len(index) == 1
@@ -0,0 +1,217 @@
+import alegra
+import pytest
+
+from bill_index import BillIndex
+from category_memory import CategoryMemory
+from submission_ledger import SubmissionLedger
+import submission_ledger as ledger
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+        self.text = "Bad Gateway"
+
+    def json(self):
+        raise ValueError("No JSON object could be decoded")
+
+
+class Created:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeAlegra:
+    """Alegra's bill and payment endpoints
+
+    Outcomes are set per invoice number: an exception to raise, an HTTP
+    status to answer with, or nothing for success.
+    """
+
+    def __init__(self, store):
+        self.ledger = store
+        self.bills = {}
+        self.payments = {}
+        self.posted = []
+
+    def answer(self, kind, number):
+        self.posted.append((kind, number))
+        outcome = getattr(self, kind).pop(number, None)
+        if isinstance(outcome, Exception):
+            raise outcome
+        if isinstance(outcome, int):
+            raise alegra.AlegraError(
+                "Alegra error", response=FakeResponse(outcome),
+            )
+        return Created({
+            "id": 77,
+            "total": 1130.0,
+            "amount": 1130.0,
+            "numberTemplate": {"fullNumber": number},
+        })
+
+    def create_bill(self, **data):
+        return self.answer("bills", data["billNumber"])
+
+    def create_payment(self, **data):
+        return self.answer("payments", data["observations"].split()[-1])
+
+
+def bill_request(number="FE-0042", **fields):
+    data = {
+        "vendorId": "3-101-123456",
+        "contactId": "5",
+        "invoiceNumber": number,
+        "amount": 1130.0,
+        "date": "2025-05-24",
+        "createPayment": False,
+    }
+    data.update(fields)
+    return data
+
+
+@pytest.fixture
+def alegra_api(app, tmp_path, monkeypatch):
+    fake = FakeAlegra(SubmissionLedger(str(tmp_path / "submissions.db")))
+    monkeypatch.setattr(app, "submission_ledger", fake.ledger)
+    monkeypatch.setattr(app, "bill_index", BillIndex())
+    monkeypatch.setattr(app, "category_memory",
+                        CategoryMemory(str(tmp_path / "memory.json")))
+    monkeypatch.setattr(
+        app,
+        "build_purchase_data",
+        lambda data, refs: ({"billNumber": data["invoiceNumber"]}, [
+            {"description": "Cemento gris", "account_id": "5001"},
+        ]),
+    )
+    monkeypatch.setattr(alegra.Bill, "create", fake.create_bill)
+    monkeypatch.setattr(alegra.Payment, "create", fake.create_payment)
+    return fake
+
+
+def submission_state(store, number="FE-0042"):
+    entry = next(entry for entry in store.list()
+                 if entry["invoice_number"] ==
+                 ledger.normalize_invoice_number(number))
+    return entry["state"]
+
+
+def can_claim(store, number):
+    store.stale_after = 300
+    return store.claim(ledger.submission_key("3101123456", number, 1130))[1]
+
+
+class TestSubmitBill:
+    def test_gateway_error_leaves_the_bill_unknown(self, app, alegra_api):
+        alegra_api.bills["FE-0042"] = 502
+        response, status = app.submit_bill(bill_request(), refs={})
+        assert status == 502
+        assert submission_state(alegra_api.ledger) == ledger.UNKNOWN
+        # The bill may exist in Alegra, so it is not posted again
+        response, status = app.submit_bill(bill_request(), refs={})
+        assert status == 409
+        assert len(alegra_api.posted) == 1
+
+    def test_client_error_can_be_submitted_again(self, app, alegra_api):
+        alegra_api.bills["FE-0042"] = 400
+        response, status = app.submit_bill(bill_request(), refs={})
+        assert status == 400
+        assert submission_state(alegra_api.ledger) == ledger.BILL_FAILED
+        response, status = app.submit_bill(bill_request(), refs={})
+        assert status == 200
+        assert response["bill"]["id"] == 77
+        assert len(alegra_api.posted) == 2
+
+    def test_timeout_leaves_the_bill_unknown(self, app, alegra_api):
+        alegra_api.bills["FE-0042"] = TimeoutError("read timed out")
+        with pytest.raises(TimeoutError):
+            app.submit_bill(bill_request(), refs={})
+        assert submission_state(alegra_api.ledger) == ledger.UNKNOWN
+        assert not can_claim(alegra_api.ledger, "FE-0042")
+
+    def test_registered_invoice_is_answered_from_the_ledger(
+            self, app, alegra_api):
+        assert app.submit_bill(bill_request(), refs={})[1] == 200
+        response, status = app.submit_bill(
+            bill_request(number="fe 42"), refs={},
+        )
+        assert status == 200 and response["duplicate"]
+        assert len(alegra_api.posted) == 1
+
+    def test_categories_are_remembered_for_the_resolved_vendor(
+            self, app, alegra_api, monkeypatch):
+        monkeypatch.setattr(
+            app.contact_index,
+            "find_by_id",
+            lambda contact_id: {"id": "5", "identification": "3101123456"},
+        )
+        data = bill_request()
+        del data["vendorId"]
+        assert app.submit_bill(data, refs={})[1] == 200
+        category = app.category_memory.lookup("3101123456", "Cemento gris")
+        assert category["account_id"] == "5001"
+
+
+class TestRegisterPaymentsBatch:
+    @pytest.fixture
+    def client(self, app, alegra_api, monkeypatch):
+        monkeypatch.setattr(app, "resolve_bill_references",
+                            lambda headers: {})
+        return app.app.test_client()
+
+    def post(self, client, bills):
+        response = client.post("/api/payments/register/batch",
+                               json={"bills": bills})
+        return response.status_code, response.get_json()
+
+    def test_partial_failures(self, client, alegra_api):
+        alegra_api.bills.update({"2": 400, "3": 502})
+        status, body = self.post(client, [
+            bill_request(number=str(n)) for n in range(1, 5)
+        ])
+        assert status == 200
+        assert not body["success"]
+        assert (body["registered"], body["failed"]) == (2, 2)
+        assert [(result["index"], result["status"], result["success"])
+                for result in body["results"]] == [
+            (0, 200, True), (1, 400, False), (2, 502, False), (3, 200, True),
+        ]
+
+    def test_ledger_state_per_bill(self, client, alegra_api):
+        alegra_api.bills.update({"2": 400, "3": 502})
+        self.post(client, [bill_request(number=str(n)) for n in range(1, 4)])
+        store = alegra_api.ledger
+        assert submission_state(store, "1") == ledger.COMPLETED
+        assert submission_state(store, "2") == ledger.BILL_FAILED
+        assert submission_state(store, "3") == ledger.UNKNOWN
+        assert can_claim(store, "2")
+        assert not can_claim(store, "3")
+
+    def test_retried_batch_skips_registered_and_unknown_bills(
+            self, client, alegra_api):
+        alegra_api.bills.update({"2": 400, "3": 502})
+        bills = [bill_request(number=str(n)) for n in range(1, 4)]
+        self.post(client, bills)
+        status, body = self.post(client, bills)
+        assert [(result["status"], result.get("duplicate"))
+                for result in body["results"]] == [
+            (200, True), (200, None), (409, None),
+        ]
+        assert sorted(number for _, number in alegra_api.posted) == [
+            "1", "2", "2", "3",
+        ]
+
+    def test_payment_gateway_error_stays_unknown(self, client, alegra_api):
+        alegra_api.payments["FE-0042"] = 504
+        status, body = self.post(client, [
+            bill_request(createPayment=True, paymentMethod="transfer"),
+        ])
+        result = body["results"][0]
+        assert result["status"] == 200 and result["paymentPending"]
+        assert submission_state(alegra_api.ledger) == ledger.PAYMENT_UNKNOWN
+
+    def test_rejects_bad_batches(self, client, app, monkeypatch):
+        assert self.post(client, [])[0] == 400
+        monkeypatch.setattr(app, "BILL_BATCH_MAX", 1)
+        assert self.post(client, [bill_request(), bill_request()])[0] == 400
@@ -0,0 +1,114 @@
+import pytest
+
+from category_memory import CategoryMemory, normalize_description
+
+VENDOR = "3-101-123456"
+
+
+@pytest.fixture
+def memory(tmp_path):
+    memory = CategoryMemory(str(tmp_path / "memory.json"))
+    memory.record(VENDOR, [
+        {"description": "Cemento gris 50kg", "account_id": "5001",
+         "has_tax": True, "tax_percentage": 13},
+        {"description": "Transporte", "account_id": "5003",
+         "tax_percentage": 0},
+        {"description": "Sin cuenta"},
+    ])
+    return memory
+
+
+class TestCategoryMemory:
+    def test_normalize_description(self):
+        assert normalize_description("CEMENTO Gris 50kg.") == "cemento gris kg"
+        assert normalize_description("Ñandú #3") == "nandu"
+
+    def test_exact_match(self, memory):
+        assert memory.lookup("3101123456", "cemento GRIS 25kg") == {
+            "account_id": "5001",
+            "tax_percentage": 13.0,
+            "has_tax": True,
+        }
+        assert memory.lookup("3101123456", "Transporte")["has_tax"] is False
+
+    def test_fuzzy_match(self, memory):
+        assert memory.lookup(VENDOR, "Cementos gris kg")["account_id"] == "5001"
+        assert memory.lookup(VENDOR, "Cemento blanco") is None
+        assert memory.stats()["fuzzy_hits"] == 1
+
+    def test_categories_are_per_vendor(self, memory):
+        assert memory.lookup("109870654", "Transporte") is None
+        assert memory.stats()["descriptions"] == 2
+
+    def test_most_frequent_choice_wins(self, memory):
+        for _ in range(2):
+            memory.record(VENDOR, [
+                {"description": "Transporte", "account_id": "5004"},
+            ])
+        assert memory.lookup(VENDOR, "Transporte")["account_id"] == "5004"
+
+    def test_apply_returns_unmatched_lines(self, memory):
+        lines = [
+            {"description": "Cemento gris 50kg"},
+            {"description": "Arena"},
+        ]
+        assert memory.apply(VENDOR, lines) == [lines[1]]
+        assert lines[0]["account_id"] == "5001"
+        assert lines[0]["category_source"] == "memory"
+        assert "account_id" not in lines[1]
+        assert memory.apply(None, lines[1:]) == lines[1:]
+
+    def test_find_vendor_in_text(self, memory):
+        text = "Ferretería\nCédula Jurídica 3-101-123456\nFactura 12"
+        assert memory.find_vendor(text) == "3101123456"
+        assert memory.find_vendor("Cédula 109870654") is None
+
+    def test_reloads_from_disk(self, memory):
+        reloaded = CategoryMemory(memory.path)
+        assert reloaded.lookup(VENDOR, "Transporte")["account_id"] == "5003"
+        memory.clear()
+        assert CategoryMemory(memory.path).stats()["vendors"] == 0
+
+
+class TestXMLCategorization:
+    @pytest.fixture
+    def ai_calls(self, app, memory, monkeypatch):
+        calls = []
+        monkeypatch.setattr(app, "category_memory", memory)
+        monkeypatch.setattr(app, "is_ai_configured", lambda: True)
+        monkeypatch.setattr(app, "get_expense_accounts_for_ai", lambda: [])
+        monkeypatch.setattr(
+            app,
+            "categorize_line_items_with_ai",
+            lambda items, accounts: calls.append(items),
+        )
+        return calls
+
+    def process(self, app):
+        document = {"is_xml": True, "xml_data": {
+            "vendor_name": "Distribuidora Acme",
+            "vendor_id": "3101123456",
+            "client_name": "",
+            "client_id": "",
+            "invoice_number": "00100001010000000123",
+            "date": "2025-05-24",
+            "total": 1130.0,
+            "document_type": "factura",
+            "line_items": [
+                {"description": "Cemento gris 50kg", "amount": 500.0},
+                {"description": "Arena", "amount": 500.0},
+            ],
+        }}
+        return app.process_invoice_file("F001.xml", "F001.xml", document)
+
+    def test_xml_lines_use_memory_only(self, app, ai_calls):
+        lines = self.process(app)["line_items"]
+        assert lines[0]["account_id"] == "5001"
+        assert "account_id" not in lines[1]
+        assert ai_calls == []
+
+    def test_flag_enables_ai_for_xml_lines(self, app, ai_calls, monkeypatch):
+        monkeypatch.setattr(app, "XML_AI_CATEGORIZATION", True)
+        self.process(app)
+        assert [[line["description"] for line in lines]
+                for lines in ai_calls] == [["Arena"]]
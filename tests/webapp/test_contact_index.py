@@ -0,0 +1,84 @@
+import alegra
+import pytest
+
+from contact_index import ContactIndex, normalize_identification, name_tokens
+
+
+def contact(contact_id, name, identification):
+    return {
+        "id": str(contact_id),
+        "name": name,
+        "identification": {"number": identification},
+    }
+
+
+@pytest.fixture
+def alegra_contacts(monkeypatch):
+    contacts = [
+        contact(3, "Distribuidora Ácme S.A.", "3-101-123456"),
+        contact(2, "Ferretería El Clavo", "109870654"),
+        contact(1, "Acme Servicios", "3101654321"),
+    ]
+    monkeypatch.setattr(alegra.Contact, "list_all", lambda: list(contacts))
+    monkeypatch.setattr(
+        alegra.Contact,
+        "list_iter",
+        lambda **kwargs: iter(sorted(
+            contacts, key=lambda c: int(c["id"]), reverse=True,
+        )),
+    )
+    return contacts
+
+
+class TestHelpers:
+    def test_normalize_identification(self):
+        assert normalize_identification(" 3-101-123.456 ") == "3101123456"
+
+    def test_name_tokens_fold_accents(self):
+        assert name_tokens("Ferretería El-Clavo") == [
+            "ferreteria", "el", "clavo",
+        ]
+
+
+class TestContactIndex:
+    def test_find_by_identification(self, alegra_contacts):
+        index = ContactIndex()
+        index.warm()
+        assert index.ready
+        assert len(index) == 3
+        assert index.find_by_identification("3101123456")["id"] == "3"
+        assert index.find_by_identification("3-101-123456")["id"] == "3"
+
+    def test_search_by_name_prefix(self, alegra_contacts):
+        index = ContactIndex()
+        index.warm()
+        assert [c["id"] for c in index.search("acm")] == ["1", "3"]
+        assert [c["id"] for c in index.search("dist acme")] == ["3"]
+        assert index.search("109870654")[0]["id"] == "2"
+
+    def test_upsert_replaces_name_tokens(self, alegra_contacts):
+        index = ContactIndex()
+        index.warm()
+        index.upsert(contact(2, "Clavos Unidos", "109870654"))
+        assert index.search("ferreteria") == []
+        assert index.search("clavos")[0]["id"] == "2"
+
+    def test_refresh_stops_at_high_water(self, alegra_contacts):
+        index = ContactIndex()
+        index.warm()
+        # Contacts the app upserted itself do not stop the scan
+        index.upsert(contact(5, "Creado por la app", "111111111"))
+        alegra_contacts.append(contact(4, "Creado en Alegra", "222222222"))
+        alegra_contacts.append(contact(5, "Creado por la app", "111111111"))
+        assert index.refresh() == 2
+        assert index.find_by_id(4)["name"] == "Creado en Alegra"
+        assert index.refresh() == 0
+
+    def test_miss_refreshes_once(self, alegra_contacts):
+        index = ContactIndex(miss_refresh_interval=3600)
+        index.warm()
+        index.invalidate()
+        alegra_contacts.append(contact(4, "Nuevo", "333333333"))
+        assert index.find_by_identification("333333333")["id"] == "4"
+        alegra_contacts.append(contact(6, "Otro", "444444444"))
+        assert index.find_by_identification("444444444") is None
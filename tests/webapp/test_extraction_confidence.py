@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+
+from extraction_confidence import (
+    ExtractionMetrics,
+    is_plausible_date,
+    is_valid_cedula,
+    score_extraction,
+)
+
+# The default HYBRID_CONFIDENCE_THRESHOLD of the app
+THRESHOLD = 0.8
+
+
+def extraction(**fields):
+    data = {
+        "vendor_id": "3101123456",
+        "vendor_name": "Distribuidora Acme",
+        "invoice_number": "00100001010000000123",
+        "date": datetime.now().strftime("%Y-%m-%d"),
+        "total": 1130.0,
+    }
+    data.update(fields)
+    return data
+
+
+LINES = [
+    {"amount": 500.0, "has_tax": True, "tax_percentage": 13},
+    {"amount": 500.0, "has_tax": True, "tax_percentage": 13},
+]
+
+
+class TestChecks:
+    def test_cedulas(self):
+        assert is_valid_cedula("109870654")
+        assert is_valid_cedula("3-101-123456")
+        assert is_valid_cedula("155812345678")
+        assert not is_valid_cedula("012345678")
+        assert not is_valid_cedula("5101123456")
+        assert not is_valid_cedula("ELECTRONICA")
+        assert not is_valid_cedula(None)
+
+    def test_dates(self):
+        today = datetime.now()
+        assert is_plausible_date(today.strftime("%Y-%m-%d"))
+        assert not is_plausible_date(
+            (today + timedelta(days=3)).strftime("%Y-%m-%d"),
+        )
+        assert not is_plausible_date(
+            (today - timedelta(days=500)).strftime("%Y-%m-%d"),
+        )
+        assert not is_plausible_date("")
+        assert not is_plausible_date("24/05/2025")
+
+
+class TestScoreExtraction:
+    def test_complete_extraction(self):
+        assert score_extraction(extraction()) == (1.0, [])
+        assert score_extraction(extraction(), LINES) == (1.0, [])
+
+    def test_missing_date_fails_its_check(self):
+        score, failed = score_extraction(extraction(date=""))
+        assert failed == ["date"]
+        assert score == 0.889
+
+    def test_missing_identifiers_fall_below_threshold(self):
+        for fields in (
+            {"vendor_id": ""},
+            {"total": 0},
+            {"invoice_number": "ELECTRONICA", "vendor_name": ""},
+        ):
+            score, failed = score_extraction(extraction(**fields))
+            assert score < THRESHOLD
+            assert failed
+
+    def test_line_totals_are_a_hard_check(self):
+        lines = LINES[:1]
+        assert score_extraction(extraction(), lines) == (0.0, ["line_totals"])
+
+    def test_line_totals_tolerance(self):
+        assert score_extraction(extraction(total=1150.0), LINES)[0] == 1.0
+        assert score_extraction(extraction(total=1160.0), LINES)[0] == 0.0
+
+
+class TestExtractionMetrics:
+    def test_escalation_rate(self):
+        metrics = ExtractionMetrics()
+        metrics.record("xml")
+        metrics.record("regex", gated=True)
+        metrics.record("ai", gated=True, escalated=True, reasons=["date"])
+        snapshot = metrics.snapshot()
+        assert snapshot["methods"] == {"xml": 1, "regex": 1, "ai": 1}
+        assert snapshot["escalation_rate"] == 0.5
+        assert snapshot["escalation_reasons"] == {"date": 1}
@@ -0,0 +1,122 @@
+import io
+
+from hacienda_xml import parse_hacienda_xml
+
+V44 = "https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/"
+V42 = "https://tribunet.hacienda.go.cr/docs/esquemas/2017/v4.2/"
+
+LINE = """
+    <LineaDetalle>
+      <NumeroLinea>{number}</NumeroLinea>
+      <Cantidad>2</Cantidad>
+      <Detalle>{description}</Detalle>
+      <PrecioUnitario>50.00</PrecioUnitario>
+      <SubTotal>100.00</SubTotal>
+      <Descuento><MontoDescuento>10.00</MontoDescuento></Descuento>
+      <Impuesto><Codigo>01</Codigo><Tarifa>13.00</Tarifa><Monto>11.70</Monto></Impuesto>
+    </LineaDetalle>"""
+
+
+def comprobante(namespace, root, total="203.40", lines=2):
+    return """<?xml version="1.0" encoding="utf-8"?>
+<{root} xmlns="{namespace}{root}">
+  <Clave>50624052500310112345600100001010000000123100000001</Clave>
+  <NumeroConsecutivo>00100001010000000123</NumeroConsecutivo>
+  <FechaEmision>2025-05-24T03:31:13.000-06:00</FechaEmision>
+  <Emisor>
+    <Nombre>Distribuidora Acme</Nombre>
+    <Identificacion><Tipo>02</Tipo><Numero>3101123456</Numero></Identificacion>
+  </Emisor>
+  <Receptor>
+    <Nombre>Cliente SA</Nombre>
+    <Identificacion><Tipo>02</Tipo><Numero>3101654321</Numero></Identificacion>
+  </Receptor>
+  <DetalleServicio>{lines}
+  </DetalleServicio>
+  <ResumenFactura><TotalComprobante>{total}</TotalComprobante></ResumenFactura>
+</{root}>""".format(
+        namespace=namespace,
+        root=root,
+        total=total,
+        lines="".join(
+            LINE.format(number=i, description="Producto %d" % i)
+            for i in range(1, lines + 1)
+        ),
+    ).encode("utf-8")
+
+
+def parse(data):
+    return parse_hacienda_xml(io.BytesIO(data))
+
+
+class TestComprobantes:
+    def test_factura(self):
+        invoice = parse(comprobante(V44, "FacturaElectronica"))
+        assert invoice["document_type"] == "factura"
+        assert invoice["version"] == "4.4"
+        assert invoice["vendor_name"] == "Distribuidora Acme"
+        assert invoice["vendor_id"] == "3101123456"
+        assert invoice["client_id"] == "3101654321"
+        assert invoice["invoice_number"] == "00100001010000000123"
+        assert invoice["date"] == "2025-05-24"
+        assert invoice["total"] == 203.40
+        assert [item["description"] for item in invoice["line_items"]] == [
+            "Producto 1", "Producto 2",
+        ]
+        item = invoice["line_items"][0]
+        assert item["quantity"] == 2
+        assert item["amount"] == 90.0
+        assert item["has_tax"] and item["tax_percentage"] == 13.0
+        assert item["taxes"] == [{"rate": 13.0, "amount": 11.70}]
+
+    def test_v42_namespace(self):
+        invoice = parse(comprobante(V42, "FacturaElectronica"))
+        assert invoice["version"] == "4.2"
+        assert invoice["vendor_id"] == "3101123456"
+
+    def test_purchase_invoice_swaps_vendor_and_client(self):
+        invoice = parse(comprobante(V44, "FacturaElectronicaCompra"))
+        assert invoice["document_type"] == "factura_compra"
+        assert invoice["vendor_id"] == "3101654321"
+        assert invoice["client_id"] == "3101123456"
+
+    def test_total_from_lines_when_missing(self):
+        invoice = parse(comprobante(V44, "TiqueteElectronico", total="0"))
+        assert invoice["document_type"] == "tiquete"
+        assert round(invoice["total"], 2) == 203.40
+
+    def test_many_lines(self):
+        invoice = parse(comprobante(V44, "FacturaElectronica", lines=500))
+        assert len(invoice["line_items"]) == 500
+        assert invoice["line_items"][-1]["line_number"] == "500"
+
+
+class TestMensajeReceptor:
+    def mensaje(self, key):
+        return """<?xml version="1.0" encoding="utf-8"?>
+<MensajeReceptor xmlns="{}mensajeReceptor">
+  <Clave>{}</Clave>
+  <NumeroCedulaEmisor>3101123456</NumeroCedulaEmisor>
+  <FechaEmisionDoc>2025-05-24T03:31:13-06:00</FechaEmisionDoc>
+  <Mensaje>1</Mensaje>
+  <TotalFactura>203.40</TotalFactura>
+  <NumeroCedulaReceptor>3101654321</NumeroCedulaReceptor>
+</MensajeReceptor>""".format(V44, key).encode("utf-8")
+
+    def test_invoice_number_is_the_consecutive_in_the_key(self):
+        # Country (3), date (6), issuer id (12), consecutive (20),
+        # situation (1), security code (8)
+        key = "506" + "240525" + "003101123456" + "00100001010000000123" \
+            + "1" + "00000001"
+        assert len(key) == 50
+        invoice = parse(self.mensaje(key))
+        assert invoice["document_type"] == "mensaje_receptor"
+        assert invoice["invoice_number"] == "00100001010000000123"
+        assert invoice["vendor_id"] == "3101123456"
+        assert invoice["client_id"] == "3101654321"
+        assert invoice["date"] == "2025-05-24"
+        assert invoice["total"] == 203.40
+        assert invoice["line_items"] == []
+
+    def test_malformed_key(self):
+        assert parse(self.mensaje("123"))["invoice_number"] == ""
@@ -0,0 +1,89 @@
+import pytest
+
+invoice_parser = pytest.importorskip("invoice_parser")
+
+from tests.webapp.test_hacienda_xml import V44, comprobante
+
+RESPONSE = """<?xml version="1.0" encoding="utf-8"?>
+<MensajeHacienda xmlns="{}mensajeHacienda">
+  <Clave>50624052500310112345600100001010000000123100000001</Clave>
+  <TotalFactura>203.40</TotalFactura>
+</MensajeHacienda>""".format(V44).encode("utf-8")
+
+
+class FakeExtractor:
+    def __init__(self):
+        self.calls = 0
+
+    def extract(self, pdf_path):
+        self.calls += 1
+        return "Factura 123"
+
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    attachments = []
+    monkeypatch.setattr(
+        invoice_parser, "extract_attachments", lambda path: attachments,
+    )
+    pdf = tmp_path / "F001.pdf"
+    pdf.write_bytes(b"%PDF")
+    xml = tmp_path / "F001.xml"
+    xml.write_bytes(comprobante(V44, "FacturaElectronica"))
+    return str(pdf), str(xml), attachments
+
+
+class TestParseInvoiceFile:
+    def test_xml_file(self, files):
+        pdf, xml, attachments = files
+        document = invoice_parser.parse_invoice_file(xml, "F001.xml")
+        assert document["is_xml"]
+        assert document["xml_data"]["invoice_number"] == "00100001010000000123"
+
+    def test_pdf_with_xml_skips_text_extraction(self, files):
+        pdf, xml, attachments = files
+        extractor = FakeExtractor()
+        document = invoice_parser.parse_invoice_file(
+            pdf, "F001.pdf", extractor, xml_path=xml,
+        )
+        assert document["xml_source"] == "file"
+        assert document["xml_data"]["vendor_id"] == "3101123456"
+        assert document["text"] == ""
+        assert extractor.calls == 0
+
+    def test_attached_xml_skips_hacienda_response(self, files):
+        pdf, xml, attachments = files
+        with open(xml, "rb") as f:
+            attachments.extend([
+                ("respuesta.xml", RESPONSE),
+                ("factura.xml", f.read()),
+            ])
+        document = invoice_parser.parse_invoice_file(
+            pdf, "F001.pdf", FakeExtractor(),
+        )
+        assert document["xml_source"] == "attachment"
+        assert document["xml_data"]["document_type"] == "factura"
+
+    def test_pdf_without_xml(self, files):
+        pdf, xml, attachments = files
+        attachments.append(("respuesta.xml", RESPONSE))
+        document = invoice_parser.parse_invoice_file(
+            pdf, "F001.pdf", FakeExtractor(),
+        )
+        assert document["xml_data"] is None
+        assert document["xml_source"] is None
+        assert document["text"] == "Factura 123"
+
+    def test_incomplete_xml_extracts_text(self, files, tmp_path):
+        pdf, xml, attachments = files
+        xml = tmp_path / "F002.xml"
+        xml.write_bytes(comprobante(V44, "FacturaElectronica", lines=0))
+        extractor = FakeExtractor()
+        document = invoice_parser.parse_invoice_file(
+            pdf, "F001.pdf", extractor, xml_path=str(xml),
+        )
+        assert invoice_parser.missing_xml_fields(document["xml_data"]) == [
+            "line_items",
+        ]
+        assert document["text"] == "Factura 123"
+        assert extractor.calls == 1
@@ -0,0 +1,88 @@
+import re
+
+from invoice_regex import (
+    FIELD_PATTERNS,
+    FLAGS,
+    extract_invoice_data,
+    normalize_date,
+    scanner,
+)
+
+INVOICE = """DISTRIBUIDORA ACME S.A.
+Cédula Jurídica: 3-101-123456
+Factura: FE-0042
+Fecha: 24/05/2025
+Descripción            Total
+Producto 1             1,000.00
+Total a pagar: ₡ 15,000.50
+"""
+
+
+def reference_scan(text):
+    """Scan with the case-insensitive patterns, one at a time"""
+    values = {}
+    for field, patterns in FIELD_PATTERNS.items():
+        if field == "known_vendor" and "vendor_name" in values:
+            continue
+        for pattern in patterns:
+            match = re.search(pattern, text, FLAGS)
+            if not match:
+                continue
+            value = match.group(1).strip()
+            digits = value.replace("-", "")
+            if field == "invoice_number" and digits.isdigit() \
+                    and len(digits) >= 9:
+                continue
+            values[field] = value
+            break
+    return values
+
+
+class TestScanner:
+    def test_matches_case_insensitive_patterns(self):
+        texts = [
+            INVOICE,
+            INVOICE.upper(),
+            "PROVEEDOR: Ferretería El Clavo\nNo. de documento 000123\n",
+            "WALMART\nTOTAL 1,234.56\n15/1/25\n",
+            # "İ" lowercases to two characters
+            "İ Proveedor: Ferretería\nFactura 77\n",
+        ]
+        for text in texts:
+            assert scanner.scan(text) == reference_scan(text)
+
+    def test_values_keep_their_case(self):
+        assert scanner.scan(INVOICE.replace("FE-0042", "Fe-0042"))[
+            "invoice_number"
+        ] == "Fe-0042"
+
+    def test_skips_invoice_numbers_that_look_like_cedulas(self):
+        text = "Factura: 3101123456\nDocumento: A-77\n"
+        assert scanner.scan(text)["invoice_number"] == "A-77"
+
+    def test_known_vendor_only_without_a_label(self):
+        assert extract_invoice_data("Walmart\nTotal 10")["vendor_name"] == \
+            "WALMART"
+        data = extract_invoice_data("Proveedor: Acme\nWalmart\nTotal 10")
+        assert data["vendor_name"] == "Acme"
+
+
+class TestExtractInvoiceData:
+    def test_fields(self):
+        data = extract_invoice_data(INVOICE)
+        assert data["vendor_id"] == "3101123456"
+        assert data["invoice_number"] == "FE-0042"
+        assert data["date"] == "2025-05-24"
+        assert data["total"] == data["amount"] == 15000.50
+
+    def test_missing_date_stays_empty(self):
+        assert extract_invoice_data("Factura 12\nTotal 10")["date"] == ""
+
+
+class TestNormalizeDate:
+    def test_formats(self):
+        assert normalize_date("4/5/25") == "2025-05-04"
+        assert normalize_date("24/05/2025") == "2025-05-24"
+        assert normalize_date("") == ""
+        assert normalize_date(None) == ""
+        assert normalize_date("24/05") == ""
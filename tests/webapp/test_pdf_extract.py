@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pdf_extract = pytest.importorskip("pdf_extract")
+
+HEADER = "Factura electrónica N° 00100001010000000123\n"
+TOTALS = "Total comprobante: 1,130.00\n"
+
+
+class FakePage:
+    def __init__(self, text):
+        self.text = text
+
+    def extract_text(self):
+        return self.text
+
+
+@pytest.fixture
+def pdf(monkeypatch, tmp_path):
+    """A PDF whose pages are the texts in the returned list"""
+    texts = []
+    reads = []
+
+    class FakeReader:
+        def __init__(self, file):
+            self.pages = [FakePage(text) for text in texts]
+
+    def read(page):
+        reads.append(page.text)
+        return page.text
+
+    monkeypatch.setattr(pdf_extract.PyPDF2, "PdfReader", FakeReader)
+    monkeypatch.setattr(FakePage, "extract_text", read)
+    path = tmp_path / "factura.pdf"
+    path.write_bytes(b"%PDF")
+    return str(path), texts, reads
+
+
+class TestHeaderTotalsScan:
+    def test_needs_header_and_totals(self):
+        scan = pdf_extract.HeaderTotalsScan()
+        assert not scan.add(HEADER)
+        assert scan.seen_header and not scan.seen_totals
+        assert not scan.add("Línea 1  Total 100.00\n")
+        assert scan.add(TOTALS)
+
+    def test_match_across_page_break(self):
+        scan = pdf_extract.HeaderTotalsScan()
+        assert not scan.add(HEADER + "Total ")
+        assert scan.add("comprobante: 5.00")
+
+
+class TestPDFTextExtractor:
+    def test_serial_stops_after_header_and_totals(self, pdf):
+        path, texts, reads = pdf
+        texts.extend([HEADER, "Líneas\n", TOTALS, "Anexo\n", "Anexo\n"])
+        assert pdf_extract.PDFTextExtractor().extract(path) == (
+            HEADER + "Líneas\n" + TOTALS
+        )
+        assert len(reads) == 3
+
+    def test_serial_reads_every_page_without_stop(self, pdf):
+        path, texts, reads = pdf
+        texts.extend([HEADER, TOTALS, "Anexo\n"])
+        extractor = pdf_extract.PDFTextExtractor(stop_when=None)
+        assert extractor.extract(path) == HEADER + TOTALS + "Anexo\n"
+
+    def test_max_pages(self, pdf):
+        path, texts, reads = pdf
+        texts.extend(["Página %d\n" % i for i in range(10)])
+        extractor = pdf_extract.PDFTextExtractor(max_pages=4)
+        assert extractor.extract(path).count("Página") == 4
+
+    def test_parallel_keeps_page_order_and_stops(self, pdf):
+        path, texts, reads = pdf
+        texts.extend([HEADER] + ["Línea %d\n" % i for i in range(5)]
+                     + [TOTALS] + ["Anexo\n"] * 9)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            extractor = pdf_extract.PDFTextExtractor(
+                executor=executor, chunk_pages=4, parallel_min_pages=8,
+            )
+            text = extractor.extract(path)
+        assert text == "".join(texts[:8])
@@ -0,0 +1,65 @@
+from prompt_builder import CategoryTable, PromptStats, count_tokens, stems
+
+ACCOUNTS = [
+    {"id": "5066", "code": "5", "name": "Gastos"},
+    {"id": "5010", "code": "5.1.02", "name": "Combustibles y lubricantes"},
+    {"id": "5011", "code": "5.1.01", "name": "Alquiler de oficinas"},
+    {"id": "5012", "code": "5.1.03", "name": "Alquiler de Oficinas"},
+    {"id": "5013", "code": "5.1.04", "name": "Servicios de telefonía",
+     "description": "Internet y celulares"},
+    {"id": "5014", "code": "5.1.05", "name": "Materiales de construcción"},
+    {"id": "5077", "code": "5.9.99", "name": "Otros gastos"},
+]
+
+
+class TestStems:
+    def test_stems(self):
+        assert stems("Telefonía CELULAR de la oficina") == {
+            "telef", "celul", "ofici",
+        }
+
+
+class TestCategoryTable:
+    def test_deduplicates_and_sorts_by_code(self):
+        accounts = CategoryTable(top_k=0).select(ACCOUNTS)
+        assert [account["id"] for account in accounts] == [
+            "5011", "5010", "5013", "5014", "5077",
+        ]
+        assert accounts[0]["row"] == "5011|5.1.01|Alquiler de oficinas"
+
+    def test_render(self):
+        table = CategoryTable(top_k=0)
+        assert table.render(table.select(ACCOUNTS[:3])) == (
+            "ID|Código|Nombre\n"
+            "5011|5.1.01|Alquiler de oficinas\n"
+            "5010|5.1.02|Combustibles y lubricantes"
+        )
+
+    def test_top_k_matches_the_invoice_text(self):
+        table = CategoryTable(top_k=1)
+        accounts = table.select(ACCOUNTS, "Plan de celulares e internet")
+        assert [account["id"] for account in accounts] == ["5013", "5077"]
+        # Without a text every account is offered
+        assert len(table.select(ACCOUNTS)) == 5
+
+    def test_table_is_prepared_once_per_chart(self):
+        table = CategoryTable(max_tables=1)
+        prepared = table._prepare(ACCOUNTS)
+        assert table._prepare(list(reversed(ACCOUNTS))) is prepared
+        assert table._prepare(ACCOUNTS[:3]) is not prepared
+        assert table._prepare(ACCOUNTS) is not prepared
+
+
+class TestPromptStats:
+    def test_record(self):
+        stats = PromptStats()
+        assert count_tokens("a" * 9) == 3
+        stats.record("items", "a" * 8, "b" * 4)
+        stats.record("items", "a" * 4, None)
+        assert stats.snapshot() == {"items": {
+            "prompts": 2,
+            "tokens": 4,
+            "max_tokens": 3,
+            "last_tokens": 1,
+            "avg_tokens": 2,
+        }}
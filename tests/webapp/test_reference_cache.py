@@ -0,0 +1,135 @@
+import threading
+
+import pytest
+
+import reference_cache
+from reference_cache import ReferenceCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(reference_cache.time, "time", clock)
+    return clock
+
+
+class Loader:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return ["taxes v%d" % self.calls]
+
+
+def wait_for_refresh():
+    for thread in threading.enumerate():
+        if thread.name.startswith("refresh-"):
+            thread.join(timeout=5)
+
+
+@pytest.fixture
+def cache(clock):
+    cache = ReferenceCache(ttl=60, stale_ttl=300)
+    loader = Loader()
+    cache.register("taxes", loader)
+    return cache, loader
+
+
+class TestReferenceCache:
+    def test_fresh_entries_are_served_from_memory(self, cache, clock):
+        cache, loader = cache
+        assert cache.get("taxes", tenant="a") == ["taxes v1"]
+        clock.now += 59
+        assert cache.get("taxes", tenant="a") == ["taxes v1"]
+        assert loader.calls == 1
+
+    def test_tenants_are_cached_apart(self, cache):
+        cache, loader = cache
+        cache.get("taxes", tenant="a")
+        assert cache.get("taxes", tenant="b") == ["taxes v2"]
+        assert cache.get("taxes", tenant="a") == ["taxes v1"]
+
+    def test_expired_entries_are_served_stale_and_refreshed(
+            self, cache, clock):
+        cache, loader = cache
+        cache.get("taxes", tenant="a")
+        clock.now += 61
+        assert cache.get("taxes", tenant="a") == ["taxes v1"]
+        wait_for_refresh()
+        assert cache.get("taxes", tenant="a") == ["taxes v2"]
+        assert loader.calls == 2
+
+    def test_entries_past_the_stale_window_are_reloaded(self, cache, clock):
+        cache, loader = cache
+        cache.get("taxes", tenant="a")
+        clock.now += 361
+        assert cache.get("taxes", tenant="a") == ["taxes v2"]
+
+    def test_stale_entry_is_served_when_the_reload_fails(self, clock):
+        cache = ReferenceCache(ttl=60, stale_ttl=0)
+        results = [["taxes v1"]]
+
+        def loader():
+            if results:
+                return results.pop()
+            raise ConnectionError("Alegra is down")
+
+        cache.register("taxes", loader)
+        cache.get("taxes", tenant="a")
+        clock.now += 61
+        assert cache.get("taxes", tenant="a") == ["taxes v1"]
+
+    def test_invalidate_drops_one_dataset(self, cache):
+        cache, loader = cache
+        cache.register("items", lambda: ["item"])
+        cache.get("taxes", tenant="a")
+        cache.get("items", tenant="a")
+        cache.get("taxes", tenant="b")
+        cache.invalidate("taxes", tenant="a")
+        assert cache.get("taxes", tenant="a") == ["taxes v3"]
+        assert cache.get("taxes", tenant="b") == ["taxes v2"]
+        assert ("a", "items") in cache._entries
+
+    def test_invalidate_drops_every_dataset_for_a_tenant(self, cache):
+        cache, loader = cache
+        cache.register("items", lambda: ["item"])
+        cache.get("taxes", tenant="a")
+        cache.get("items", tenant="a")
+        cache.invalidate(tenant="a")
+        assert ("a", "taxes") not in cache._entries
+        assert ("a", "items") not in cache._entries
+
+    def test_refresh_started_before_invalidate_is_not_stored(
+            self, cache, clock):
+        cache, _ = cache
+        loading = threading.Event()
+        release = threading.Event()
+        versions = iter(["old", "new"])
+
+        def loader():
+            version = next(versions)
+            if version == "old":
+                loading.set()
+                release.wait(timeout=5)
+            return [version]
+
+        cache.register("taxes", loader)
+        cache.invalidate("taxes", tenant="a")
+        cache._entries[("a", "taxes")] = (clock.now - 61, ["stale"])
+        assert cache.get("taxes", tenant="a") == ["stale"]
+        assert loading.wait(timeout=5)
+        # A tax changes in Alegra while the refresh is reading the old list
+        cache.invalidate("taxes", tenant="a")
+        release.set()
+        wait_for_refresh()
+        assert ("a", "taxes") not in cache._entries
+        assert cache.get("taxes", tenant="a") == ["new"]
@@ -0,0 +1,208 @@
+import threading
+
+import pytest
+
+import submission_ledger as ledger
+from submission_ledger import (
+    PaymentRejected,
+    SubmissionLedger,
+    normalize_invoice_number,
+    submission_key,
+)
+
+KEY = submission_key("3-101-123456", "FE-00042", 1130)
+PAYMENT = {"date": "2025-05-24", "bankAccount": {"id": 1}}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SubmissionLedger(str(tmp_path / "submissions.db"), stale_after=0)
+
+
+def registered(store, key=KEY):
+    """Claim an invoice and record its bill as created"""
+    entry, claimed = store.claim(key, "2025-05-24")
+    assert claimed
+    store.transition(entry["id"], ledger.BILL_CREATED, bill_id="77",
+                     payment_data=PAYMENT, response={"id": 77})
+    return entry["id"]
+
+
+def paid(payment_data):
+    return {"id": 9, "amount": 1130}
+
+
+def timed_out(payment_data):
+    raise TimeoutError("read timed out")
+
+
+def rejected(payment_data):
+    raise PaymentRejected("bank account closed")
+
+
+class TestKeys:
+    def test_normalize_invoice_number(self):
+        assert normalize_invoice_number("FE-0001") == "FE1"
+        assert normalize_invoice_number("fe 1") == "FE1"
+        assert normalize_invoice_number("00100001010000000123") == \
+            "100001010000000123"
+        assert normalize_invoice_number("A-100") == "A100"
+        assert normalize_invoice_number(None) == ""
+
+    def test_submission_key(self):
+        assert KEY == ("3101123456", "FE42", "1130.00")
+        assert submission_key("3101123456", "fe 42", "1130.0") == KEY
+
+
+class TestClaim:
+    def test_second_claim_is_refused(self, store):
+        entry, claimed = store.claim(KEY, "2025-05-24")
+        assert claimed and entry["state"] == ledger.PENDING
+        assert entry["date"] == "2025-05-24"
+        store.stale_after = 300
+        again, claimed = store.claim(KEY)
+        assert not claimed
+        assert again["id"] == entry["id"]
+
+    def test_concurrent_claims(self, store):
+        store.stale_after = 300
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(store.claim(KEY)[1]))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(results) == [False] * 7 + [True]
+
+    def test_failed_bill_can_be_claimed_again(self, store):
+        entry, _ = store.claim(KEY)
+        store.transition(entry["id"], ledger.BILL_FAILED, error="400")
+        again, claimed = store.claim(KEY)
+        assert claimed
+        assert again["state"] == ledger.PENDING and again["error"] is None
+
+    def test_stale_claim_becomes_unknown(self, store):
+        entry, _ = store.claim(KEY)
+        again, claimed = store.claim(KEY)
+        assert not claimed
+        assert again["state"] == ledger.UNKNOWN
+        assert store.release(entry["id"])
+        assert store.claim(KEY)[1]
+
+    def test_registered_bills_are_not_claimed(self, store):
+        submission_id = registered(store)
+        entry, claimed = store.claim(KEY)
+        assert not claimed and entry["bill_id"] == "77"
+        assert [e["id"] for e in store.registered()] == [submission_id]
+
+
+class TestTransition:
+    def test_conditional_transition(self, store):
+        submission_id = registered(store)
+        assert not store.transition(submission_id, ledger.COMPLETED,
+                                    from_states=(ledger.PAYMENT_PENDING,))
+        assert store.claim_payment(submission_id)
+        assert not store.claim_payment(submission_id)
+        assert store.get(submission_id)["state"] == ledger.PAYMENT_PENDING
+        assert [t["state"] for t in store.history(submission_id)] == [
+            ledger.PENDING, ledger.BILL_CREATED, ledger.PAYMENT_PENDING,
+        ]
+
+    def test_without_ledger(self, store):
+        assert not store.transition(None, ledger.COMPLETED)
+
+
+class TestPostPayment:
+    def post(self, store, pay):
+        submission_id = registered(store)
+        assert store.claim_payment(submission_id)
+        response = store.post_payment(submission_id, PAYMENT, pay, {"id": 77})
+        return store.get(submission_id), response
+
+    def test_paid(self, store):
+        entry, response = self.post(store, paid)
+        assert entry["state"] == ledger.COMPLETED
+        assert entry["payment_id"] == "9"
+        assert response == {"id": 77, "payment": {"id": 9, "amount": 1130}}
+
+    def test_rejected_payment_is_retried(self, store):
+        entry, response = self.post(store, rejected)
+        assert entry["state"] == ledger.PAYMENT_FAILED
+        assert response["paymentPending"]
+        assert entry["payment_attempts"] == 1
+
+    def test_unanswered_payment_is_unknown(self, store):
+        entry, response = self.post(store, timed_out)
+        assert entry["state"] == ledger.PAYMENT_UNKNOWN
+        assert "read timed out" in response["warning"]
+
+
+class TestResumePayments:
+    def test_retries_rejected_payments(self, store):
+        submission_id = registered(store)
+        store.claim_payment(submission_id)
+        store.post_payment(submission_id, PAYMENT, rejected, {})
+        assert store.resume_payments(paid, None, retry_after=0) == 1
+        entry = store.get(submission_id)
+        assert entry["state"] == ledger.COMPLETED
+        assert entry["payment_attempts"] == 2
+        assert "warning" not in entry["response"]
+
+    def test_stops_after_max_attempts(self, store):
+        submission_id = registered(store)
+        store.claim_payment(submission_id)
+        store.post_payment(submission_id, PAYMENT, rejected, {})
+        for _ in range(3):
+            store.resume_payments(rejected, None, max_attempts=2,
+                                  retry_after=0)
+        entry = store.get(submission_id)
+        assert entry["state"] == ledger.PAYMENT_FAILED
+        assert entry["payment_attempts"] == 2
+
+    def test_unknown_payment_found_in_alegra(self, store):
+        submission_id = registered(store)
+        store.claim_payment(submission_id)
+        store.post_payment(submission_id, PAYMENT, timed_out, {})
+        posts = []
+        found = store.resume_payments(
+            posts.append, lambda entry: {"id": 12, "amount": 1130},
+            retry_after=0,
+        )
+        assert found == 1
+        assert posts == []
+        entry = store.get(submission_id)
+        assert entry["state"] == ledger.COMPLETED
+        assert entry["payment_id"] == "12"
+
+    def test_unknown_payment_missing_in_alegra(self, store):
+        submission_id = registered(store)
+        store.claim_payment(submission_id)
+        store.post_payment(submission_id, PAYMENT, timed_out, {})
+        # Looked up first, then posted again on a later run
+        store.resume_payments(paid, lambda entry: None, retry_after=60)
+        assert store.get(submission_id)["state"] == ledger.PAYMENT_FAILED
+        store.resume_payments(paid, lambda entry: None, retry_after=0)
+        assert store.get(submission_id)["state"] == ledger.COMPLETED
+
+    def test_stale_payment_claim_is_looked_up(self, store):
+        submission_id = registered(store)
+        store.claim_payment(submission_id)
+        lookups = []
+
+        def find(entry):
+            lookups.append(entry["id"])
+            return {"id": 12, "amount": 1130}
+
+        assert store.resume_payments(timed_out, find, retry_after=0) == 1
+        assert lookups == [submission_id]
+        assert store.get(submission_id)["state"] == ledger.COMPLETED
+
+    def test_lookup_errors_leave_the_payment_unknown(self, store):
+        submission_id = registered(store)
+        store.claim_payment(submission_id)
+        store.post_payment(submission_id, PAYMENT, timed_out, {})
+        store.resume_payments(paid, timed_out, retry_after=0)
+        assert store.get(submission_id)["state"] == ledger.PAYMENT_UNKNOWN
@@ -0,0 +1,163 @@
+import json
+import threading
+
+import pytest
+
+import upload_jobs
+from upload_jobs import JobQueue
+
+
+class Gate:
+    """A job that runs until the test lets it finish"""
+
+    def __init__(self, result=None, error=None):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.result = result
+        self.error = error
+
+    def __call__(self):
+        self.started.set()
+        assert self.release.wait(timeout=5)
+        if self.error:
+            raise self.error
+        return self.result
+
+
+class UploadError(Exception):
+    status_code = 422
+
+
+def wait_until_finished(queue, job):
+    while job["status"] not in queue.FINISHED:
+        job = queue.wait_for_change(job["id"], job["version"], timeout=5)
+    return job
+
+
+@pytest.fixture
+def queue():
+    return JobQueue(max_workers=1, retention=60)
+
+
+class TestJobQueue:
+    def test_job_moves_from_queued_to_done(self, queue):
+        running, waiting = Gate(), Gate(result={"invoice": "FE-0042"})
+        queue.submit(running)
+        job = queue.submit(waiting)
+        assert running.started.wait(timeout=5)
+        assert queue.get(job["id"])["status"] == "queued"
+        running.release.set()
+        assert waiting.started.wait(timeout=5)
+        assert queue.get(job["id"])["status"] == "processing"
+        waiting.release.set()
+        job = wait_until_finished(queue, job)
+        assert job["status"] == "done"
+        assert job["result"] == {"invoice": "FE-0042"}
+        assert job["error"] is None and job["finished_at"]
+
+    def test_failed_job_keeps_the_error_and_status_code(self, queue):
+        gate = Gate(error=UploadError("Archivo ilegible"))
+        gate.release.set()
+        job = wait_until_finished(queue, queue.submit(gate))
+        assert job["status"] == "failed"
+        assert job["error"] == "Archivo ilegible"
+        assert job["status_code"] == 422
+
+    def test_unexpected_errors_default_to_500(self, queue):
+        gate = Gate(error=ValueError("boom"))
+        gate.release.set()
+        job = wait_until_finished(queue, queue.submit(gate))
+        assert job["status_code"] == 500
+
+    def test_snapshots_are_copies(self, queue):
+        gate = Gate()
+        job = queue.submit(gate)
+        job["status"] = "done"
+        assert queue.get(job["id"])["status"] != "done"
+        gate.release.set()
+
+    def test_wait_for_change_times_out_without_changes(self, queue):
+        gate = Gate()
+        job = queue.submit(gate)
+        assert gate.started.wait(timeout=5)
+        job = queue.get(job["id"])
+        assert queue.wait_for_change(job["id"], job["version"],
+                                     timeout=0.05) == job
+        gate.release.set()
+
+    def test_unknown_jobs(self, queue):
+        assert queue.get("missing") is None
+        assert queue.wait_for_change("missing", 0, timeout=0.05) is None
+
+    def test_stats_count_jobs_by_status(self, queue):
+        running, waiting = Gate(), Gate()
+        queue.submit(running)
+        queue.submit(waiting)
+        assert running.started.wait(timeout=5)
+        assert queue.stats() == {"processing": 1, "queued": 1}
+        running.release.set()
+        waiting.release.set()
+
+    def test_finished_jobs_are_purged_after_retention(
+            self, queue, monkeypatch):
+        done = Gate()
+        done.release.set()
+        finished = wait_until_finished(queue, queue.submit(done))
+        running = Gate()
+        pending = queue.submit(running)
+        assert running.started.wait(timeout=5)
+        now = finished["finished_at"] + 61
+        monkeypatch.setattr(upload_jobs.time, "time", lambda: now)
+        queue._purge()
+        assert queue.get(finished["id"]) is None
+        # Jobs still running are kept however old they are
+        assert queue.get(pending["id"])["status"] == "processing"
+        running.release.set()
+
+    def test_recent_jobs_are_kept(self, queue):
+        done = Gate()
+        done.release.set()
+        job = wait_until_finished(queue, queue.submit(done))
+        queue.submit(lambda: None)
+        assert queue.get(job["id"])["status"] == "done"
+
+
+class TestUploadJobEvents:
+    @pytest.fixture
+    def client(self, app, queue, monkeypatch):
+        monkeypatch.setattr(app, "upload_jobs", queue)
+        return app.app.test_client()
+
+    def events(self, response):
+        return [json.loads(line[len("data: "):])
+                for line in response.get_data(as_text=True).split("\n\n")
+                if line.startswith("data: ")]
+
+    def test_stream_follows_the_job_until_it_finishes(self, client, queue):
+        gate = Gate(result={"invoice": "FE-0042"})
+        job = queue.submit(gate)
+        assert gate.started.wait(timeout=5)
+        response = client.get(f"/api/upload/jobs/{job['id']}/events",
+                              buffered=False)
+        assert response.mimetype == "text/event-stream"
+        assert response.headers["Cache-Control"] == "no-cache"
+        gate.release.set()
+        assert self.events(response) == [
+            {"job_id": job["id"], "status": "processing"},
+            {"job_id": job["id"], "status": "done", "success": True,
+             "data": {"invoice": "FE-0042"}},
+        ]
+
+    def test_stream_of_a_failed_job(self, client, queue):
+        gate = Gate(error=UploadError("Archivo ilegible"))
+        gate.release.set()
+        job = wait_until_finished(queue, queue.submit(gate))
+        response = client.get(f"/api/upload/jobs/{job['id']}/events")
+        assert self.events(response) == [
+            {"job_id": job["id"], "status": "failed", "success": False,
+             "error": "Archivo ilegible"},
+        ]
+
+    def test_unknown_job(self, client):
+        assert client.get("/api/upload/jobs/missing/events").status_code == 404
+        assert client.get("/api/upload/jobs/missing").status_code == 404
@@ -0,0 +1,124 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from vendor_templates import VendorTemplateStore, parse_date, parse_number
+
+TODAY = datetime.now()
+
+
+def invoice_text(number, total, lines):
+    rows = "\n".join(
+        "%s   %d   %s   %s" % (description, quantity,
+                               format(price, ",.2f"), format(amount, ",.2f"))
+        for description, quantity, price, amount in lines
+    )
+    return """DISTRIBUIDORA ACME S.A.
+Cédula Jurídica: 3-101-123456
+Factura N°: {number}
+Fecha: {date}
+Descripción   Cant   Precio   Total
+{rows}
+Subtotal: {subtotal}
+Total comprobante: {total}
+Gracias por su compra
+""".format(
+        number=number,
+        date=TODAY.strftime("%d/%m/%Y"),
+        rows=rows,
+        subtotal=format(sum(line[3] for line in lines), ",.2f"),
+        total=format(total, ",.2f"),
+    )
+
+
+TEXT = invoice_text("FE-0042", 1130.0, [
+    ("Cemento gris", 2, 250.0, 500.0),
+    ("Varilla #3", 5, 100.0, 500.0),
+])
+HEADER = {
+    "vendor_id": "3101123456",
+    "vendor_name": "Distribuidora Acme",
+    "invoice_number": "FE-0042",
+    "date": TODAY.strftime("%Y-%m-%d"),
+    "total": 1130.0,
+}
+ITEMS = [
+    {"description": "Cemento gris", "amount": 500.0, "account_id": "5001",
+     "has_tax": True, "tax_percentage": 13},
+    {"description": "Varilla #3", "amount": 500.0, "account_id": "5002",
+     "has_tax": True, "tax_percentage": 13},
+]
+NEXT_TEXT = invoice_text("FE-0043", 2260.0, [
+    ("Cemento gris", 4, 250.0, 1000.0),
+    ("Arena", 1, 1000.0, 1000.0),
+])
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = VendorTemplateStore(str(tmp_path / "templates.json"))
+    assert store.learn(TEXT, HEADER, ITEMS)
+    return store
+
+
+def saved_template(store):
+    with open(store.path, encoding="utf-8") as f:
+        return json.load(f)["templates"].get("3101123456")
+
+
+class TestParsing:
+    def test_numbers(self):
+        assert parse_number("1,234.56") == 1234.56
+        assert parse_number("1.234,56") == 1234.56
+        assert parse_number("1234,5") == 1234.5
+        assert parse_number("15,000") == 15000
+        assert parse_number("1.234.567") == 1234567
+
+    def test_dates(self):
+        assert parse_date("4/5/25") == "2025-05-04"
+        assert parse_date("2025-05-24") == "2025-05-24"
+        assert parse_date("31/02/2025") is None
+
+
+class TestVendorTemplateStore:
+    def test_replays_the_learned_layout(self, store):
+        data = store.apply(NEXT_TEXT)
+        assert data["invoice_number"] == "FE-0043"
+        assert data["total"] == 2260.0
+        assert data["vendor_id"] == "3101123456"
+        assert [(item["description"], item["amount"], item["account_id"])
+                for item in data["line_items"]] == [
+            ("Cemento gris", 1000.0, "5001"),
+            ("Arena", 1000.0, "5001"),
+        ]
+        assert store.stats() == {"vendors": 1, "hits": 1, "misses": 0}
+
+    def test_only_learns_valid_vendors(self, tmp_path):
+        store = VendorTemplateStore(str(tmp_path / "templates.json"))
+        header = dict(HEADER, vendor_id="123")
+        assert not store.learn(TEXT, header, ITEMS)
+        assert store.apply(TEXT) is None
+
+    def test_counters_are_saved_on_flush(self, store):
+        store.apply(NEXT_TEXT)
+        assert saved_template(store)["uses"] == 0
+        store.flush()
+        assert saved_template(store)["uses"] == 1
+
+    def test_drops_templates_that_keep_failing(self, tmp_path):
+        store = VendorTemplateStore(str(tmp_path / "templates.json"),
+                                    max_failures=2)
+        assert store.learn(TEXT, HEADER, ITEMS)
+        # Lines that do not add up to the total mean the layout changed
+        broken = NEXT_TEXT.replace("2,260.00", "9,999.00")
+        assert store.apply(broken) is None
+        assert saved_template(store)["failures"] == 0
+        assert store.apply(broken) is None
+        assert saved_template(store) is None
+        assert store.stats()["misses"] == 2
+
+    def test_reloads_from_disk(self, store):
+        assert VendorTemplateStore(store.path).apply(NEXT_TEXT) is not None
+        store.clear()
+        assert VendorTemplateStore(store.path).stats()["vendors"] == 0
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class AICache:
+    """Content-addressed disk cache for AI extraction results.
+
+    Entries are keyed by a hash of everything that determines the AI answer
+    (the kind of extraction, prompt version, model, invoice text and the
+    expense accounts offered for categorization), so re-uploading the same
+    invoice returns the stored result without calling the provider. Each
+    entry is a JSON file; the least recently used files are deleted once
+    the cache grows past ``max_bytes``.
+    """
+
+    def __init__(self, directory, max_bytes=50 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size, least recently used first
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            files.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._size += size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    @staticmethod
+    def key(kind, prompt_version, model, text, expense_accounts=None):
+        """Build the cache key for an AI extraction"""
+        accounts = sorted(
+            (str(acc.get('id', '')), str(acc.get('name', '')), str(acc.get('code', '')))
+            for acc in expense_accounts or []
+        )
+        payload = json.dumps([kind, prompt_version, model, text, accounts], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached value for a key, or None"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                value = json.load(f)
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            self._discard(key)
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Store a value and evict the least recently used entries if needed"""
+        data = json.dumps(value, ensure_ascii=False).encode('utf-8')
+        # Write to a temporary file first so readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Error writing AI cache entry: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self._size += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            evicted = []
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                old_key, size = self._entries.popitem(last=False)
+                self._size -= size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def _discard(self, key):
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        """Delete every cached entry"""
+        with self._lock:
+            keys = list(self._entries)
+        for key in keys:
+            self._discard(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
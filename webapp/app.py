@@ -1,16 +1,32 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response, stream_with_context
 import os
+import atexit
 import alegra
 from werkzeug.utils import secure_filename
-import PyPDF2
-import re
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import json
 import requests
-import xml.etree.ElementTree as ET
 import logging
+import multiprocessing
 import tempfile
+import uuid
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from contact_index import ContactIndex, normalize_identification, get_contact_identification
+from reference_cache import ReferenceCache
+from upload_jobs import JobQueue
+from ai_cache import AICache
+from invoice_parser import parse_invoice_file, missing_xml_fields
+from invoice_regex import extract_invoice_data
+from extraction_confidence import ExtractionMetrics, score_extraction
+from vendor_templates import VendorTemplateStore
+from category_memory import CategoryMemory
+from prompt_builder import CategoryTable, PromptStats
+import submission_ledger as ledger
+from bill_index import BillIndex
+from pdf_extract import PDFTextExtractor
 
 # Load environment variables from .env file
 load_dotenv()
@@ -18,7 +34,7 @@ load_dotenv()
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'ALEGRA_TOKEN'
 app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', '16')) * 1024 * 1024  # 16MB max request size by default
 app.config['ALLOWED_EXTENSIONS'] = {'pdf', 'xml'}
 
 # Create upload folder if it doesn't exist
@@ -28,11 +44,123 @@ if not os.path.exists(app.config['UPLOAD_FOLDER']):
 # Configure APIs
 alegra.user = os.environ.get('ALEGRA_USER', '')
 alegra.token = os.environ.get('ALEGRA_TOKEN', '')
+ALEGRA_PAGE_WORKERS = int(os.environ.get('ALEGRA_PAGE_WORKERS', '4'))  # Concurrent page requests for full scans
+# Client-side request budget shared by every thread; Alegra's rate-limit headers are followed either way
+if os.environ.get('ALEGRA_REQUESTS_PER_SECOND'):
+    alegra.requests_per_second = float(os.environ['ALEGRA_REQUESTS_PER_SECOND'])
+
+# Batch uploads and long PDFs are parsed in PARSE_WORKERS worker processes.
+# Where fork is available every worker is forked here, before any background
+# thread starts, so none inherits a lock (logging, connection pools, sqlite)
+# held by another thread; elsewhere they are spawned fresh on first use
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', str(os.cpu_count() or 2)))
+if 'fork' in multiprocessing.get_all_start_methods():
+    parse_executor = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context('fork'))
+    parse_executor.submit(int).result()
+else:
+    parse_executor = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+
+# Local contact index for vendor matching, warmed in the background
+contact_index = ContactIndex(
+    refresh_interval=int(os.environ.get('CONTACT_INDEX_REFRESH_SECONDS', '300'))
+)
+if alegra.user and alegra.token:
+    contact_index.start()
+
+# Background workers for queued invoice uploads
+upload_jobs = JobQueue(max_workers=int(os.environ.get('UPLOAD_WORKERS', '4')))
+
+# Batch uploads parse files in the worker processes and enrich them (contacts, AI) in threads
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', '500'))
+# Zip archives of a batch may expand to at most BATCH_MAX_UNCOMPRESSED_MB in total
+BATCH_MAX_UNCOMPRESSED = int(os.environ.get('BATCH_MAX_UNCOMPRESSED_MB', '200')) * 1024 * 1024
+batch_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('BATCH_WORKERS', '8')), thread_name_prefix='batch')
+
+# Batch bill registration submits up to BILL_SUBMIT_WORKERS bills to Alegra at once
+BILL_BATCH_MAX = int(os.environ.get('BILL_BATCH_MAX', '200'))
+bill_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('BILL_SUBMIT_WORKERS', '4')), thread_name_prefix='bills')
+
+# Ledger of submitted bills: duplicates are answered locally and failed
+# payments are retried in the background
+# Claims older than LEDGER_STALE_SECONDS, well past the longest request with its retries,
+# are taken as interrupted
+submission_ledger = ledger.SubmissionLedger(os.environ.get('LEDGER_PATH', 'submissions.db'),
+                                            stale_after=int(os.environ.get('LEDGER_STALE_SECONDS', '900')))
+LEDGER_RESUME_SECONDS = int(os.environ.get('LEDGER_RESUME_SECONDS', '60'))
+LEDGER_MAX_PAYMENT_ATTEMPTS = int(os.environ.get('LEDGER_MAX_PAYMENT_ATTEMPTS', '5'))
+if alegra.user and alegra.token:
+    submission_ledger.start(lambda payment_data: create_payment(payment_data),
+                            lambda entry: find_bill_payment(entry['bill_id']),
+                            interval=LEDGER_RESUME_SECONDS, max_attempts=LEDGER_MAX_PAYMENT_ATTEMPTS)
+
+# Index of the bills registered in Alegra, to flag duplicate invoices locally
+bill_index = BillIndex(
+    resolve_identification=lambda provider_id: (contact_index.find_by_id(provider_id) or {}).get('identification', ''),
+    wait_ready=contact_index.wait_ready,
+    refresh_interval=int(os.environ.get('BILL_INDEX_REFRESH_SECONDS', '300'))
+)
+bill_index.seed(submission_ledger.registered())
+if alegra.user and alegra.token:
+    bill_index.start()
+
+# PDF text extraction limits; long PDFs are split across the parse processes
+PDF_MAX_PAGES = int(os.environ.get('PDF_MAX_PAGES', '50'))
+PDF_TIMEOUT_SECONDS = float(os.environ.get('PDF_TIMEOUT_SECONDS', '30'))
+pdf_extractor = None
+# Batch files are already parsed in a worker process, one page after another
+batch_pdf_extractor = PDFTextExtractor(max_pages=PDF_MAX_PAGES, timeout=PDF_TIMEOUT_SECONDS)
+
+# Reference data (categories, taxes, items, bank accounts) cached per tenant
+reference_cache = ReferenceCache(
+    ttl=int(os.environ.get('REFERENCE_CACHE_TTL_SECONDS', '3600'))
+)
 
 # AI Provider configuration
 AI_PROVIDER = os.environ.get('AI_PROVIDER', 'openai').lower()  # 'openai' or 'gemini'
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', '')
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
+OPENAI_MODEL = os.environ.get('OPENAI_MODEL', 'gpt-4')
+GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-pro')
+# 'split' asks the AI for the header and the line items separately,
+# 'merged' extracts both with a single call and 'hybrid' uses the regex
+# header unless its confidence is below HYBRID_CONFIDENCE_THRESHOLD
+AI_EXTRACTION_MODE = os.environ.get('AI_EXTRACTION_MODE', 'split').lower()
+HYBRID_CONFIDENCE_THRESHOLD = float(os.environ.get('HYBRID_CONFIDENCE_THRESHOLD', '0.8'))
+
+# XML lines are categorized from memory only unless this is set, so XML
+# uploads don't call the AI just to pick expense accounts
+XML_AI_CATEGORIZATION = os.environ.get('XML_AI_CATEGORIZATION', 'false').lower() == 'true'
+
+# How invoices are extracted and how often the AI is needed
+extraction_metrics = ExtractionMetrics()
+
+# Threads for AI calls that run alongside other work on the same upload
+ai_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('AI_WORKERS', '8')), thread_name_prefix='ai')
+
+# Bump when the AI prompts change so cached results from older prompts are not reused
+AI_PROMPT_VERSION = 2
+
+# Expense accounts offered to the AI; above CATEGORY_PROMPT_TOP_K accounts only
+# the ones that best match the invoice text are listed (0 lists them all)
+category_table = CategoryTable(top_k=int(os.environ.get('CATEGORY_PROMPT_TOP_K', '40')))
+prompt_stats = PromptStats()
+
+# AI results cached on disk so re-uploaded invoices don't call the provider again
+ai_cache = AICache(
+    os.environ.get('AI_CACHE_DIR', 'ai_cache'),
+    max_bytes=int(os.environ.get('AI_CACHE_MAX_MB', '50')) * 1024 * 1024
+)
+
+# Layouts learned from AI extractions, replayed for later invoices of the same vendor
+vendor_templates = VendorTemplateStore(
+    os.environ.get('VENDOR_TEMPLATES_PATH', 'vendor_templates.json'),
+    min_confidence=float(os.environ.get('VENDOR_TEMPLATE_MIN_CONFIDENCE', '0.9'))
+)
+vendor_templates.start(interval=int(os.environ.get('VENDOR_TEMPLATES_FLUSH_SECONDS', '60')))
+atexit.register(vendor_templates.flush)
+
+# Accounts and taxes of registered bills, reused for the same vendor's lines
+category_memory = CategoryMemory(os.environ.get('CATEGORY_MEMORY_PATH', 'category_memory.json'))
 
 def get_tax_id_by_percentage(percentage, all_taxes):
     """Get tax ID based on percentage"""
@@ -41,25 +169,45 @@ def get_tax_id_by_percentage(percentage, all_taxes):
             return int(tax['id'])
     return None
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+def fetch_alegra_list(resource, **params):
+    """Fetch one page of an Alegra resource, raising on error responses"""
+    return resource.list(**params).records
+
+def fetch_alegra_object(resource, resource_id):
+    """Fetch a single Alegra object, raising on error responses"""
+    return resource.retrieve(resource_id).data
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from PDF file"""
+reference_cache.register('categories', lambda: alegra.Category.list_all(page_size=100, max_workers=ALEGRA_PAGE_WORKERS))
+reference_cache.register('expense_parent', lambda: fetch_alegra_object(alegra.Category, 5066))  # Egresos
+reference_cache.register('taxes', lambda: fetch_alegra_list(alegra.Tax))
+reference_cache.register('items', lambda: fetch_alegra_list(alegra.Item, limit=30))
+reference_cache.register('bank_accounts', lambda: fetch_alegra_list(alegra.BankAccount))
+
+def is_ai_configured():
+    """Check whether the selected AI provider has an API key"""
+    return bool((AI_PROVIDER == 'openai' and OPENAI_API_KEY) or (AI_PROVIDER == 'gemini' and GEMINI_API_KEY))
+
+def get_expense_accounts_for_ai():
+    """Get the expense accounts offered to the AI for line item categorization"""
+    expense_accounts = []
     try:
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-        return text
+        for a in reference_cache.get('categories'):
+            if (a.get('type') == 'expense' and 
+                a.get('id') not in ['5066', '5065']):
+                expense_accounts.append({
+                    'id': a['id'], 
+                    'code': a.get('code', ''), 
+                    'name': a['name'], 
+                    'description': a.get('description', '')
+                })
     except Exception as e:
-        print(f"Error extracting PDF text: {e}")
-        return ""
+        print(f"Error fetching expense accounts: {e}")
+    return expense_accounts
 
-def extract_payment_info_with_ai(text):
-    """Extract payment information using AI (OpenAI or Gemini)"""
-    prompt = """
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+
+HEADER_PROMPT_RULES = """
     Analiza el siguiente texto de una factura electrónica de Costa Rica y extrae:
     1. Monto total (amount)
     2. Número de factura o descripción (description)
@@ -80,7 +228,83 @@ def extract_payment_info_with_ai(text):
     - NO uses cédulas (números largos de 9-12 dígitos) como número de factura
     - Los números de factura suelen ser más cortos (3-8 caracteres) y pueden incluir letras
     - Prioriza el texto que dice explícitamente "Factura" sobre otros números
+"""
+
+def complete_with_ai(system_prompt, prompt):
+    """Send a prompt to the configured AI provider and return the response text"""
+    if AI_PROVIDER == 'openai' and OPENAI_API_KEY:
+        from openai import OpenAI
+        client = OpenAI(api_key=OPENAI_API_KEY)
+        
+        response = client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.1
+        )
+        return response.choices[0].message.content
+    
+    elif AI_PROVIDER == 'gemini' and GEMINI_API_KEY:
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY)
+        
+        model = genai.GenerativeModel(GEMINI_MODEL)
+        response = model.generate_content(prompt)
+        return response.text
     
+    return None
+
+def get_ai_model():
+    """Get the name of the model used by the configured AI provider"""
+    return GEMINI_MODEL if AI_PROVIDER == 'gemini' else OPENAI_MODEL
+
+def parse_ai_json(result):
+    """Parse the JSON object embedded in an AI response, or None if there is none"""
+    if not result:
+        return None
+    # Find JSON in the response
+    json_start = result.find('{')
+    json_end = result.rfind('}') + 1
+    if json_start >= 0 and json_end > json_start:
+        return json.loads(result[json_start:json_end])
+    return None
+
+def complete_ai_json(kind, text, expense_accounts, system_prompt, prompt):
+    """Get the JSON answer of an AI extraction, reusing cached results for the same input"""
+    key = ai_cache.key(kind, AI_PROMPT_VERSION, f"{AI_PROVIDER}:{get_ai_model()}", text, expense_accounts)
+    parsed = ai_cache.get(key)
+    if parsed is not None:
+        print(f"♻️ Using cached AI {kind} result")
+        return parsed
+    
+    tokens = prompt_stats.record(kind, system_prompt, prompt)
+    print(f"🤖 Sending {kind} prompt (~{tokens} tokens)")
+    parsed = parse_ai_json(complete_with_ai(system_prompt, prompt))
+    if parsed is not None:
+        ai_cache.set(key, parsed)
+    return parsed
+
+def adapt_ai_header(parsed):
+    """Build the invoice header dict returned to the upload response from AI output"""
+    return {
+        'amount': parsed.get('amount', 0),
+        'total': parsed.get('amount', 0),  # Add total field
+        'description': parsed.get('description', '') or parsed.get('invoice_number', ''),
+        'invoice_number': parsed.get('invoice_number', '') or parsed.get('description', ''),
+        'client_name': parsed.get('client_name', ''),
+        'client_id': parsed.get('client_id', ''),
+        'vendor_name': parsed.get('vendor_name', ''),
+        'vendor_id': parsed.get('vendor_id', ''),
+        'date': parsed.get('date', datetime.now().strftime('%Y-%m-%d')),
+        'auto_matched': False,
+        'line_items': parsed.get('line_items', [])
+    }
+
+def extract_payment_info_with_ai(text):
+    """Extract payment information using AI (OpenAI or Gemini)"""
+    prompt = HEADER_PROMPT_RULES + """
     Responde SOLO con un JSON válido con esta estructura exacta:
     {
         "amount": número,
@@ -99,74 +323,24 @@ def extract_payment_info_with_ai(text):
     
     # Use AI to analyze
     try:
-        result = None
-        
-        if AI_PROVIDER == 'openai' and OPENAI_API_KEY:
-            try:
-                from openai import OpenAI
-                client = OpenAI(api_key=OPENAI_API_KEY)
-                
-                response = client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "system", "content": "Eres un experto en análisis de facturas de Costa Rica."},
-                        {"role": "user", "content": prompt + text}  # Add the invoice text
-                    ],
-                    temperature=0.1
-                )
-                
-                result = response.choices[0].message.content
-            except ImportError:
-                print("OpenAI library not installed, falling back to regex")
-                return extract_invoice_data(text)  # Fallback to regex extraction
-            except Exception as e:
-                print(f"Error using OpenAI: {e}")
-                return extract_invoice_data(text)  # Fallback to regex extraction
-                
-        elif AI_PROVIDER == 'gemini' and GEMINI_API_KEY:
-            try:
-                import google.generativeai as genai
-                genai.configure(api_key=GEMINI_API_KEY)
-                
-                model = genai.GenerativeModel('gemini-pro')
-                response = model.generate_content(prompt + text)  # Add the invoice text
-                result = response.text
-            except ImportError:
-                print("Google Generative AI library not installed, falling back to regex")
-                return extract_invoice_data(text)  # Fallback to regex extraction
-            except Exception as e:
-                print(f"Error using Gemini: {e}")
-                return extract_invoice_data(text)  # Fallback to regex extraction
+        try:
+            parsed = complete_ai_json(
+                'header', text, None,
+                "Eres un experto en análisis de facturas de Costa Rica.",
+                prompt + text
+            )
+        except ImportError:
+            print(f"{AI_PROVIDER} library not installed, falling back to regex")
+            return extract_invoice_data(text)  # Fallback to regex extraction
+        except Exception as e:
+            print(f"Error using {AI_PROVIDER}: {e}")
+            return extract_invoice_data(text)  # Fallback to regex extraction
         
-        # Parse the AI response
-        if result:
-            try:
-                # Find JSON in the response
-                json_start = result.find('{')
-                json_end = result.rfind('}') + 1
-                if json_start >= 0 and json_end > json_start:
-                    json_str = result[json_start:json_end]
-                    parsed = json.loads(json_str)
-                    
-                    print(f"AI extracted invoice number: '{parsed.get('invoice_number', 'NOT FOUND')}'")
-                    
-                    # Return the complete structure with defaults for missing fields
-                    return {
-                        'amount': parsed.get('amount', 0),
-                        'total': parsed.get('amount', 0),  # Add total field
-                        'description': parsed.get('description', '') or parsed.get('invoice_number', ''),
-                        'invoice_number': parsed.get('invoice_number', '') or parsed.get('description', ''),
-                        'client_name': parsed.get('client_name', ''),
-                        'client_id': parsed.get('client_id', ''),
-                        'vendor_name': parsed.get('vendor_name', ''),
-                        'vendor_id': parsed.get('vendor_id', ''),
-                        'date': parsed.get('date', datetime.now().strftime('%Y-%m-%d')),
-                        'auto_matched': False,
-                        'line_items': parsed.get('line_items', [])
-                    }
-            except Exception as e:
-                print(f"Error parsing AI response: {e}")
-                return extract_invoice_data(text)  # Fallback to regex extraction
+        if parsed is not None:
+            print(f"AI extracted invoice number: '{parsed.get('invoice_number', 'NOT FOUND')}'")
+            
+            # Return the complete structure with defaults for missing fields
+            return adapt_ai_header(parsed)
         
         print("No AI provider configured or response is empty")
         return extract_invoice_data(text)  # Fallback to regex extraction
@@ -175,276 +349,7 @@ def extract_payment_info_with_ai(text):
         print(f"Error in AI extraction: {e}")
         return extract_invoice_data(text)  # Fallback to regex
 
-def extract_data_from_xml(xml_path):
-    """Extract structured data from Costa Rican electronic invoice XML"""
-    try:
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
-        
-        # Define namespace
-        ns = {'fe': 'https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.3/facturaElectronica'}
-        
-        # Extract vendor info
-        vendor_name = root.find('.//fe:Emisor/fe:Nombre', ns).text if root.find('.//fe:Emisor/fe:Nombre', ns) is not None else ''
-        vendor_id = root.find('.//fe:Emisor/fe:Identificacion/fe:Numero', ns).text if root.find('.//fe:Emisor/fe:Identificacion/fe:Numero', ns) is not None else ''
-        
-        # Extract client info
-        client_name = root.find('.//fe:Receptor/fe:Nombre', ns).text if root.find('.//fe:Receptor/fe:Nombre', ns) is not None else ''
-        client_id = root.find('.//fe:Receptor/fe:Identificacion/fe:Numero', ns).text if root.find('.//fe:Receptor/fe:Identificacion/fe:Numero', ns) is not None else ''
-        
-        # Extract invoice details
-        invoice_number = root.find('.//fe:NumeroConsecutivo', ns).text if root.find('.//fe:NumeroConsecutivo', ns) is not None else ''
-        date_str = root.find('.//fe:FechaEmision', ns).text if root.find('.//fe:FechaEmision', ns) is not None else ''
-        
-        # Parse date
-        date = datetime.now().strftime('%Y-%m-%d')
-        if date_str:
-            try:
-                # Handle both 2025-05-24T03:31:13 and other formats
-                if 'T' in date_str:
-                    date_obj = datetime.fromisoformat(date_str.split('.')[0])
-                else:
-                    date_obj = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-                date = date_obj.strftime('%Y-%m-%d')
-            except:
-                pass
-        
-        # Extract line items
-        line_items = []
-        for line in root.findall('.//fe:LineaDetalle', ns):
-            item = {
-                'line_number': line.find('fe:NumeroLinea', ns).text if line.find('fe:NumeroLinea', ns) is not None else '',
-                'description': line.find('fe:Detalle', ns).text if line.find('fe:Detalle', ns) is not None else '',
-                'quantity': float(line.find('fe:Cantidad', ns).text) if line.find('fe:Cantidad', ns) is not None else 1,
-                'unit_price': float(line.find('fe:PrecioUnitario', ns).text) if line.find('fe:PrecioUnitario', ns) is not None else 0,
-                'subtotal': float(line.find('fe:SubTotal', ns).text) if line.find('fe:SubTotal', ns) is not None else 0,
-                'discount': float(line.find('.//fe:MontoDescuento', ns).text) if line.find('.//fe:MontoDescuento', ns) is not None else 0,
-                'taxes': []
-            }
-            
-            # Extract taxes for this line
-            for tax in line.findall('.//fe:Impuesto', ns):
-                tax_rate = float(tax.find('fe:Tarifa', ns).text) if tax.find('fe:Tarifa', ns) is not None else 0
-                tax_amount = float(tax.find('fe:Monto', ns).text) if tax.find('fe:Monto', ns) is not None else 0
-                item['taxes'].append({
-                    'rate': tax_rate,
-                    'amount': tax_amount
-                })
-            
-            # Calculate final amount (subtotal - discount)
-            item['amount'] = item['subtotal'] - item['discount']
-            item['has_tax'] = len(item['taxes']) > 0
-            item['tax_percentage'] = item['taxes'][0]['rate'] if item['taxes'] else 0
-            
-            line_items.append(item)
-        
-        # Extract totals
-        total = 0
-        total_node = root.find('.//fe:ResumenFactura/fe:TotalComprobante', ns)
-        if total_node is not None:
-            try:
-                total = float(total_node.text)
-            except:
-                pass
-        
-        # If total is still 0, calculate from line items
-        if total == 0 and line_items:
-            subtotal = sum(item['amount'] for item in line_items)
-            total_tax = sum(sum(tax['amount'] for tax in item['taxes']) for item in line_items)
-            total = subtotal + total_tax
-        
-        return {
-            'vendor_name': vendor_name,
-            'vendor_id': vendor_id,
-            'client_name': client_name,
-            'client_id': client_id,
-            'invoice_number': invoice_number,
-            'date': date,
-            'line_items': line_items,
-            'total': total,
-            'is_xml': True
-        }
-    except Exception as e:
-        print(f"Error parsing XML: {e}")
-        return None
-
-def extract_vendor_info(text):
-    """Extract vendor information from invoice text"""
-    vendor_info = {
-        'name': '',
-        'id': ''
-    }
-    
-    # Look for vendor patterns in Costa Rica invoices
-    # Common vendor name patterns
-    vendor_patterns = [
-        r'(?:Emisor|EMISOR|Proveedor|PROVEEDOR|Vendedor|VENDEDOR)[:\s]*([^\n]+)',
-        r'(?:Razón Social|RAZÓN SOCIAL)[:\s]*([^\n]+)',
-        r'(?:Nombre Comercial|NOMBRE COMERCIAL)[:\s]*([^\n]+)'
-    ]
-    
-    for pattern in vendor_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            vendor_info['name'] = match.group(1).strip()
-            break
-    
-    # If no vendor name found with patterns, look for known vendors
-    known_vendors = [
-        'CLARO CR TELECOMUNICACIONES',
-        'CORPORACION SUPERMERCADOS UNIDOS',
-        'WAL MART',
-        'WALMART'
-    ]
-    
-    if not vendor_info['name']:
-        text_upper = text.upper()
-        for vendor in known_vendors:
-            if vendor in text_upper:
-                vendor_info['name'] = vendor
-                break
-    
-    # Vendor ID patterns
-    id_patterns = [
-        r'(?:Cédula Jurídica|CÉDULA JURÍDICA|CED\. JURÍDICA)[:\s]*([\d-]+)',
-        r'(?:Identificación del Emisor|IDENTIFICACIÓN DEL EMISOR)[:\s]*([\d-]+)',
-        r'(?:RUC|NIT)[:\s]*([\d-]+)'
-    ]
-    
-    for pattern in id_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            vendor_info['id'] = match.group(1).strip().replace('-', '')
-            break
-    
-    return vendor_info
-
-def extract_invoice_data(pdf_text):
-    """Extract structured invoice data from PDF text using AI if available"""
-    
-    # Extract basic info using regex patterns
-    vendor_info = extract_vendor_info(pdf_text)
-    
-    # Extract dates
-    date_pattern = r'(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})'
-    dates = re.findall(date_pattern, pdf_text)
-    invoice_date = dates[0] if dates else datetime.now().strftime('%Y-%m-%d')
-    
-    # Try to normalize date format
-    if invoice_date and '/' in invoice_date:
-        try:
-            parts = invoice_date.split('/')
-            if len(parts[2]) == 2:
-                parts[2] = '20' + parts[2]
-            invoice_date = f"{parts[2]}-{parts[1].zfill(2)}-{parts[0].zfill(2)}"
-        except:
-            invoice_date = datetime.now().strftime('%Y-%m-%d')
-    
-    # Extract invoice number
-    # Enhanced patterns for Costa Rican invoices
-    invoice_patterns = [
-        # "Factura" followed by number (most common)
-        r'factura\s*[:#]?\s*([A-Z0-9\-]+)',
-        # "# de documento" or "No. de documento" that's NOT a cedula (shorter numbers)
-        r'(?:no\.?\s*de\s*documento|#\s*de\s*documento)\s*[:#]?\s*([A-Z0-9\-]{1,15})',
-        # "Número de factura" or similar
-        r'(?:n[úu]mero\s*(?:de\s*)?factura|no\.?\s*factura)\s*[:#]?\s*([A-Z0-9\-]+)',
-        # "Invoice" or "No." followed by number
-        r'(?:invoice|no\.?)\s*[:#]?\s*([A-Z0-9\-]+)',
-        # Generic document number (but exclude long numbers that look like cedulas)
-        r'(?:documento|doc)\s*[:#]?\s*([A-Z0-9\-]{1,15})',
-        # Standalone number patterns (not too long to avoid cedulas)
-        r'^([A-Z]?\d{3,8}[A-Z]?)$'  # Alphanumeric, 3-8 digits
-    ]
-    
-    invoice_number = ''
-    for pattern in invoice_patterns:
-        match = re.search(pattern, pdf_text, re.IGNORECASE | re.MULTILINE)
-        if match:
-            potential_number = match.group(1).strip()
-            print(f"Found potential invoice number: '{potential_number}' with pattern: {pattern}")
-            # Skip if it looks like a cedula (9-12 digits)
-            if potential_number.replace('-', '').isdigit() and len(potential_number.replace('-', '')) >= 9:
-                print(f"Skipping '{potential_number}' - looks like a cedula")
-                continue
-            invoice_number = potential_number
-            print(f"Using invoice number: '{invoice_number}'")
-            break
-    
-    if not invoice_number:
-        print("No invoice number found with regex patterns")
-    
-    # Extract total amount
-    total_pattern = r'(?:total|monto total|total a pagar)[:\s]*(?:₡|CRC)?\s*([\d,]+\.?\d*)'
-    total_match = re.search(total_pattern, pdf_text, re.IGNORECASE)
-    total = 0
-    if total_match:
-        total_str = total_match.group(1).replace(',', '')
-        try:
-            total = float(total_str)
-        except:
-            total = 0
-    
-    return {
-        'vendor_name': vendor_info.get('name', ''),
-        'vendor_id': vendor_info.get('id', ''),
-        'client_name': '',  # Would need more sophisticated extraction
-        'client_id': '',
-        'invoice_number': invoice_number,
-        'date': invoice_date,
-        'total': total,
-        'amount': total
-    }
-
-def analyze_invoice_items_with_ai(pdf_text, expense_accounts):
-    """Use AI to analyze invoice and categorize line items"""
-    
-    # Create a comprehensive list of available expense categories for the AI
-    if expense_accounts and len(expense_accounts) > 0:
-        # Create a detailed list of ALL available categories
-        accounts_list = []
-        for acc in expense_accounts:
-            if acc.get('id') not in ['5066', '5065']:  # Exclude parent categories
-                accounts_list.append({
-                    'id': acc['id'],
-                    'name': acc['name'],
-                    'code': acc.get('code', '')
-                })
-        
-        # Sort by code for better organization
-        accounts_list.sort(key=lambda x: x.get('code', ''))
-        
-        # Create a detailed account listing for AI
-        accounts_detail = "\\n".join([
-            f"- ID: {acc['id']} | Código: {acc.get('code', 'N/A')} | Nombre: {acc['name']}"
-            for acc in accounts_list
-        ])
-        
-        account_instruction = f"""
-        CUENTAS CONTABLES DISPONIBLES EN EL SISTEMA:
-        {accounts_detail}
-        
-        IMPORTANTE PARA CATEGORIZACIÓN:
-        - Analiza cada línea de la factura y asigna la cuenta más apropiada según su descripción
-        - Para productos de supermercado: busca cuentas como "Costo de ventas", "Inventario", "Mercadería"
-        - Para servicios: busca cuentas de "Servicios", "Gastos administrativos", etc.
-        - Para telecomunicaciones: busca cuentas específicas de "Telecomunicaciones", "Internet", etc.
-        - Si no puedes determinar la cuenta apropiada, usa ID: 5077 (Gastos Generales)
-        - NO uses cuentas de Salarios (5076) a menos que sea realmente nómina
-        - Asigna un account_id específico a CADA línea de la factura
-        """
-    else:
-        # If no accounts available, use default
-        account_instruction = """
-        No hay cuentas contables disponibles en el sistema.
-        Usa account_id: 5077 (Gastos Generales) para todas las líneas.
-        """
-    
-    prompt = f"""
-    Analiza la siguiente factura y extrae CADA línea de producto/servicio por separado.
-    
-    {account_instruction}
-    
+LINE_ITEM_PROMPT_RULES = """
     IMPORTANTE - CÁLCULO DE PRECIOS:
     1. Si ves un TOTAL general en la factura (ej: "Total: ₡25,000"), ese es el monto total de toda la factura
     2. Si ves cantidad y total, calcula el precio unitario: precio_unitario = total_de_linea ÷ cantidad
@@ -502,7 +407,63 @@ def analyze_invoice_items_with_ai(pdf_text, expense_accounts):
       → tax_percentage: 13, confidence_level: "high"
     - Si ves "Seguro médico" sin indicación clara
       → tax_percentage: 2, confidence_level: "medium", needs_manual_selection: true
+"""
+
+def select_expense_accounts(expense_accounts, text):
+    """Pick the expense accounts to offer the AI for a text, see CategoryTable"""
+    if not expense_accounts:
+        return expense_accounts
+    return category_table.select(expense_accounts, text)
+
+def build_account_instruction(expense_accounts):
+    """Build the prompt section listing the expense accounts available for categorization
+    
+    ``expense_accounts`` should come from select_expense_accounts.
+    """
+    if expense_accounts and len(expense_accounts) > 0:
+        account_instruction = f"""
+        CUENTAS CONTABLES DISPONIBLES EN EL SISTEMA:
+{category_table.render(expense_accounts)}
+        
+        IMPORTANTE PARA CATEGORIZACIÓN:
+        - Analiza cada línea de la factura y asigna la cuenta más apropiada según su descripción
+        - Para productos de supermercado: busca cuentas como "Costo de ventas", "Inventario", "Mercadería"
+        - Para servicios: busca cuentas de "Servicios", "Gastos administrativos", etc.
+        - Para telecomunicaciones: busca cuentas específicas de "Telecomunicaciones", "Internet", etc.
+        - Si no puedes determinar la cuenta apropiada, usa ID: 5077 (Gastos Generales)
+        - NO uses cuentas de Salarios (5076) a menos que sea realmente nómina
+        - Asigna un account_id específico a CADA línea de la factura
+        """
+    else:
+        # If no accounts available, use default
+        account_instruction = """
+        No hay cuentas contables disponibles en el sistema.
+        Usa account_id: 5077 (Gastos Generales) para todas las líneas.
+        """
+    
+    return account_instruction
+
+def analyze_invoice_items_with_ai(pdf_text, expense_accounts, categorize=True):
+    """Use AI to analyze invoice and categorize line items
+    
+    With ``categorize`` False the prompt leaves out the accounts and the
+    lines come back without account_id, for categorize_line_items.
+    """
+    if categorize:
+        expense_accounts = select_expense_accounts(expense_accounts, pdf_text)
+        account_instruction = build_account_instruction(expense_accounts)
+    else:
+        expense_accounts = None
+        account_instruction = """
+        No asignes cuentas contables: usa account_id: null en todas las líneas,
+        se asignan después.
+        """
     
+    prompt = f"""
+    Analiza la siguiente factura y extrae CADA línea de producto/servicio por separado.
+    
+    {account_instruction}
+    {LINE_ITEM_PROMPT_RULES}
     Responde en formato JSON:
     {{
         "line_items": [
@@ -531,58 +492,21 @@ def analyze_invoice_items_with_ai(pdf_text, expense_accounts):
     
     # Use AI to analyze line items
     try:
-        result = None
-        
-        if AI_PROVIDER == 'openai' and OPENAI_API_KEY:
-            try:
-                from openai import OpenAI
-                client = OpenAI(api_key=OPENAI_API_KEY)
-                
-                response = client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "system", "content": "Eres un experto en análisis de facturas de Costa Rica y conoces perfectamente las diferentes tasas de IVA (0%, 1%, 2%, 13%)."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.1
-                )
-                
-                result = response.choices[0].message.content
-            except ImportError:
-                print("OpenAI library not installed, skipping line item analysis")
-                return []
-            except Exception as e:
-                print(f"Error using OpenAI for line items: {e}")
-                return []
-                
-        elif AI_PROVIDER == 'gemini' and GEMINI_API_KEY:
-            try:
-                import google.generativeai as genai
-                genai.configure(api_key=GEMINI_API_KEY)
-                
-                model = genai.GenerativeModel('gemini-pro')
-                response = model.generate_content(prompt)
-                result = response.text
-            except ImportError:
-                print("Google Generative AI library not installed, skipping line item analysis")
-                return []
-            except Exception as e:
-                print(f"Error using Gemini for line items: {e}")
-                return []
+        try:
+            parsed = complete_ai_json(
+                'line_items' if categorize else 'line_items_uncategorized', pdf_text, expense_accounts,
+                "Eres un experto en análisis de facturas de Costa Rica y conoces perfectamente las diferentes tasas de IVA (0%, 1%, 2%, 13%).",
+                prompt
+            )
+        except ImportError:
+            print(f"{AI_PROVIDER} library not installed, skipping line item analysis")
+            return []
+        except Exception as e:
+            print(f"Error using {AI_PROVIDER} for line items: {e}")
+            return []
         
-        # Parse the AI response
-        if result:
-            try:
-                # Find JSON in the response
-                json_start = result.find('{')
-                json_end = result.rfind('}') + 1
-                if json_start >= 0 and json_end > json_start:
-                    json_str = result[json_start:json_end]
-                    parsed = json.loads(json_str)
-                    return parsed.get('line_items', [])
-            except Exception as e:
-                print(f"Error parsing AI line items response: {e}")
-                return []
+        if parsed is not None:
+            return parsed.get('line_items', [])
         
         print("No AI provider configured or response is empty for line items")
         return []
@@ -591,6 +515,128 @@ def analyze_invoice_items_with_ai(pdf_text, expense_accounts):
         print(f"Error in analyze_invoice_items_with_ai: {e}")
         return []
 
+def categorize_line_items_with_ai(line_items, expense_accounts):
+    """Ask the AI for the account of line items that only need categorizing
+    
+    The prompt carries just the line descriptions instead of the whole
+    invoice text.
+    """
+    lines = "\n".join(f"{idx}. {item.get('description', '')}" for idx, item in enumerate(line_items))
+    expense_accounts = select_expense_accounts(expense_accounts, lines)
+    prompt = f"""
+    Asigna a cada línea de factura la cuenta contable más apropiada según su descripción.
+    
+    {build_account_instruction(expense_accounts)}
+    
+    Responde SOLO con un JSON válido:
+    {{
+        "categories": [
+            {{"index": número de la línea, "account_id": "ID de la cuenta contable"}}
+        ]
+    }}
+    
+    Líneas:
+    {lines}
+    """
+    
+    try:
+        parsed = complete_ai_json(
+            'categories', lines, expense_accounts,
+            "Eres un contador experto en la categorización de gastos en Costa Rica.",
+            prompt
+        )
+    except Exception as e:
+        print(f"Error using {AI_PROVIDER} to categorize line items: {e}")
+        return
+    
+    for category in (parsed or {}).get('categories', []):
+        try:
+            item = line_items[int(category['index'])]
+        except (KeyError, IndexError, TypeError, ValueError):
+            continue
+        if category.get('account_id'):
+            item['account_id'] = str(category['account_id'])
+
+def categorize_line_items(vendor_id, line_items, use_ai=True):
+    """Categorize line items from the vendor's registered bills
+    
+    Lines with no remembered category that have no account_id yet are sent
+    to the AI, which only sees their descriptions, unless use_ai is False.
+    """
+    unmatched = category_memory.apply(vendor_id, line_items)
+    if len(unmatched) < len(line_items):
+        print(f"🧠 {len(line_items) - len(unmatched)} of {len(line_items)} lines categorized from memory")
+    uncategorized = [item for item in unmatched if not item.get('account_id')]
+    if uncategorized and use_ai and is_ai_configured():
+        print(f"🤖 Categorizing {len(uncategorized)} lines with AI...")
+        categorize_line_items_with_ai(uncategorized, get_expense_accounts_for_ai())
+
+def extract_invoice_with_ai(pdf_text, expense_accounts):
+    """Extract the invoice header and categorized line items with a single AI call
+    
+    Returns (header, line_items) shaped like the results of
+    extract_payment_info_with_ai and analyze_invoice_items_with_ai, or None
+    if the AI call fails so the caller can fall back to the two-call mode.
+    """
+    expense_accounts = select_expense_accounts(expense_accounts, pdf_text)
+    account_instruction = build_account_instruction(expense_accounts)
+    
+    prompt = f"""{HEADER_PROMPT_RULES}
+    
+    Además, extrae CADA línea de producto/servicio por separado.
+    
+    {account_instruction}
+    {LINE_ITEM_PROMPT_RULES}
+    Responde SOLO con un JSON válido con esta estructura exacta:
+    {{
+        "amount": número,
+        "description": "string",
+        "client_name": "string",
+        "client_id": "string",
+        "vendor_name": "string",
+        "vendor_id": "string",
+        "date": "YYYY-MM-DD",
+        "invoice_number": "string (número de factura específico, NO cédula)",
+        "line_items": [
+            {{
+                "description": "descripción exacta del producto",
+                "quantity": número de unidades,
+                "unit_price": precio POR UNIDAD (no el total),
+                "amount": monto total de la línea (unit_price × quantity),
+                "account_id": "ID de la cuenta contable apropiada",
+                "has_tax": true/false,
+                "tax_percentage": número (0, 1, 2, o 13),
+                "needs_manual_selection": true/false,
+                "confidence_level": "high/medium/low",
+                "iva_reasoning": "breve explicación de por qué elegiste este porcentaje"
+            }}
+        ],
+        "requires_manual_review": true/false
+    }}
+    
+    Texto de la factura:
+    {pdf_text}
+    """
+    
+    try:
+        parsed = complete_ai_json(
+            'invoice', pdf_text, expense_accounts,
+            "Eres un experto en análisis de facturas de Costa Rica y conoces perfectamente las diferentes tasas de IVA (0%, 1%, 2%, 13%).",
+            prompt
+        )
+    except Exception as e:
+        print(f"Error in single-pass AI extraction: {e}")
+        return None
+    
+    if parsed is None:
+        print("Single-pass AI extraction returned no JSON")
+        return None
+    
+    line_items = parsed.get('line_items') or []
+    header = adapt_ai_header(parsed)
+    header['line_items'] = []
+    return header, line_items
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -633,13 +679,17 @@ def api_status():
     
     return jsonify({
         'alegra_configured': bool(alegra.user and alegra.token),
-        'ai_configured': bool(
-            (AI_PROVIDER == 'openai' and OPENAI_API_KEY) or 
-            (AI_PROVIDER == 'gemini' and GEMINI_API_KEY)
-        ),
+        'ai_configured': is_ai_configured(),
         'ai_provider': AI_PROVIDER if (OPENAI_API_KEY or GEMINI_API_KEY) else None,
         'api_test': test_result,
-        'contact_count': contact_count
+        'contact_count': contact_count,
+        'ai_cache': ai_cache.stats(),
+        'vendor_templates': vendor_templates.stats(),
+        'category_memory': category_memory.stats(),
+        'prompts': prompt_stats.snapshot(),
+        'ledger': submission_ledger.stats(),
+        'bill_index': bill_index.stats(),
+        'extraction': extraction_metrics.snapshot()
     })
 
 def find_contact_by_id(vendor_id):
@@ -649,107 +699,36 @@ def find_contact_by_id(vendor_id):
     
     try:
         # Clean the vendor ID for search (remove dashes, spaces, etc.)
-        clean_vendor_id = re.sub(r'[\s\-\.]+', '', str(vendor_id).strip())
-        
-        # Use direct API call
-        import base64
-        credentials = f"{alegra.user}:{alegra.token}"
-        encoded_credentials = base64.b64encode(credentials.encode()).decode()
+        clean_vendor_id = normalize_identification(vendor_id)
         
-        headers = {
-            'Authorization': f'Basic {encoded_credentials}',
-            'Content-Type': 'application/json'
-        }
+        # Look up the local index first, no Alegra traffic needed
+        if contact_index.wait_ready(timeout=5):
+            contact = contact_index.find_by_identification(clean_vendor_id)
+            if contact:
+                print(f"Found matching contact in index: {contact['name']} with ID {contact['identification']}")
+            else:
+                print(f"No contact found with identification: {vendor_id}")
+            return contact
         
-        # Search through pages to find the contact
-        all_contacts = []
-        page = 1
-        limit = 30
-        max_pages = 10  # Search up to 10 pages (300 contacts)
-        found = False
+        print(f"Contact index not ready, searching Alegra for contact with ID: {clean_vendor_id}")
         
-        print(f"Searching for contact with ID: {clean_vendor_id}")
-        
-        while page <= max_pages and not found:
-            api_response = requests.get(
-                f'https://api.alegra.com/api/v1/contacts?limit={limit}&start={(page-1)*limit}',
-                headers=headers
-            )
-            
-            if api_response.status_code == 200:
-                contacts_page = api_response.json()
-                if isinstance(contacts_page, list):
-                    print(f"Page {page}: Checking {len(contacts_page)} contacts")
-                    
-                    for contact in contacts_page:
-                        if isinstance(contact, dict):
-                            # Handle both formats: string directly or object with 'number'
-                            contact_id_info = contact.get('identification', '')
-                            if isinstance(contact_id_info, dict):
-                                contact_id = str(contact_id_info.get('number', ''))
-                            else:
-                                contact_id = str(contact_id_info)
-                            clean_contact_id = re.sub(r'[\s\-\.]+', '', contact_id)
-                            
-                            if clean_contact_id == clean_vendor_id:
-                                print(f"Found match on page {page}: {contact.get('name')}")
-                                all_contacts = [contact]
-                                found = True
-                                break
-                    
-                    if not found:
-                        all_contacts.extend(contacts_page)
-                        
-                    if len(contacts_page) < limit:
-                        break  # No more pages
-                    page += 1
-                else:
-                    break
-            else:
-                print(f"Error fetching page {page}: {api_response.status_code}")
-                break
-        
-        data = all_contacts
-        if not found:
-            print(f"Contact with ID {clean_vendor_id} not found after searching {page} pages")
-            
-        # Handle the response
-        contacts = []
-        if isinstance(data, list):
-            contacts = data
-        elif isinstance(data, dict):
-            # Check for error response
-            if 'code' in data and 'message' in data:
-                print(f"API Error: {data.get('code')} - {data.get('message')}")
-                return None
-            # Check for data wrapper
-            elif 'data' in data:
-                contacts = data['data']
-            else:
-                print(f"Unexpected response structure when listing contacts")
-                return None
-        
-        # Search for contact with matching identification
-        for contact in contacts:
-            if isinstance(contact, dict):
-                # Handle both formats: string directly or object with 'number'
-                contact_id_info = contact.get('identification', '')
-                if isinstance(contact_id_info, dict):
-                    contact_id = str(contact_id_info.get('number', ''))
-                else:
-                    contact_id = str(contact_id_info)
-                clean_contact_id = re.sub(r'[\s\-\.]+', '', contact_id)
-                
-                if clean_contact_id == clean_vendor_id:
-                    print(f"Found matching contact: {contact.get('name')} with ID {contact_id}")
-                    return {
-                        'id': contact['id'],
-                        'name': str(contact.get('name', '')),
-                        'identification': contact_id,
-                        'email': str(contact.get('email', ''))
-                    }
+        # Stream contacts page by page, stopping at the first match
+        checked = 0
+        for contact in alegra.Contact.list_iter(max_pages=10, prefetch=True):  # Up to 300 contacts
+            if not isinstance(contact, dict):
+                continue
+            checked += 1
+            contact_id = get_contact_identification(contact)
+            if normalize_identification(contact_id) == clean_vendor_id:
+                print(f"Found matching contact: {contact.get('name')} with ID {contact_id}")
+                return {
+                    'id': contact['id'],
+                    'name': str(contact.get('name', '')),
+                    'identification': contact_id,
+                    'email': str(contact.get('email', ''))
+                }
         
-        print(f"No contact found with identification: {vendor_id}")
+        print(f"No contact found with identification: {vendor_id} after checking {checked} contacts")
         return None
     except Exception as e:
         print(f"Error searching for contact: {e}")
@@ -757,109 +736,458 @@ def find_contact_by_id(vendor_id):
         traceback.print_exc()
         return None
 
-@app.route('/api/upload', methods=['POST'])
-def upload_file():
+class UploadError(Exception):
+    """Error processing an uploaded invoice, with the HTTP status to report"""
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+def format_xml_invoice(xml_data):
+    """Format XML invoice data like the PDF extraction response"""
+    return {
+        'vendor_name': xml_data['vendor_name'],
+        'vendor_id': xml_data['vendor_id'],
+        'client_name': xml_data['client_name'],
+        'client_id': xml_data['client_id'],
+        'invoice_number': xml_data['invoice_number'],
+        'date': xml_data['date'],
+        'total': xml_data['total'],
+        'line_items': xml_data['line_items'],
+        'is_xml': True,
+        'document_type': xml_data['document_type'],
+        'raw_text': f"Factura XML de {xml_data['vendor_name'] or xml_data['vendor_id']}"
+    }
+
+def complete_xml_invoice_with_ai(extracted_data, missing, pdf_text):
+    """Fill the fields an XML invoice lacks from its PDF, asking the AI only for those"""
+    header_fields = [field for field in missing if field != 'line_items']
+    if not pdf_text or not is_ai_configured():
+        if header_fields:
+            # Regex extraction is local and cheap
+            header = extract_invoice_data(pdf_text)
+            for field in header_fields:
+                extracted_data[field] = header.get(field) or extracted_data[field]
+        return extracted_data
+    
+    header_future = ai_executor.submit(extract_payment_info_with_ai, pdf_text) if header_fields else None
+    if 'line_items' in missing:
+        print("🤖 XML has no line items, analyzing PDF with AI...")
+        extracted_data['line_items'] = analyze_invoice_items_with_ai(pdf_text, get_expense_accounts_for_ai())
+    if header_future:
+        print(f"🤖 XML is missing {', '.join(header_fields)}, completing them with AI...")
+        header = header_future.result()
+        for field in header_fields:
+            extracted_data[field] = header.get(field) or extracted_data[field]
+    return extracted_data
+
+def process_invoice_file(filepath, filename, document=None, xml_path=None):
+    """Extract invoice data from a saved PDF or XML file
+    
+    ``document`` is the result of parse_invoice_file when the file was
+    already parsed, e.g. in a worker process. ``xml_path`` is the electronic
+    invoice XML sent along with a PDF.
+    """
+    if document is None:
+        document = parse_invoice_file(filepath, filename, get_pdf_extractor(), xml_path)
+    
+    if document['is_xml']:
+        xml_data = document['xml_data']
+        if not xml_data:
+            raise UploadError('Error al procesar el archivo XML')
+        
+        # Format the response similar to PDF extraction
+        extracted_data = format_xml_invoice(xml_data)
+        extraction_metrics.record('xml')
+    elif document.get('xml_data'):
+        # The vendor's XML is authoritative; the PDF only fills what it lacks
+        xml_data = document['xml_data']
+        print(f"📄 Using XML from {document['xml_source']} for {filename}")
+        extracted_data = format_xml_invoice(xml_data)
+        missing = missing_xml_fields(xml_data)
+        if missing:
+            extracted_data = complete_xml_invoice_with_ai(extracted_data, missing, document['text'])
+        if document['text']:
+            extracted_data['raw_text'] = document['text']
+        extracted_data['xml_source'] = document['xml_source']
+        extraction_metrics.record('xml')
+    else:
+        pdf_text = document['text']
+        if not pdf_text:
+            raise UploadError('No se pudo extraer texto del PDF')
+        
+        # Recurring vendors are extracted with the layout learned from their earlier invoices
+        template_data = vendor_templates.apply(pdf_text)
+        
+        # Extract structured data from PDF using AI if available
+        merged = None
+        if template_data is None and is_ai_configured() and AI_EXTRACTION_MODE == 'merged':
+            print("🤖 Analyzing PDF with a single AI call...")
+            merged = extract_invoice_with_ai(pdf_text, get_expense_accounts_for_ai())
+            if merged is None:
+                print("Single-pass AI extraction failed, falling back to separate calls")
+        
+        if template_data is not None:
+            print(f"📐 Extracted with the template of vendor {template_data['template_vendor']}, skipping AI")
+            extracted_data = template_data
+            extraction_metrics.record('template')
+        elif merged is not None:
+            extracted_data, line_items = merged
+            extraction_metrics.record('ai')
+            if line_items:
+                extracted_data['line_items'] = line_items
+                print(f"✅ AI found {len(line_items)} line items")
+                vendor_templates.learn(pdf_text, extracted_data, line_items)
+            else:
+                print("❌ AI did not find any line items")
+        elif is_ai_configured():
+            # In hybrid mode the regex header is kept when it scores well
+            regex_data, confidence, issues = None, None, []
+            if AI_EXTRACTION_MODE == 'hybrid':
+                regex_data = extract_invoice_data(pdf_text)
+                confidence, issues = score_extraction(regex_data)
+            
+            # Use AI extraction for basic invoice info in the background while
+            # the categories are fetched and the line items are analyzed here
+            header_future = None
+            if regex_data is None or confidence < HYBRID_CONFIDENCE_THRESHOLD:
+                header_future = ai_executor.submit(extract_payment_info_with_ai, pdf_text)
+            
+            # Vendors with remembered categories only need the lines extracted
+            memory_vendor = category_memory.find_vendor(pdf_text)
+            expense_accounts = get_expense_accounts_for_ai() if memory_vendor is None else None
+            
+            # Extract line items with AI
+            print("🤖 Analyzing PDF with AI to extract line items...")
+            line_items = analyze_invoice_items_with_ai(pdf_text, expense_accounts, categorize=memory_vendor is None)
+            
+            if header_future is None:
+                # The regex header looked complete; check it against the line totals
+                confidence, issues = score_extraction(regex_data, line_items)
+            
+            if regex_data is not None and confidence >= HYBRID_CONFIDENCE_THRESHOLD:
+                print(f"✅ Regex header confidence {confidence:.2f}, skipping AI header extraction")
+                extracted_data = regex_data
+                extraction_metrics.record('regex', gated=True)
+            else:
+                if regex_data is not None:
+                    print(f"🤖 Regex header confidence {confidence:.2f} (failed: {', '.join(issues)}), using AI")
+                extracted_data = header_future.result() if header_future else extract_payment_info_with_ai(pdf_text)
+                extraction_metrics.record('ai', gated=regex_data is not None,
+                                          escalated=regex_data is not None, reasons=issues)
+            if confidence is not None:
+                extracted_data['extraction_confidence'] = confidence
+            
+            if line_items and len(line_items) > 0:
+                extracted_data['line_items'] = line_items
+                print(f"✅ AI found {len(line_items)} line items")
+                vendor_templates.learn(pdf_text, extracted_data, line_items)
+            else:
+                print("❌ AI did not find any line items")
+                extracted_data['line_items'] = []
+        else:
+            # Fallback to regex extraction
+            extracted_data = extract_invoice_data(pdf_text)
+            extracted_data['line_items'] = []  # No AI means no line items
+            extraction_metrics.record('regex')
+            
+        extracted_data['raw_text'] = pdf_text
+        extracted_data['is_xml'] = False
+    
+    if extracted_data.get('line_items'):
+        vendor_id = extracted_data.get('vendor_id') or (document.get('text') and category_memory.find_vendor(document['text']))
+        categorize_line_items(vendor_id, extracted_data['line_items'],
+                              use_ai=XML_AI_CATEGORIZATION or not extracted_data.get('is_xml'))
+    
+    duplicate_bill = bill_index.find(extracted_data.get('vendor_id'), extracted_data.get('invoice_number'),
+                                     extracted_data.get('total'))
+    if duplicate_bill:
+        print(f"⚠️ Invoice {extracted_data.get('invoice_number')} is already registered as bill {duplicate_bill['id']}")
+        extracted_data['duplicate_bill'] = duplicate_bill
+    
+    return extracted_data
+
+def remove_uploaded_files(*paths):
+    """Remove saved upload files, skipping missing ones"""
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+def run_upload_job(filepath, filename, xml_path=None):
+    """Process an uploaded file in a job worker and remove it afterwards"""
+    try:
+        return process_invoice_file(filepath, filename, xml_path=xml_path)
+    finally:
+        remove_uploaded_files(filepath, xml_path)
+
+def get_parse_executor():
+    """Get the process pool used to parse batch uploads and long PDFs"""
+    return parse_executor
+
+def get_pdf_extractor():
+    """Get the PDF extractor that splits long documents across the parse processes"""
+    global pdf_extractor
+    if pdf_extractor is None:
+        pdf_extractor = PDFTextExtractor(
+            executor=get_parse_executor(),
+            max_pages=PDF_MAX_PAGES,
+            timeout=PDF_TIMEOUT_SECONDS
+        )
+    return pdf_extractor
+
+def run_batch_file(filepath, filename, xml_path=None):
+    """Parse a batch file in the process pool, then extract its invoice data"""
+    try:
+        document = get_parse_executor().submit(
+            parse_invoice_file, filepath, filename, batch_pdf_extractor, xml_path
+        ).result()
+        return process_invoice_file(filepath, filename, document)
+    finally:
+        remove_uploaded_files(filepath, xml_path)
+
+def pair_batch_files(saved):
+    """Pair each PDF with the XML of the same name, if the batch has one
+    
+    Returns (filename, filepath, xml_path) for every invoice; XMLs paired with
+    a PDF are not processed on their own.
+    """
+    def stem(filename):
+        return os.path.splitext(filename)[0].lower()
+    
+    pdfs = {stem(filename) for filename, _ in saved if filename.lower().endswith('.pdf')}
+    xmls = {}
+    for filename, filepath in saved:
+        if filename.lower().endswith('.xml') and stem(filename) in pdfs:
+            xmls.setdefault(stem(filename), filepath)
+    
+    invoices = []
+    for filename, filepath in saved:
+        if filename.lower().endswith('.pdf'):
+            invoices.append((filename, filepath, xmls.get(stem(filename))))
+        elif filepath not in xmls.values():
+            invoices.append((filename, filepath, None))
+    return invoices
+
+def save_batch_files(files):
+    """Save the files of a batch upload, expanding zip archives
+    
+    Returns the saved (filename, filepath) pairs and the names of the files
+    that were skipped with the reason. An archive is skipped whole when its
+    declared sizes would take the batch past BATCH_MAX_UNCOMPRESSED.
+    """
+    saved, skipped = [], []
+    uncompressed = 0
+    allowed = tuple(app.config['ALLOWED_EXTENSIONS'])
+    
+    def add(name, source):
+        filename = secure_filename(os.path.basename(name))
+        if len(saved) >= BATCH_MAX_FILES:
+            skipped.append({'filename': name, 'error': f'Se superó el máximo de {BATCH_MAX_FILES} archivos'})
+        elif not filename.lower().endswith(allowed):
+            skipped.append({'filename': name, 'error': 'Tipo de archivo no permitido. Solo se aceptan PDF y XML.'})
+        else:
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{filename}")
+            with open(filepath, 'wb') as out:
+                shutil.copyfileobj(source, out)
+            saved.append((filename, filepath))
+    
+    for file in files:
+        if not file.filename:
+            continue
+        if not file.filename.lower().endswith('.zip'):
+            add(file.filename, file.stream)
+            continue
+        try:
+            with zipfile.ZipFile(file.stream) as archive:
+                entries = [info for info in archive.infolist()
+                           if not (info.is_dir() or info.filename.startswith('__MACOSX/')
+                                   or os.path.basename(info.filename).startswith('.'))]
+                # Reads stop at the declared file_size, so the sum bounds what is extracted
+                size = sum(info.file_size for info in entries if info.file_size <= app.config['MAX_CONTENT_LENGTH'])
+                if uncompressed + size > BATCH_MAX_UNCOMPRESSED:
+                    skipped.append({'filename': file.filename,
+                                    'error': f'El lote supera {BATCH_MAX_UNCOMPRESSED // (1024 * 1024)} MB descomprimidos'})
+                    continue
+                uncompressed += size
+                for info in entries:
+                    name = info.filename
+                    if info.file_size > app.config['MAX_CONTENT_LENGTH']:
+                        skipped.append({'filename': name, 'error': 'Archivo demasiado grande'})
+                        continue
+                    with archive.open(info) as source:
+                        add(name, source)
+        except zipfile.BadZipFile:
+            skipped.append({'filename': file.filename, 'error': 'Archivo ZIP inválido'})
+    
+    return saved, skipped
+
+def get_uploaded_file():
+    """Get the uploaded invoice file from the request, or an error response"""
     if 'file' not in request.files:
-        return jsonify({'error': 'No se encontró el archivo'}), 400
+        return None, (jsonify({'error': 'No se encontró el archivo'}), 400)
     
     file = request.files['file']
     if file.filename == '':
-        return jsonify({'error': 'No se seleccionó ningún archivo'}), 400
+        return None, (jsonify({'error': 'No se seleccionó ningún archivo'}), 400)
     
-    if file and file.filename.lower().endswith(tuple(app.config['ALLOWED_EXTENSIONS'])):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        # Check if it's XML or PDF
-        is_xml = filename.lower().endswith('.xml')
-        
-        if is_xml:
-            # Extract data from XML
-            xml_data = extract_data_from_xml(filepath)
-            if not xml_data:
-                return jsonify({'error': 'Error al procesar el archivo XML'}), 500
-            
-            # Format the response similar to PDF extraction
-            extracted_data = {
-                'vendor_name': xml_data['vendor_name'],
-                'vendor_id': xml_data['vendor_id'],
-                'client_name': xml_data['client_name'],
-                'client_id': xml_data['client_id'],
-                'invoice_number': xml_data['invoice_number'],
-                'date': xml_data['date'],
-                'total': xml_data['total'],
-                'line_items': xml_data['line_items'],
-                'is_xml': True,
-                'raw_text': f"Factura XML de {xml_data['vendor_name']}"
-            }
-        else:
-            # Extract PDF text
-            pdf_text = extract_text_from_pdf(filepath)
-            if not pdf_text:
-                return jsonify({'error': 'No se pudo extraer texto del PDF'}), 500
+    if not file.filename.lower().endswith(tuple(app.config['ALLOWED_EXTENSIONS'])):
+        return None, (jsonify({'error': 'Tipo de archivo no permitido. Solo se aceptan PDF y XML.'}), 400)
+    
+    return file, None
+
+def get_uploaded_xml(file):
+    """Get the optional XML sent along with an uploaded PDF, or an error response"""
+    xml_file = request.files.get('xml')
+    if xml_file is None or xml_file.filename == '':
+        return None, None
+    
+    if not xml_file.filename.lower().endswith('.xml') or not file.filename.lower().endswith('.pdf'):
+        return None, (jsonify({'error': 'El campo xml solo acepta un XML que acompañe a un PDF.'}), 400)
+    
+    return xml_file, None
+
+def save_uploaded_file(file):
+    """Save an uploaded file under a unique name and return its path"""
+    filename = secure_filename(file.filename)
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{filename}")
+    file.save(filepath)
+    return filename, filepath
+
+@app.route('/api/upload', methods=['POST'])
+def upload_file():
+    file, error = get_uploaded_file()
+    if not error:
+        xml_file, error = get_uploaded_xml(file)
+    if error:
+        return error
+    
+    filename, filepath = save_uploaded_file(file)
+    xml_path = save_uploaded_file(xml_file)[1] if xml_file else None
+    try:
+        extracted_data = process_invoice_file(filepath, filename, xml_path=xml_path)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    finally:
+        # Clean up - remove the uploaded files
+        remove_uploaded_files(filepath, xml_path)
+    
+    return jsonify({
+        'success': True,
+        'data': extracted_data
+    })
+
+@app.route('/api/upload/batch', methods=['POST'])
+def upload_batch():
+    """Process many invoices (files or zip archives) and stream the results
+    
+    The response is newline-delimited JSON: one line per file as soon as it
+    is processed, with the overall progress, and a final summary line.
+    """
+    files = request.files.getlist('files') or request.files.getlist('file')
+    saved, skipped = save_batch_files(files)
+    if not saved and not skipped:
+        return jsonify({'error': 'No se encontró el archivo'}), 400
+    invoices = pair_batch_files(saved)
+    
+    futures = {batch_executor.submit(run_batch_file, filepath, filename, xml_path): (index, filename, filepath, xml_path)
+               for index, (filename, filepath, xml_path) in enumerate(invoices)}
+    
+    def results():
+        progress = {'total': len(invoices) + len(skipped), 'completed': 0, 'succeeded': 0, 'failed': 0, 'skipped': 0}
+        try:
+            yield json.dumps({'type': 'start', 'progress': progress}) + '\n'
+            for item in skipped:
+                progress['completed'] += 1
+                progress['skipped'] += 1
+                yield json.dumps({'type': 'file', 'filename': item['filename'], 'status': 'skipped',
+                                  'error': item['error'], 'progress': progress}) + '\n'
             
-            # Extract structured data from PDF using AI if available
-            if (AI_PROVIDER == 'openai' and OPENAI_API_KEY) or (AI_PROVIDER == 'gemini' and GEMINI_API_KEY):
-                # Use AI extraction for basic invoice info
-                extracted_data = extract_payment_info_with_ai(pdf_text)
-                
-                # Get expense accounts for line item analysis
-                import base64
-                credentials = f"{alegra.user}:{alegra.token}"
-                encoded_credentials = base64.b64encode(credentials.encode()).decode()
-                headers = {
-                    'Authorization': f'Basic {encoded_credentials}',
-                    'Content-Type': 'application/json'
-                }
-                
-                expense_accounts = []
+            for future in as_completed(futures):
+                index, filename, _, _ = futures[future]
+                result = {'type': 'file', 'index': index, 'filename': filename}
                 try:
-                    accounts_response = requests.get(
-                        'https://api.alegra.com/api/v1/categories?limit=200',
-                        headers=headers
-                    )
-                    if accounts_response.status_code == 200:
-                        accounts = accounts_response.json()
-                        if isinstance(accounts, list):
-                            for a in accounts:
-                                if (a.get('type') == 'expense' and 
-                                    a.get('id') not in ['5066', '5065']):
-                                    expense_accounts.append({
-                                        'id': a['id'], 
-                                        'code': a.get('code', ''), 
-                                        'name': a['name'], 
-                                        'description': a.get('description', '')
-                                    })
+                    result['data'] = future.result()
+                    result['status'] = 'done'
+                    progress['succeeded'] += 1
                 except Exception as e:
-                    print(f"Error fetching expense accounts: {e}")
-                
-                # Extract line items with AI
-                print("🤖 Analyzing PDF with AI to extract line items...")
-                line_items = analyze_invoice_items_with_ai(pdf_text, expense_accounts)
-                if line_items and len(line_items) > 0:
-                    extracted_data['line_items'] = line_items
-                    print(f"✅ AI found {len(line_items)} line items")
-                else:
-                    print("❌ AI did not find any line items")
-                    extracted_data['line_items'] = []
+                    print(f"Error processing batch file {filename}: {e}")
+                    result['status'] = 'failed'
+                    result['error'] = str(e)
+                    progress['failed'] += 1
+                progress['completed'] += 1
+                result['progress'] = progress
+                yield json.dumps(result) + '\n'
+            
+            yield json.dumps({'type': 'summary', 'progress': progress}) + '\n'
+        finally:
+            # The client went away: drop the files that were never processed
+            for future, (_, _, filepath, xml_path) in futures.items():
+                if future.cancel():
+                    remove_uploaded_files(filepath, xml_path)
+    
+    return Response(stream_with_context(results()), mimetype='application/x-ndjson')
+
+@app.route('/api/upload/jobs', methods=['POST'])
+def create_upload_job():
+    """Queue an uploaded invoice for background processing"""
+    file, error = get_uploaded_file()
+    if not error:
+        xml_file, error = get_uploaded_xml(file)
+    if error:
+        return error
+    
+    filename, filepath = save_uploaded_file(file)
+    xml_path = save_uploaded_file(xml_file)[1] if xml_file else None
+    job = upload_jobs.submit(run_upload_job, filepath, filename, xml_path)
+    return jsonify({
+        'success': True,
+        'job_id': job['id'],
+        'status': job['status'],
+        'status_url': f"/api/upload/jobs/{job['id']}"
+    }), 202
+
+def format_upload_job(job):
+    """Format a job snapshot like the /api/upload response"""
+    response = {
+        'job_id': job['id'],
+        'status': job['status']
+    }
+    if job['status'] == 'done':
+        response['success'] = True
+        response['data'] = job['result']
+    elif job['status'] == 'failed':
+        response['success'] = False
+        response['error'] = job['error']
+    return response
+
+@app.route('/api/upload/jobs/<job_id>', methods=['GET'])
+def get_upload_job(job_id):
+    """Get the status and result of an upload job"""
+    job = upload_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(format_upload_job(job))
+
+@app.route('/api/upload/jobs/<job_id>/events', methods=['GET'])
+def stream_upload_job(job_id):
+    """Stream upload job status changes as server-sent events"""
+    job = upload_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    
+    def events(job):
+        version = None
+        while job:
+            if job['version'] != version:
+                version = job['version']
+                yield f"data: {json.dumps(format_upload_job(job))}\n\n"
+                if job['status'] in upload_jobs.FINISHED:
+                    return
             else:
-                # Fallback to regex extraction
-                extracted_data = extract_invoice_data(pdf_text)
-                extracted_data['line_items'] = []  # No AI means no line items
-                
-            extracted_data['raw_text'] = pdf_text
-            extracted_data['is_xml'] = False
-        
-        # Clean up - remove the uploaded file
-        os.remove(filepath)
-        
-        return jsonify({
-            'success': True,
-            'data': extracted_data
-        })
+                yield ": keep-alive\n\n"
+            job = upload_jobs.wait_for_change(job_id, version)
     
-    return jsonify({'error': 'Tipo de archivo no permitido. Solo se aceptan PDF y XML.'}), 400
+    return Response(stream_with_context(events(job)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
 
 @app.route('/api/contacts/search', methods=['GET'])
 def search_contacts():
@@ -867,91 +1195,31 @@ def search_contacts():
         query = request.args.get('q', '')
         
         # Clean the query for identification search
-        clean_query = re.sub(r'[\s\-\.]+', '', query.strip())
+        clean_query = normalize_identification(query)
         
-        # Use direct API call to get contacts
-        import base64
-        credentials = f"{alegra.user}:{alegra.token}"
-        encoded_credentials = base64.b64encode(credentials.encode()).decode()
+        # Serve from the local contact index when it is warm
+        if contact_index.ready:
+            return jsonify({'contacts': contact_index.search(query, limit=10)})
         
-        headers = {
-            'Authorization': f'Basic {encoded_credentials}',
-            'Content-Type': 'application/json'
-        }
-        
-        # If searching by ID, try to get all contacts (pagination)
-        all_contacts = []
+        # If searching by ID, stream contacts page by page until a match
         if clean_query.isdigit() and len(clean_query) >= 9:
-            page = 1
-            limit = 30
-            max_pages = 5  # Limit to prevent infinite loops
-            
-            while page <= max_pages:
-                api_response = requests.get(
-                    f'https://api.alegra.com/api/v1/contacts?limit={limit}&start={(page-1)*limit}',
-                    headers=headers
-                )
-                
-                if api_response.status_code == 200:
-                    contacts_page = api_response.json()
-                    if isinstance(contacts_page, list):
-                        all_contacts.extend(contacts_page)
-                        # Check if we found the contact we're looking for
-                        for contact in contacts_page:
-                            if isinstance(contact, dict):
-                                # Handle both formats: string directly or object with 'number'
-                                contact_id_info = contact.get('identification', '')
-                                if isinstance(contact_id_info, dict):
-                                    contact_id = str(contact_id_info.get('number', ''))
-                                else:
-                                    contact_id = str(contact_id_info)
-                                
-                                if re.sub(r'[\s\-\.]+', '', contact_id) == clean_query:
-                                    print(f"Found contact on page {page}: {contact.get('name')}")
-                                    all_contacts = [contact]  # Just return this one
-                                    page = max_pages + 1  # Exit loop
-                                    break
-                        
-                        if len(contacts_page) < limit or page >= max_pages:
-                            break
-                        page += 1
-                    else:
-                        break
-                else:
+            data = []
+            for contact in alegra.Contact.list_iter(max_pages=5, prefetch=True):  # Limit to prevent long scans
+                if not isinstance(contact, dict):
+                    continue
+                data.append(contact)
+                if normalize_identification(get_contact_identification(contact)) == clean_query:
+                    print(f"Found contact: {contact.get('name')}")
+                    data = [contact]  # Just return this one
                     break
             
-            data = all_contacts
-            print(f"Searched {page-1} pages, total contacts checked: {len(all_contacts)}")
+            print(f"Total contacts checked: {len(data)}")
         else:
             # For name searches, just get first page
-            api_response = requests.get(
-                'https://api.alegra.com/api/v1/contacts?limit=30',
-                headers=headers
-            )
-            
-            if api_response.status_code == 200:
-                data = api_response.json()
-            else:
-                print(f"API Error Response: {api_response.text}")
-                data = []
-            
-        # Handle the response
-        contacts = []
-        if isinstance(data, list):
-            contacts = data
-            print(f"Got {len(contacts)} contacts from API")
-        elif isinstance(data, dict):
-            # Check for error response
-            if 'code' in data and 'message' in data:
-                print(f"API Error: {data.get('code')} - {data.get('message')}")
-                contacts = []
-            # Check for data wrapper
-            elif 'data' in data:
-                contacts = data['data']
-                print(f"Got {len(contacts)} contacts from API (wrapped in 'data')")
-            else:
-                print(f"Unexpected response structure: {list(data.keys())[:5]}")
-                contacts = []
+            data = list(alegra.Contact.list_iter(max_pages=1))
+        
+        contacts = data
+        print(f"Got {len(contacts)} contacts from API")
         
         # Filter contacts by name or identification
         filtered_contacts = []
@@ -966,15 +1234,10 @@ def search_contacts():
         for contact in contacts:
             if isinstance(contact, dict):
                 contact_name = str(contact.get('name', ''))
-                # Handle both formats: string directly or object with 'number'
-                contact_id_info = contact.get('identification', '')
-                if isinstance(contact_id_info, dict):
-                    contact_id = str(contact_id_info.get('number', ''))
-                else:
-                    contact_id = str(contact_id_info)
+                contact_id = get_contact_identification(contact)
                 
                 # Clean contact ID for comparison
-                clean_contact_id = re.sub(r'[\s\-\.]+', '', contact_id)
+                clean_contact_id = normalize_identification(contact_id)
                 
                 # Check if query matches name or identification
                 match_by_name = query.lower() in contact_name.lower()
@@ -1006,7 +1269,7 @@ def create_contact():
         data = request.json
         
         # Create contact in Alegra
-        response = alegra.Contact.create(
+        contact = alegra.Contact.create(
             name=data['name'],
             identification={
                 "type": "CC",  # Cédula for Costa Rica
@@ -1017,16 +1280,11 @@ def create_contact():
             address={
                 "city": "San José, Costa Rica"  # Default city
             }
-        )
+        ).data
+        
+        # Make the new contact available to lookups right away
+        contact_index.upsert(contact)
         
-        # Handle response
-        if hasattr(response, 'json'):
-            contact = response.json()
-        elif hasattr(response, 'content'):
-            contact = json.loads(response.content.decode('utf-8'))
-        else:
-            contact = response
-            
         # Handle both formats for identification
         contact_id = ''
         if 'identification' in contact:
@@ -1047,506 +1305,660 @@ def create_contact():
     except Exception as e:
         return jsonify({'error': f'Error creando contacto: {str(e)}'}), 500
 
-@app.route('/api/payments/register', methods=['POST'])
-def register_payment():
+class BillError(Exception):
+    """Error building a bill from a registration request, with the HTTP status to report"""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def get_alegra_headers():
+    """Build the headers for direct calls to the Alegra API"""
+    import base64
+    credentials = f"{alegra.user}:{alegra.token}"
+    encoded_credentials = base64.b64encode(credentials.encode()).decode()
+    return {
+        'Authorization': f'Basic {encoded_credentials}',
+        'Content-Type': 'application/json'
+    }
+
+def resolve_bill_references(headers):
+    """Resolve the item, expense categories and taxes used to build bills
+    
+    Done once per registration request, so a batch shares them.
+    """
+    # Check if we have any items first
     try:
-        data = request.json
+        items = reference_cache.get('items')
+    except Exception as e:
+        print(f"Could not fetch items: {e}")
+        items = None
+    
+    default_item_id = None
+    if items:
+        # Use item ID 6 which works for purchases
+        # Try to find it specifically, or use the highest ID as fallback
+        purchase_item = None
+        for item in items:
+            if str(item.get('id')) == '6':
+                purchase_item = item
+                break
         
-        # First, get the accounting catalog and taxes
-        import base64
-        credentials = f"{alegra.user}:{alegra.token}"
-        encoded_credentials = base64.b64encode(credentials.encode()).decode()
-        headers = {
-            'Authorization': f'Basic {encoded_credentials}',
-            'Content-Type': 'application/json'
+        if purchase_item:
+            default_item_id = int(purchase_item.get('id'))
+            print(f"Using purchase item ID: {default_item_id} - {purchase_item.get('name')}")
+        else:
+            # Fallback to highest ID
+            items_sorted = sorted(items, key=lambda x: int(x.get('id', 0)), reverse=True)
+            default_item_id = int(items_sorted[0].get('id'))
+            print(f"Using highest ID item: {default_item_id} - {items_sorted[0].get('name')}")
+    elif items is not None:
+        print("No items found, will create one")
+    
+    # If no items exist, create a default one
+    if not default_item_id:
+        print("Creating default item...")
+        new_item_data = {
+            'name': 'Servicios y Compras Generales',
+            'description': 'Item genérico para facturas de proveedores',
+            'price': 0,  # Price will be set per invoice
+            'reference': 'SERV-GENERAL',
+            'type': 'service'  # Service type doesn't require inventory
         }
         
-        # Check if we have any items first
-        items_response = requests.get(
-            'https://api.alegra.com/api/v1/items?limit=30',
+        create_item_response = requests.post(
+            'https://api.alegra.com/api/v1/items',
+            json=new_item_data,
             headers=headers
         )
         
-        default_item_id = None
-        if items_response.status_code == 200:
-            items = items_response.json()
-            if isinstance(items, list) and len(items) > 0:
-                # Use item ID 6 which works for purchases
-                # Try to find it specifically, or use the highest ID as fallback
-                purchase_item = None
-                for item in items:
-                    if str(item.get('id')) == '6':
-                        purchase_item = item
-                        break
-                
-                if purchase_item:
-                    default_item_id = int(purchase_item.get('id'))
-                    print(f"Using purchase item ID: {default_item_id} - {purchase_item.get('name')}")
-                else:
-                    # Fallback to highest ID
-                    items_sorted = sorted(items, key=lambda x: int(x.get('id', 0)), reverse=True)
-                    default_item_id = int(items_sorted[0].get('id'))
-                    print(f"Using highest ID item: {default_item_id} - {items_sorted[0].get('name')}")
-            else:
-                print("No items found, will create one")
-        
-        # If no items exist, create a default one
-        if not default_item_id:
-            print("Creating default item...")
-            new_item_data = {
-                'name': 'Servicios y Compras Generales',
-                'description': 'Item genérico para facturas de proveedores',
-                'price': 0,  # Price will be set per invoice
-                'reference': 'SERV-GENERAL',
-                'type': 'service'  # Service type doesn't require inventory
-            }
-            
-            create_item_response = requests.post(
-                'https://api.alegra.com/api/v1/items',
-                json=new_item_data,
-                headers=headers
-            )
-            
-            if create_item_response.status_code in [200, 201]:
-                created_item = create_item_response.json()
-                default_item_id = int(created_item.get('id'))  # Ensure it's an integer
-                print(f"Created default item with ID: {default_item_id}")
-            else:
-                print(f"Failed to create item: {create_item_response.text}")
-        
-        # Initialize category IDs
-        default_expense_id = None  # Don't default to parent Egresos
-        grocery_expense_id = None
-        generic_expense_id = None
-        
-        # Get expense accounts
-        accounts_response = requests.get(
-            'https://api.alegra.com/api/v1/categories?limit=200',
-            headers=headers
-        )
-        expense_accounts = []
-        all_expense_categories = {}
-        
-        if accounts_response.status_code == 200:
-            accounts = accounts_response.json()
-            if isinstance(accounts, list):
-                # Filter for expense accounts
-                for a in accounts:
-                    # Check if it's an expense type and NOT a parent category
-                    if (a.get('type') == 'expense' and 
-                        a.get('id') not in ['5066', '5065'] and  # Exclude parent categories
-                        a.get('name', '').lower() not in ['egresos', 'ingresos']):  # Exclude main parent names
-                        
-                        expense_accounts.append({
-                            'id': a['id'], 
-                            'code': a.get('code', ''), 
-                            'name': a['name'], 
-                            'description': a.get('description', '')
-                        })
-                        # Store for easy lookup
-                        all_expense_categories[a['name'].lower()] = a['id']
-                        
-                print(f"Found {len(expense_accounts)} expense accounts")
-                
-                # Find specific categories for common expense types
-                for acc in expense_accounts:
-                    name_lower = acc['name'].lower()
-                    
-                    # Look for grocery/food related categories
-                    if any(word in name_lower for word in ['compra', 'mercadería', 'inventario', 'costo de venta', 'producto', 'mercancía']):
-                        if not grocery_expense_id:
-                            grocery_expense_id = int(acc['id'])  # Ensure integer
-                            print(f"Found grocery/inventory category: {acc['name']} (ID: {acc['id']})")
-                    
-                    # Look for general expense categories
-                    elif any(word in name_lower for word in ['otros gastos', 'gastos varios', 'gastos generales', 'otros']):
-                        if not generic_expense_id:
-                            generic_expense_id = int(acc['id'])  # Ensure integer
-                            print(f"Found generic expense category: {acc['name']} (ID: {acc['id']})")
-                    
-                    # Set a default if we haven't found one yet
-                    elif not default_expense_id and 'salario' not in name_lower and 'nómina' not in name_lower:
-                        default_expense_id = int(acc['id'])  # Ensure integer
-                
-                # If we didn't find specific categories, use any available expense account
-                if not grocery_expense_id and expense_accounts:
-                    # Try to find "Costo de ventas" or similar
-                    for acc in expense_accounts:
-                        if ('costo' in acc['name'].lower() or 'compra' in acc['name'].lower()) and acc['id'] != '5076':
-                            grocery_expense_id = int(acc['id'])  # Ensure integer
-                            print(f"Using cost/purchase category: {acc['name']} (ID: {acc['id']})")
-                            break
-                
-                # Set default IDs with fallback chain
-                if not default_expense_id:
-                    if generic_expense_id:
-                        default_expense_id = generic_expense_id
-                    elif grocery_expense_id:
-                        default_expense_id = grocery_expense_id
-                    elif expense_accounts:
-                        # Use first non-salary expense account
-                        for acc in expense_accounts:
-                            if acc['id'] != '5076' and 'salario' not in acc['name'].lower():
-                                default_expense_id = int(acc['id'])  # Ensure integer
-                                break
-                        if not default_expense_id and expense_accounts:
-                            default_expense_id = int(expense_accounts[0]['id'])  # Ensure integer
-                
-                # If still no expense categories, create one
-                if not default_expense_id and len(expense_accounts) == 0:
-                    print("No expense categories found, creating one...")
-                    new_category_data = {
-                        'name': 'Compras y Servicios',
-                        'type': 'expense',
-                        'parent': 5066,  # Parent is Egresos
-                        'description': 'Gastos generales de compras y servicios'
-                    }
-                    
-                    create_cat_response = requests.post(
-                        'https://api.alegra.com/api/v1/categories',
-                        json=new_category_data,
-                        headers=headers
-                    )
-                    
-                    if create_cat_response.status_code in [200, 201]:
-                        created_cat = create_cat_response.json()
-                        default_expense_id = int(created_cat.get('id'))  # Ensure integer
-                        print(f"Created expense category with ID: {default_expense_id}")
-                    else:
-                        print(f"Failed to create category: {create_cat_response.text}")
+        if create_item_response.status_code in [200, 201]:
+            created_item = create_item_response.json()
+            default_item_id = int(created_item.get('id'))  # Ensure it's an integer
+            reference_cache.invalidate('items')
+            print(f"Created default item with ID: {default_item_id}")
+        else:
+            print(f"Failed to create item: {create_item_response.text}")
+    
+    # Initialize category IDs
+    default_expense_id = None  # Don't default to parent Egresos
+    grocery_expense_id = None
+    generic_expense_id = None
+    
+    # Get expense accounts
+    try:
+        accounts = reference_cache.get('categories')
+    except Exception as e:
+        print(f"Could not fetch expense categories: {e}")
+        accounts = None
+    expense_accounts = []
+    all_expense_categories = {}
+    
+    if isinstance(accounts, list):
+        # Filter for expense accounts
+        for a in accounts:
+            # Check if it's an expense type and NOT a parent category
+            if (a.get('type') == 'expense' and 
+                a.get('id') not in ['5066', '5065'] and  # Exclude parent categories
+                a.get('name', '').lower() not in ['egresos', 'ingresos']):  # Exclude main parent names
                 
-                print(f"Default expense category ID: {default_expense_id}")
-                print(f"Grocery category ID: {grocery_expense_id}")
-                print(f"Generic expense category ID: {generic_expense_id}")
+                expense_accounts.append({
+                    'id': a['id'], 
+                    'code': a.get('code', ''), 
+                    'name': a['name'], 
+                    'description': a.get('description', '')
+                })
+                # Store for easy lookup
+                all_expense_categories[a['name'].lower()] = a['id']
                 
-        else:
-            print(f"Could not fetch expense categories: {accounts_response.status_code}")
+        print(f"Found {len(expense_accounts)} expense accounts")
         
-        # Get taxes
-        taxes_response = requests.get(
-            'https://api.alegra.com/api/v1/taxes',
-            headers=headers
-        )
-        available_taxes = []
-        tax_ids_by_percentage = {}
-        iva_tax_id = None
-        
-        if taxes_response.status_code == 200:
-            taxes = taxes_response.json()
-            available_taxes = taxes
+        # Find specific categories for common expense types
+        for acc in expense_accounts:
+            name_lower = acc['name'].lower()
             
-            # Create a mapping of percentage to tax ID
-            for tax in taxes:
-                if isinstance(tax, dict):
-                    percentage = float(tax.get('percentage', 0))
-                    tax_ids_by_percentage[percentage] = int(tax['id'])
-                    
-                    # Keep backwards compatibility for default IVA tax
-                    if 'IVA' in tax.get('name', '').upper() or percentage == 13:
-                        iva_tax_id = int(tax['id'])
-                        
-            print(f"Available tax mappings: {tax_ids_by_percentage}")
-            print(f"Default IVA tax ID: {iva_tax_id}")
-        
-        # Process line items - either from XML or analyze with AI
-        line_items_data = []
-        
-        if data.get('lineItems'):
-            # If line items are already provided (from XML)
-            print("Using pre-extracted line items from XML")
-            line_items_data = data['lineItems']
-        elif data.get('pdfText'):
-            # Analyze PDF text with AI
-            print("Analyzing PDF with AI to extract line items")
-            line_items_data = analyze_invoice_items_with_ai(data['pdfText'], expense_accounts)
+            # Look for grocery/food related categories
+            if any(word in name_lower for word in ['compra', 'mercadería', 'inventario', 'costo de venta', 'producto', 'mercancía']):
+                if not grocery_expense_id:
+                    grocery_expense_id = int(acc['id'])  # Ensure integer
+                    print(f"Found grocery/inventory category: {acc['name']} (ID: {acc['id']})")
             
-            # If AI returned a dict with line_items key, extract it
-            if isinstance(line_items_data, dict) and 'line_items' in line_items_data:
-                line_items_data = line_items_data['line_items']
-        
-        print(f"Found {len(line_items_data)} line items")
-        
-        # Create a purchase invoice (factura de proveedor)
-        purchase_data = {
-            'date': data['date'],
-            'dueDate': data['date'],  # Same as invoice date for now
-            'provider': int(data['contactId']),  # The vendor/provider
-            'numberTemplate': {
-                'number': data.get('invoiceNumber', '')  # Invoice number from PDF
-            },
-            'paymentMethod': data.get('paymentMethod', 'cash'),
-            'observations': data.get('description', ''),
-            'anotation': f"Factura registrada desde PDF: {data.get('description', '')}"
-        }
-        
-        # Decide whether to use items or categories based on what's available
-        # Force categories for purchase bills - items are for sales
-        use_items = False  # Don't use items for purchases
-        use_categories = True  # Always use categories for expenses
-        
-        # Use 5077 (Gastos Generales) as default if no expense categories found
-        if not default_expense_id or default_expense_id in ['5066', '5065']:
-            default_expense_id = 5077
-            print(f"Using default expense category ID: {default_expense_id} (Gastos Generales)")
-        
-        print(f"Use items: {use_items} (item ID: {default_item_id})")
-        print(f"Use categories: {use_categories} (category ID: {default_expense_id})")
-        
-        if use_items:
-            # Use items approach - this is more reliable
-            print("Using items approach for bill creation")
+            # Look for general expense categories
+            elif any(word in name_lower for word in ['otros gastos', 'gastos varios', 'gastos generales', 'otros']):
+                if not generic_expense_id:
+                    generic_expense_id = int(acc['id'])  # Ensure integer
+                    print(f"Found generic expense category: {acc['name']} (ID: {acc['id']})")
             
-            # Calculate total amount from line items or use provided amount
-            total_amount = float(data['amount'])
-            if line_items_data:
-                calculated_total = sum(
-                    float(item.get('amount', 0)) if 'amount' in item 
-                    else float(item.get('unit_price', 0)) * float(item.get('quantity', 1))
-                    for item in line_items_data
-                )
-                if calculated_total > 0:
-                    total_amount = calculated_total
+            # Set a default if we haven't found one yet
+            elif not default_expense_id and 'salario' not in name_lower and 'nómina' not in name_lower:
+                default_expense_id = int(acc['id'])  # Ensure integer
+        
+        # If we didn't find specific categories, use any available expense account
+        if not grocery_expense_id and expense_accounts:
+            # Try to find "Costo de ventas" or similar
+            for acc in expense_accounts:
+                if ('costo' in acc['name'].lower() or 'compra' in acc['name'].lower()) and acc['id'] != '5076':
+                    grocery_expense_id = int(acc['id'])  # Ensure integer
+                    print(f"Using cost/purchase category: {acc['name']} (ID: {acc['id']})")
+                    break
+        
+        # Set default IDs with fallback chain
+        if not default_expense_id:
+            if generic_expense_id:
+                default_expense_id = generic_expense_id
+            elif grocery_expense_id:
+                default_expense_id = grocery_expense_id
+            elif expense_accounts:
+                # Use first non-salary expense account
+                for acc in expense_accounts:
+                    if acc['id'] != '5076' and 'salario' not in acc['name'].lower():
+                        default_expense_id = int(acc['id'])  # Ensure integer
+                        break
+                if not default_expense_id and expense_accounts:
+                    default_expense_id = int(expense_accounts[0]['id'])  # Ensure integer
+        
+        # If still no expense categories, create one
+        if not default_expense_id and len(expense_accounts) == 0:
+            print("No expense categories found, creating one...")
+            new_category_data = {
+                'name': 'Compras y Servicios',
+                'type': 'expense',
+                'parent': 5066,  # Parent is Egresos
+                'description': 'Gastos generales de compras y servicios'
+            }
             
-            # Create items list for purchases.items structure
-            items_list = []
+            create_cat_response = requests.post(
+                'https://api.alegra.com/api/v1/categories',
+                json=new_category_data,
+                headers=headers
+            )
             
-            if line_items_data and len(line_items_data) > 0:
-                # Create an item entry for each line item
-                for idx, item in enumerate(line_items_data):
-                    amount = float(item.get('amount', 0))
-                    if 'unit_price' in item and 'quantity' in item:
-                        amount = float(item['unit_price']) * float(item.get('quantity', 1))
-                    
-                    item_entry = {
-                        'id': str(default_item_id),  # Ensure it's a string
-                        'price': amount,
-                        'quantity': float(item.get('quantity', 1))
-                    }
-                    
-                    # Add tax if applicable - support multiple tax percentages
-                    tax_percentage = float(item.get('tax_percentage', 0))
-                    if tax_percentage > 0 and tax_percentage in tax_ids_by_percentage:
-                        tax_id = tax_ids_by_percentage[tax_percentage]
-                        item_entry['tax'] = [{'id': tax_id}]
-                        print(f"Applied {tax_percentage}% tax (ID: {tax_id}) to item")
-                    elif item.get('has_tax') and iva_tax_id:
-                        # Fallback to default IVA tax for backwards compatibility
-                        item_entry['tax'] = [{'id': iva_tax_id}]
-                        print(f"Applied default IVA tax (ID: {iva_tax_id}) to item")
-                    
-                    items_list.append(item_entry)
+            if create_cat_response.status_code in [200, 201]:
+                created_cat = create_cat_response.json()
+                default_expense_id = int(created_cat.get('id'))  # Ensure integer
+                reference_cache.invalidate('categories')
+                print(f"Created expense category with ID: {default_expense_id}")
             else:
-                # Single item for the entire invoice
-                item_entry = {
-                    'id': str(default_item_id),  # Ensure it's a string
-                    'price': total_amount,
-                    'quantity': 1
-                }
+                print(f"Failed to create category: {create_cat_response.text}")
+        
+        print(f"Default expense category ID: {default_expense_id}")
+        print(f"Grocery category ID: {grocery_expense_id}")
+        print(f"Generic expense category ID: {generic_expense_id}")
+    
+    # Get taxes
+    try:
+        taxes = reference_cache.get('taxes')
+    except Exception as e:
+        print(f"Could not fetch taxes: {e}")
+        taxes = None
+    available_taxes = []
+    tax_ids_by_percentage = {}
+    iva_tax_id = None
+    
+    if taxes is not None:
+        available_taxes = taxes
+        
+        # Create a mapping of percentage to tax ID
+        for tax in taxes:
+            if isinstance(tax, dict):
+                percentage = float(tax.get('percentage', 0))
+                tax_ids_by_percentage[percentage] = int(tax['id'])
                 
-                # Add tax
-                if iva_tax_id:
-                    item_entry['tax'] = [{'id': iva_tax_id}]
-                    
-                items_list.append(item_entry)
-            
-            # Use purchases.items structure for bills
-            purchase_data['purchases'] = {
-                'items': items_list
-            }
-            
-            print(f"Using {len(items_list)} items in purchases.items structure")
-            
-        elif use_categories:
-            # Use categories approach as fallback
-            print("Using categories approach for bill creation")
-            
-            # Build categories from line items
-            categories = []
-            
-            if line_items_data:
-                # Process each line item
-                for idx, item in enumerate(line_items_data):
-                    # Find the account ID for this item
-                    account_id = item.get('account_id')
-                    
-                    # If no account_id from AI or XML, use default
-                    if not account_id:
-                        account_id = 5077  # Gastos Generales
-                        print(f"Line {idx+1}: No category determined by AI, using default ID: {account_id} (Gastos Generales)")
-                    else:
-                        # Ensure account_id is integer if provided
-                        account_id = int(account_id)
-                        print(f"Line {idx+1}: AI assigned category ID: {account_id}")
-                    
-                    # Calculate the amount (handle both unit_price * quantity and direct amount)
-                    if 'unit_price' in item and 'quantity' in item:
-                        amount = float(item['unit_price']) * float(item.get('quantity', 1))
-                    else:
-                        amount = float(item.get('amount', 0))
-                    
-                    # Build category entry
-                    category_entry = {
-                        'id': account_id,
-                        'price': amount,
-                        'quantity': float(item.get('quantity', 1)),
-                        'observations': item.get('description', f'Línea {idx+1}')
-                    }
-                    
-                    # Add tax if applicable - support multiple tax percentages
-                    tax_percentage = float(item.get('tax_percentage', 0))
-                    if tax_percentage > 0 and tax_percentage in tax_ids_by_percentage:
-                        tax_id = tax_ids_by_percentage[tax_percentage]
-                        category_entry['tax'] = [{'id': tax_id}]
-                        print(f"Applied {tax_percentage}% tax (ID: {tax_id}) to category")
-                    elif item.get('has_tax') and iva_tax_id:
-                        # Fallback to default IVA tax for backwards compatibility
-                        category_entry['tax'] = [{'id': iva_tax_id}]
-                        print(f"Applied default IVA tax (ID: {iva_tax_id}) to category")
+                # Keep backwards compatibility for default IVA tax
+                if 'IVA' in tax.get('name', '').upper() or percentage == 13:
+                    iva_tax_id = int(tax['id'])
                     
-                    categories.append(category_entry)
-            
-            # If no categories yet, create a default one
-            if not categories:
-                print("No line items found, creating default category")
-                categories.append({
-                    'id': 5077,  # Gastos Generales as fallback
-                    'price': float(data['amount']),
-                    'quantity': 1,
-                    'observations': data.get('description', 'Servicio'),
-                    'tax': [{'id': iva_tax_id}] if iva_tax_id else []
-                })
-            
-            purchase_data['purchases'] = {
-                'categories': categories
-            }
-            print(f"Using {len(categories)} categories for bill")
+        print(f"Available tax mappings: {tax_ids_by_percentage}")
+        print(f"Default IVA tax ID: {iva_tax_id}")
+    
+    return {
+        'default_item_id': default_item_id,
+        'default_expense_id': default_expense_id,
+        'expense_accounts': expense_accounts,
+        'tax_ids_by_percentage': tax_ids_by_percentage,
+        'iva_tax_id': iva_tax_id
+    }
+
+def build_purchase_data(data, refs):
+    """Build the Alegra bill for a registration request
+    
+    Returns the bill data and the line items it was built from.
+    """
+    default_item_id = refs['default_item_id']
+    default_expense_id = refs['default_expense_id']
+    expense_accounts = refs['expense_accounts']
+    tax_ids_by_percentage = refs['tax_ids_by_percentage']
+    iva_tax_id = refs['iva_tax_id']
+    
+    # Process line items - either from XML or analyze with AI
+    line_items_data = []
+    
+    if data.get('lineItems'):
+        # If line items are already provided (from XML)
+        print("Using pre-extracted line items from XML")
+        line_items_data = data['lineItems']
+    elif data.get('pdfText'):
+        # Analyze PDF text with AI
+        print("Analyzing PDF with AI to extract line items")
+        line_items_data = analyze_invoice_items_with_ai(data['pdfText'], expense_accounts)
+        
+        # If AI returned a dict with line_items key, extract it
+        if isinstance(line_items_data, dict) and 'line_items' in line_items_data:
+            line_items_data = line_items_data['line_items']
+    
+    print(f"Found {len(line_items_data)} line items")
+    
+    # Create a purchase invoice (factura de proveedor)
+    purchase_data = {
+        'date': data['date'],
+        'dueDate': data['date'],  # Same as invoice date for now
+        'provider': int(data['contactId']),  # The vendor/provider
+        'numberTemplate': {
+            'number': data.get('invoiceNumber', '')  # Invoice number from PDF
+        },
+        'paymentMethod': data.get('paymentMethod', 'cash'),
+        'observations': data.get('description', ''),
+        'anotation': f"Factura registrada desde PDF: {data.get('description', '')}"
+    }
+    
+    # Decide whether to use items or categories based on what's available
+    # Force categories for purchase bills - items are for sales
+    use_items = False  # Don't use items for purchases
+    use_categories = True  # Always use categories for expenses
+    
+    # Use 5077 (Gastos Generales) as default if no expense categories found
+    if not default_expense_id or default_expense_id in ['5066', '5065']:
+        default_expense_id = 5077
+        print(f"Using default expense category ID: {default_expense_id} (Gastos Generales)")
+    
+    print(f"Use items: {use_items} (item ID: {default_item_id})")
+    print(f"Use categories: {use_categories} (category ID: {default_expense_id})")
+    
+    if use_items:
+        # Use items approach - this is more reliable
+        print("Using items approach for bill creation")
+        
+        # Calculate total amount from line items or use provided amount
+        total_amount = float(data['amount'])
+        if line_items_data:
+            calculated_total = sum(
+                float(item.get('amount', 0)) if 'amount' in item 
+                else float(item.get('unit_price', 0)) * float(item.get('quantity', 1))
+                for item in line_items_data
+            )
+            if calculated_total > 0:
+                total_amount = calculated_total
+        
+        # Create items list for purchases.items structure
+        items_list = []
+        
+        if line_items_data and len(line_items_data) > 0:
+            # Create an item entry for each line item
+            for idx, item in enumerate(line_items_data):
+                amount = float(item.get('amount', 0))
+                if 'unit_price' in item and 'quantity' in item:
+                    amount = float(item['unit_price']) * float(item.get('quantity', 1))
+                
+                item_entry = {
+                    'id': str(default_item_id),  # Ensure it's a string
+                    'price': amount,
+                    'quantity': float(item.get('quantity', 1))
+                }
+                
+                # Add tax if applicable - support multiple tax percentages
+                tax_percentage = float(item.get('tax_percentage', 0))
+                if tax_percentage > 0 and tax_percentage in tax_ids_by_percentage:
+                    tax_id = tax_ids_by_percentage[tax_percentage]
+                    item_entry['tax'] = [{'id': tax_id}]
+                    print(f"Applied {tax_percentage}% tax (ID: {tax_id}) to item")
+                elif item.get('has_tax') and iva_tax_id:
+                    # Fallback to default IVA tax for backwards compatibility
+                    item_entry['tax'] = [{'id': iva_tax_id}]
+                    print(f"Applied default IVA tax (ID: {iva_tax_id}) to item")
+                
+                items_list.append(item_entry)
         else:
-            # Neither items nor valid categories available
-            return jsonify({
-                'error': 'No se encontraron items ni categorías contables válidas. Por favor configure al menos un item o categoría de gastos en Alegra.'
-            }), 400
+            # Single item for the entire invoice
+            item_entry = {
+                'id': str(default_item_id),  # Ensure it's a string
+                'price': total_amount,
+                'quantity': 1
+            }
+            
+            # Add tax
+            if iva_tax_id:
+                item_entry['tax'] = [{'id': iva_tax_id}]
+                
+            items_list.append(item_entry)
+        
+        # Use purchases.items structure for bills
+        purchase_data['purchases'] = {
+            'items': items_list
+        }
         
-        print(f"Purchase data: {json.dumps(purchase_data, indent=2)}")
+        print(f"Using {len(items_list)} items in purchases.items structure")
         
-        # Create purchase invoice using direct API call
-        response = requests.post(
-            'https://api.alegra.com/api/v1/bills',
-            json=purchase_data,
-            headers=headers
-        )
+    elif use_categories:
+        # Use categories approach as fallback
+        print("Using categories approach for bill creation")
         
-        if response.status_code == 201:
-            bill = response.json()
-            
-            # Return line items info for UI display
-            response_data = {
-                'success': True,
-                'bill': {
-                    'id': bill['id'],
-                    'number': bill.get('numberTemplate', {}).get('fullNumber', ''),
-                    'amount': bill.get('total', 0)
-                },
-                'lineItems': []
-            }
-            
-            # Add line items info for UI
-            if 'purchases' in purchase_data and 'items' in purchase_data['purchases']:
-                # If we used purchases.items structure
-                for item in purchase_data['purchases']['items']:
-                    response_data['lineItems'].append({
-                        'description': data.get('description', 'Servicio'),
-                        'amount': item.get('price', 0),
-                        'hasTax': bool(item.get('tax'))
-                    })
-            elif 'purchases' in purchase_data and 'categories' in purchase_data['purchases']:
-                # If we used purchases.categories structure
-                for cat in purchase_data['purchases']['categories']:
-                    response_data['lineItems'].append({
-                        'description': cat.get('observations', cat.get('description', 'Servicio')),
-                        'amount': cat.get('price', 0),
-                        'hasTax': bool(cat.get('tax'))
-                    })
-            
-            # If createPayment is true and paymentMethod is not 'credit', create a payment for this bill
-            if data.get('createPayment', True) and data.get('paymentMethod', 'cash') != 'credit':
-                payment_data = {
-                    'date': data['date'],
-                    'bankAccount': 1,  # Default bank account
-                    'paymentMethod': data.get('paymentMethod', 'cash'),
-                    'type': 'out',  # Outgoing payment (expense)
-                    'bills': [{
-                        'id': bill['id'],
-                        'amount': float(data['amount'])
-                    }],
-                    'provider': int(data['contactId']),
-                    'observations': f"Pago de factura {bill.get('numberTemplate', {}).get('fullNumber', '')}"
-                }
+        # Build categories from line items
+        categories = []
+        
+        if line_items_data:
+            # Process each line item
+            for idx, item in enumerate(line_items_data):
+                # Find the account ID for this item
+                account_id = item.get('account_id')
                 
-                payment_response = requests.post(
-                    'https://api.alegra.com/api/v1/payments',
-                    json=payment_data,
-                    headers=headers
-                )
+                # If no account_id from AI or XML, use default
+                if not account_id:
+                    account_id = 5077  # Gastos Generales
+                    print(f"Line {idx+1}: No category determined by AI, using default ID: {account_id} (Gastos Generales)")
+                else:
+                    # Ensure account_id is integer if provided
+                    account_id = int(account_id)
+                    print(f"Line {idx+1}: AI assigned category ID: {account_id}")
                 
-                if payment_response.status_code == 201:
-                    payment = payment_response.json()
-                    response_data['payment'] = {
-                        'id': payment['id'],
-                        'amount': payment['amount']
-                    }
+                # Calculate the amount (handle both unit_price * quantity and direct amount)
+                if 'unit_price' in item and 'quantity' in item:
+                    amount = float(item['unit_price']) * float(item.get('quantity', 1))
                 else:
-                    # Bill created but payment failed
-                    response_data['warning'] = f'Factura creada pero el pago falló: {payment_response.text}'
-            
-            return jsonify(response_data)
-        else:
-            print(f"Error response from Alegra: {response.text}")
-            return jsonify({
-                'error': f'Error creando factura de compra: {response.text}'
-            }), response.status_code
-            
+                    amount = float(item.get('amount', 0))
+                
+                # Build category entry
+                category_entry = {
+                    'id': account_id,
+                    'price': amount,
+                    'quantity': float(item.get('quantity', 1)),
+                    'observations': item.get('description', f'Línea {idx+1}')
+                }
+                
+                # Add tax if applicable - support multiple tax percentages
+                tax_percentage = float(item.get('tax_percentage', 0))
+                if tax_percentage > 0 and tax_percentage in tax_ids_by_percentage:
+                    tax_id = tax_ids_by_percentage[tax_percentage]
+                    category_entry['tax'] = [{'id': tax_id}]
+                    print(f"Applied {tax_percentage}% tax (ID: {tax_id}) to category")
+                elif item.get('has_tax') and iva_tax_id:
+                    # Fallback to default IVA tax for backwards compatibility
+                    category_entry['tax'] = [{'id': iva_tax_id}]
+                    print(f"Applied default IVA tax (ID: {iva_tax_id}) to category")
+                
+                categories.append(category_entry)
+        
+        # If no categories yet, create a default one
+        if not categories:
+            print("No line items found, creating default category")
+            categories.append({
+                'id': 5077,  # Gastos Generales as fallback
+                'price': float(data['amount']),
+                'quantity': 1,
+                'observations': data.get('description', 'Servicio'),
+                'tax': [{'id': iva_tax_id}] if iva_tax_id else []
+            })
+        
+        purchase_data['purchases'] = {
+            'categories': categories
+        }
+        print(f"Using {len(categories)} categories for bill")
+    else:
+        # Neither items nor valid categories available
+        raise BillError('No se encontraron items ni categorías contables válidas. Por favor configure al menos un item o categoría de gastos en Alegra.')
+    
+    return purchase_data, line_items_data
+
+def create_payment(payment_data):
+    """Create a payment in Alegra, returning it or raising with Alegra's error
+    
+    Client errors (4xx) mean Alegra did not record the payment and raise
+    PaymentRejected; server errors and timeouts leave it unknown.
+    """
+    try:
+        return alegra.Payment.create(**payment_data).data
+    except alegra.AlegraError as e:
+        if e.status_code is not None and e.status_code < 500:
+            raise ledger.PaymentRejected(e.message) from e
+        raise
+
+def find_bill_payment(bill_id):
+    """Find the payment recorded for a bill in Alegra, or None"""
+    payments = alegra.Bill.retrieve(bill_id).get('payments') or []
+    return payments[-1] if payments else None
+
+def ledger_duplicate_response(entry):
+    """Answer a submission of an invoice the ledger already has"""
+    if entry['state'] in ledger.REGISTERED_STATES:
+        response_data = dict(entry['response'] or {'success': True})
+        response_data['duplicate'] = True
+        response_data['submissionId'] = entry['id']
+        print(f"Invoice already registered as bill {entry['bill_id']}, not posting it again")
+        return response_data, 200
+    if entry['state'] == ledger.PENDING:
+        return {'error': 'Esta factura ya se está registrando', 'submissionId': entry['id']}, 409
+    return {
+        'error': 'No se sabe si esta factura quedó registrada en Alegra. Revísela y, si no existe, '
+                 f'libérela con POST /api/ledger/{entry["id"]}/release para volver a enviarla.',
+        'submissionId': entry['id']
+    }, 409
+
+def get_bill_vendor_id(data):
+    """Get the vendor cédula of a registration request, from its contact if not given"""
+    if data.get('vendorId'):
+        return data['vendorId']
+    if not data.get('contactId'):
+        return ''
+    contact = contact_index.find_by_id(data['contactId'])
+    if contact:
+        return contact['identification']
+    try:
+        return get_contact_identification(fetch_alegra_object(alegra.Contact, data['contactId']))
+    except Exception as e:
+        print(f"Error fetching contact {data['contactId']}: {e}")
+        return ''
+
+def submit_bill(data, refs=None):
+    """Create the bill of a registration request and its payment in Alegra
+    
+    The invoice is claimed in the submission ledger first, so an invoice
+    that was already registered is answered without calling Alegra. An
+    invoice the bill index already has from Alegra is rejected unless
+    ``allowDuplicate`` is set. ``refs`` are resolved here when not given.
+    Returns the response data and its HTTP status.
+    """
+    vendor_id = get_bill_vendor_id(data)
+    key = ledger.submission_key(vendor_id, data.get('invoiceNumber'), data.get('amount'))
+    submission_id = None
+    if key[0] and key[1]:
+        entry, claimed = submission_ledger.claim(key, data.get('date'))
+        if not claimed:
+            return ledger_duplicate_response(entry)
+        submission_id = entry['id']
+    else:
+        print("No vendor cédula or invoice number, registering without the submission ledger")
+    
+    duplicate_bill = bill_index.find(vendor_id, data.get('invoiceNumber'), data.get('amount'))
+    if duplicate_bill and not data.get('allowDuplicate'):
+        submission_ledger.transition(submission_id, ledger.BILL_FAILED, f"duplicate of bill {duplicate_bill['id']}",
+                                     error='duplicate')
+        return {
+            'error': f"Esta factura ya está registrada en Alegra (factura de compra {duplicate_bill['id']}). "
+                     'Envíela con allowDuplicate para registrarla de todos modos.',
+            'duplicateBill': duplicate_bill
+        }, 409
+    
+    try:
+        if refs is None:
+            refs = resolve_bill_references(get_alegra_headers())
+        purchase_data, line_items_data = build_purchase_data(data, refs)
+    except Exception as e:
+        submission_ledger.transition(submission_id, ledger.BILL_FAILED, str(e)[:500], error=str(e)[:500])
+        raise
+    
+    print(f"Purchase data: {json.dumps(purchase_data, indent=2)}")
+    
+    # Create purchase invoice
+    try:
+        bill = alegra.Bill.create(**purchase_data).data
+    except alegra.AlegraError as e:
+        print(f"Error response from Alegra: {e}")
+        # Only client errors (4xx) mean Alegra did not record the bill; after a
+        # server error or gateway timeout it may exist, like in create_payment
+        state = ledger.BILL_FAILED if e.status_code is not None and e.status_code < 500 else ledger.UNKNOWN
+        submission_ledger.transition(submission_id, state, str(e)[:500], error=str(e)[:500])
+        return {
+            'error': f'Error creando factura de compra: {e.message}',
+            'submissionId': submission_id
+        }, e.status_code or 502
+    except Exception as e:
+        # The request may have reached Alegra, so the bill must not be posted again blindly
+        submission_ledger.transition(submission_id, ledger.UNKNOWN, str(e)[:500], error=str(e)[:500])
+        raise
+    
+    # Remember the categories for this vendor's next invoices
+    category_memory.record(vendor_id, line_items_data)
+    bill_index.add(vendor_id, data.get('invoiceNumber'), data.get('amount'), bill['id'], data.get('date', ''))
+    
+    # Return line items info for UI display
+    response_data = {
+        'success': True,
+        'bill': {
+            'id': bill['id'],
+            'number': bill.get('numberTemplate', {}).get('fullNumber', ''),
+            'amount': bill.get('total', 0)
+        },
+        'lineItems': []
+    }
+    
+    # Add line items info for UI
+    if 'purchases' in purchase_data and 'items' in purchase_data['purchases']:
+        # If we used purchases.items structure
+        for item in purchase_data['purchases']['items']:
+            response_data['lineItems'].append({
+                'description': data.get('description', 'Servicio'),
+                'amount': item.get('price', 0),
+                'hasTax': bool(item.get('tax'))
+            })
+    elif 'purchases' in purchase_data and 'categories' in purchase_data['purchases']:
+        # If we used purchases.categories structure
+        for cat in purchase_data['purchases']['categories']:
+            response_data['lineItems'].append({
+                'description': cat.get('observations', cat.get('description', 'Servicio')),
+                'amount': cat.get('price', 0),
+                'hasTax': bool(cat.get('tax'))
+            })
+    
+    # If createPayment is true and paymentMethod is not 'credit', create a payment for this bill
+    if data.get('createPayment', True) and data.get('paymentMethod', 'cash') != 'credit':
+        payment_data = {
+            'date': data['date'],
+            'bankAccount': 1,  # Default bank account
+            'paymentMethod': data.get('paymentMethod', 'cash'),
+            'type': 'out',  # Outgoing payment (expense)
+            'bills': [{
+                'id': bill['id'],
+                'amount': float(data['amount'])
+            }],
+            'provider': int(data['contactId']),
+            'observations': f"Pago de factura {bill.get('numberTemplate', {}).get('fullNumber', '')}"
+        }
+        
+        # The payment is claimed along with the bill, so the resume worker leaves it alone;
+        # if it fails the ledger retries or looks it up in the background
+        submission_ledger.transition(submission_id, ledger.PAYMENT_PENDING, bill_id=str(bill['id']),
+                                     payment_data=payment_data, response=response_data)
+        response_data = submission_ledger.post_payment(submission_id, payment_data, create_payment, response_data)
+    else:
+        submission_ledger.transition(submission_id, ledger.COMPLETED, bill_id=str(bill['id']),
+                                     response=response_data)
+    
+    return response_data, 200
+
+@app.route('/api/payments/register', methods=['POST'])
+def register_payment():
+    try:
+        data = request.json
+        response_data, status_code = submit_bill(data)
+        return jsonify(response_data), status_code
+    except BillError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({'error': f'Error registrando factura: {str(e)}'}), 500
 
+def register_batch_bill(index, data, refs):
+    """Register one bill of a batch, turning errors into its result"""
+    try:
+        response_data, status_code = submit_bill(data, refs)
+    except BillError as e:
+        response_data, status_code = {'error': str(e)}, e.status_code
+    except KeyError as e:
+        response_data, status_code = {'error': f'Falta el campo {e}'}, 400
+    except Exception as e:
+        response_data, status_code = {'error': f'Error registrando factura: {str(e)}'}, 500
+    response_data.update(index=index, status=status_code, success=status_code == 200)
+    return response_data
+
+@app.route('/api/payments/register/batch', methods=['POST'])
+def register_payments_batch():
+    """Register many prepared bills and their payments in one request
+    
+    Takes {"bills": [...]} with each bill shaped like the body of
+    /api/payments/register. The items, categories and taxes are resolved
+    once for the whole batch and the bills are submitted in parallel; each
+    result carries the index of its bill so failed ones can be retried.
+    """
+    bills = (request.get_json(silent=True) or {}).get('bills')
+    if not isinstance(bills, list) or not bills:
+        return jsonify({'error': 'Se requiere una lista de facturas en "bills"'}), 400
+    if len(bills) > BILL_BATCH_MAX:
+        return jsonify({'error': f'Máximo {BILL_BATCH_MAX} facturas por lote'}), 400
+    
+    try:
+        refs = resolve_bill_references(get_alegra_headers())
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': f'Error registrando facturas: {str(e)}'}), 500
+    
+    futures = [bill_executor.submit(register_batch_bill, index, data, refs) for index, data in enumerate(bills)]
+    results = [future.result() for future in futures]
+    registered = sum(1 for result in results if result['success'])
+    print(f"Registered {registered} of {len(bills)} bills")
+    return jsonify({
+        'success': registered == len(bills),
+        'registered': registered,
+        'failed': len(bills) - registered,
+        'results': results
+    })
+
+@app.route('/api/ledger', methods=['GET'])
+def list_submissions():
+    """List the bill submissions in the ledger, optionally filtered by state"""
+    limit = min(int(request.args.get('limit', 100)), 1000)
+    return jsonify({'submissions': submission_ledger.list(request.args.get('state'), limit)})
+
+@app.route('/api/ledger/<int:submission_id>', methods=['GET'])
+def get_submission(submission_id):
+    entry = submission_ledger.get(submission_id)
+    if entry is None:
+        return jsonify({'error': 'Registro no encontrado'}), 404
+    entry['history'] = submission_ledger.history(submission_id)
+    return jsonify(entry)
+
+@app.route('/api/ledger/<int:submission_id>/release', methods=['POST'])
+def release_submission(submission_id):
+    """Allow an invoice whose bill post failed midway to be submitted again"""
+    if not submission_ledger.release(submission_id):
+        return jsonify({'error': 'Solo se pueden liberar registros en estado desconocido'}), 409
+    return jsonify({'success': True})
+
 @app.route('/api/contacts/all', methods=['GET'])
 def get_all_contacts():
     """Get all contacts with pagination"""
     try:
-        import base64
-        credentials = f"{alegra.user}:{alegra.token}"
-        encoded_credentials = base64.b64encode(credentials.encode()).decode()
-        
-        headers = {
-            'Authorization': f'Basic {encoded_credentials}',
-            'Content-Type': 'application/json'
-        }
-        
-        all_contacts = []
-        page = 1
-        limit = 30
-        
-        # Fetch all pages
-        while True:
-            print(f"Fetching page {page}...")
-            response = requests.get(
-                f'https://api.alegra.com/api/v1/contacts?limit={limit}&start={(page-1)*limit}',
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                contacts = response.json()
-                if isinstance(contacts, list):
-                    all_contacts.extend(contacts)
-                    if len(contacts) < limit:
-                        break  # No more pages
-                    page += 1
-                else:
-                    break
-            else:
-                print(f"Error on page {page}: {response.status_code}")
-                break
+        # Fetch all pages concurrently
+        all_contacts = alegra.Contact.list_all(max_workers=ALEGRA_PAGE_WORKERS)
         
         print(f"Total contacts fetched: {len(all_contacts)}")
         
@@ -1590,37 +2002,8 @@ def get_all_contacts():
 def get_accounts_catalog():
     """Get the accounting accounts catalog"""
     try:
-        import base64
-        credentials = f"{alegra.user}:{alegra.token}"
-        encoded_credentials = base64.b64encode(credentials.encode()).decode()
-        
-        headers = {
-            'Authorization': f'Basic {encoded_credentials}',
-            'Content-Type': 'application/json'
-        }
-        
         # Get all accounting accounts
-        all_accounts = []
-        page = 1
-        limit = 100
-        
-        while True:
-            response = requests.get(
-                f'https://api.alegra.com/api/v1/categories?limit={limit}&start={(page-1)*limit}',
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                accounts = response.json()
-                if isinstance(accounts, list):
-                    all_accounts.extend(accounts)
-                    if len(accounts) < limit:
-                        break
-                    page += 1
-                else:
-                    break
-            else:
-                break
+        all_accounts = reference_cache.get('categories')
         
         # Filter and organize accounts
         expense_accounts = []
@@ -1649,35 +2032,23 @@ def get_accounts_catalog():
 def get_taxes():
     """Get available taxes"""
     try:
-        import base64
-        credentials = f"{alegra.user}:{alegra.token}"
-        encoded_credentials = base64.b64encode(credentials.encode()).decode()
-        
-        headers = {
-            'Authorization': f'Basic {encoded_credentials}',
-            'Content-Type': 'application/json'
-        }
+        try:
+            taxes = reference_cache.get('taxes')
+        except Exception as e:
+            print(f"Error getting taxes: {e}")
+            return jsonify({'error': 'Error getting taxes'}), 500
         
-        response = requests.get(
-            'https://api.alegra.com/api/v1/taxes',
-            headers=headers
-        )
+        # Focus on IVA/sales tax
+        sales_taxes = []
+        for tax in taxes:
+            if isinstance(tax, dict) and 'IVA' in tax.get('name', '').upper():
+                sales_taxes.append({
+                    'id': tax.get('id'),
+                    'name': tax.get('name'),
+                    'percentage': tax.get('percentage', 0)
+                })
         
-        if response.status_code == 200:
-            taxes = response.json()
-            # Focus on IVA/sales tax
-            sales_taxes = []
-            for tax in taxes:
-                if isinstance(tax, dict) and 'IVA' in tax.get('name', '').upper():
-                    sales_taxes.append({
-                        'id': tax.get('id'),
-                        'name': tax.get('name'),
-                        'percentage': tax.get('percentage', 0)
-                    })
-            
-            return jsonify({'taxes': sales_taxes})
-        else:
-            return jsonify({'error': 'Error getting taxes'}), 500
+        return jsonify({'taxes': sales_taxes})
             
     except Exception as e:
         return jsonify({'error': f'Error: {str(e)}'}), 500
@@ -1685,28 +2056,13 @@ def get_taxes():
 @app.route('/api/bank-accounts', methods=['GET'])
 def get_bank_accounts():
     try:
-        # Get bank accounts using direct API call
-        import requests
-        import base64
-        
-        credentials = f"{alegra.user}:{alegra.token}"
-        encoded_credentials = base64.b64encode(credentials.encode()).decode()
-        
-        headers = {
-            'Authorization': f'Basic {encoded_credentials}',
-            'Content-Type': 'application/json'
-        }
-        
-        response = requests.get(
-            'https://api.alegra.com/api/v1/bank-accounts',
-            headers=headers
-        )
-        
-        if response.status_code == 200:
-            accounts = response.json()
-            return jsonify({'accounts': accounts})
-        else:
+        try:
+            accounts = reference_cache.get('bank_accounts')
+        except Exception as e:
+            print(f"Error getting bank accounts: {e}")
             return jsonify({'error': 'Error obteniendo cuentas bancarias'}), 500
+        
+        return jsonify({'accounts': accounts})
             
     except Exception as e:
         return jsonify({'error': f'Error: {str(e)}'}), 500
@@ -1773,66 +2129,52 @@ def debug_categories():
 def get_expense_categories():
     """Get expense subcategories"""
     try:
-        import base64
-        credentials = f"{alegra.user}:{alegra.token}"
-        encoded_credentials = base64.b64encode(credentials.encode()).decode()
+        # Get the specific expense category (Egresos) which has id 5066
+        try:
+            category = reference_cache.get('expense_parent')
+        except requests.HTTPError as e:
+            return jsonify({'error': e.response.text}), e.response.status_code
         
-        headers = {
-            'Authorization': f'Basic {encoded_credentials}',
-            'Content-Type': 'application/json'
-        }
+        # Get children categories if they exist
+        children = category.get('children', [])
         
-        # Get the specific expense category (Egresos) which has id 5066
-        response = requests.get(
-            'https://api.alegra.com/api/v1/categories/5066',
-            headers=headers
-        )
+        # If no children in the response, try to get all categories and filter
+        if not children:
+            try:
+                all_categories = reference_cache.get('categories')
+            except Exception as e:
+                print(f"Error fetching categories: {e}")
+                all_categories = None
+            if all_categories is not None:
+                # Find expense type categories that are not top-level
+                expense_categories = []
+                for cat in all_categories:
+                    if isinstance(cat, dict):
+                        # Check if it's an expense category and has a proper code
+                        if (cat.get('type') == 'expense' and 
+                            cat.get('id') != '5066' and  # Not the parent Egresos
+                            cat.get('code') is not None):
+                            expense_categories.append({
+                                'id': cat['id'],
+                                'code': cat.get('code', ''),
+                                'name': cat['name'],
+                                'description': cat.get('description', '')
+                            })
+                
+                return jsonify({
+                    'expense_categories': expense_categories,
+                    'total': len(expense_categories)
+                })
         
-        if response.status_code == 200:
-            category = response.json()
-            
-            # Get children categories if they exist
-            children = category.get('children', [])
-            
-            # If no children in the response, try to get all categories and filter
-            if not children:
-                all_response = requests.get(
-                    'https://api.alegra.com/api/v1/categories?limit=200',
-                    headers=headers
-                )
-                if all_response.status_code == 200:
-                    all_categories = all_response.json()
-                    # Find expense type categories that are not top-level
-                    expense_categories = []
-                    for cat in all_categories:
-                        if isinstance(cat, dict):
-                            # Check if it's an expense category and has a proper code
-                            if (cat.get('type') == 'expense' and 
-                                cat.get('id') != '5066' and  # Not the parent Egresos
-                                cat.get('code') is not None):
-                                expense_categories.append({
-                                    'id': cat['id'],
-                                    'code': cat.get('code', ''),
-                                    'name': cat['name'],
-                                    'description': cat.get('description', '')
-                                })
-                    
-                    return jsonify({
-                        'expense_categories': expense_categories,
-                        'total': len(expense_categories)
-                    })
-            
-            return jsonify({
-                'parent': {
-                    'id': category.get('id'),
-                    'name': category.get('name'),
-                    'type': category.get('type')
-                },
-                'children': children,
-                'has_children': len(children) > 0
-            })
-        else:
-            return jsonify({'error': response.text}), response.status_code
+        return jsonify({
+            'parent': {
+                'id': category.get('id'),
+                'name': category.get('name'),
+                'type': category.get('type')
+            },
+            'children': children,
+            'has_children': len(children) > 0
+        })
             
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1935,6 +2277,7 @@ def create_expense_category():
         )
         
         if response.status_code in [200, 201]:
+            reference_cache.invalidate('categories')
             return jsonify({
                 'success': True,
                 'category': response.json()
@@ -1951,73 +2294,58 @@ def create_expense_category():
 def system_init():
     """Check and initialize system with default items/categories if needed"""
     try:
-        import base64
-        credentials = f"{alegra.user}:{alegra.token}"
-        encoded_credentials = base64.b64encode(credentials.encode()).decode()
-        
-        headers = {
-            'Authorization': f'Basic {encoded_credentials}',
-            'Content-Type': 'application/json'
-        }
-        
         # Check items
-        items_response = requests.get(
-            'https://api.alegra.com/api/v1/items?limit=10',
-            headers=headers
-        )
+        try:
+            items = reference_cache.get('items')[:10]
+        except Exception as e:
+            print(f"Error fetching items: {e}")
+            items = []
         
-        items_count = 0
+        items_count = len(items)
         default_item = None
-        if items_response.status_code == 200:
-            items = items_response.json()
-            if isinstance(items, list):
-                items_count = len(items)
-                for item in items:
-                    if 'general' in item.get('name', '').lower() or 'servicio' in item.get('name', '').lower():
-                        default_item = {
-                            'id': item.get('id'),
-                            'name': item.get('name'),
-                            'reference': item.get('reference')
-                        }
-                        break
+        for item in items:
+            if 'general' in item.get('name', '').lower() or 'servicio' in item.get('name', '').lower():
+                default_item = {
+                    'id': item.get('id'),
+                    'name': item.get('name'),
+                    'reference': item.get('reference')
+                }
+                break
         
         # Check expense categories
-        categories_response = requests.get(
-            'https://api.alegra.com/api/v1/categories?limit=200',
-            headers=headers
-        )
+        try:
+            categories = reference_cache.get('categories')
+        except Exception as e:
+            print(f"Error fetching categories: {e}")
+            categories = []
         
         expense_categories = []
-        if categories_response.status_code == 200:
-            categories = categories_response.json()
-            if isinstance(categories, list):
-                for cat in categories:
-                    if (cat.get('type') == 'expense' and 
-                        cat.get('id') not in ['5066', '5065'] and
-                        cat.get('name', '').lower() not in ['egresos', 'ingresos']):
-                        expense_categories.append({
-                            'id': cat.get('id'),
-                            'code': cat.get('code'),
-                            'name': cat.get('name')
-                        })
+        for cat in categories:
+            if (cat.get('type') == 'expense' and 
+                cat.get('id') not in ['5066', '5065'] and
+                cat.get('name', '').lower() not in ['egresos', 'ingresos']):
+                expense_categories.append({
+                    'id': cat.get('id'),
+                    'code': cat.get('code'),
+                    'name': cat.get('name')
+                })
         
         # Get taxes
-        taxes_response = requests.get(
-            'https://api.alegra.com/api/v1/taxes',
-            headers=headers
-        )
+        try:
+            taxes = reference_cache.get('taxes')
+        except Exception as e:
+            print(f"Error fetching taxes: {e}")
+            taxes = []
         
         iva_tax = None
-        if taxes_response.status_code == 200:
-            taxes = taxes_response.json()
-            for tax in taxes:
-                if isinstance(tax, dict) and ('IVA' in tax.get('name', '').upper() or tax.get('percentage') == 13):
-                    iva_tax = {
-                        'id': tax.get('id'),
-                        'name': tax.get('name'),
-                        'percentage': tax.get('percentage')
-                    }
-                    break
+        for tax in taxes:
+            if isinstance(tax, dict) and ('IVA' in tax.get('name', '').upper() or tax.get('percentage') == 13):
+                iva_tax = {
+                    'id': tax.get('id'),
+                    'name': tax.get('name'),
+                    'percentage': tax.get('percentage')
+                }
+                break
         
         return jsonify({
             'items': {
@@ -2111,6 +2439,7 @@ def system_setup():
                 if create_response.status_code in [200, 201]:
                     created_item = create_response.json()
                     created['items'].append(created_item)
+                    reference_cache.invalidate('items')
                     print(f"Created item: {created_item.get('name')} (ID: {created_item.get('id')})")
                 else:
                     error_msg = f"Error creating item {item_data['name']}: {create_response.text}"
@@ -2192,6 +2521,7 @@ def create_purchase_item():
         
         if response.status_code in [200, 201]:
             item = response.json()
+            reference_cache.invalidate('items')
             return jsonify({
                 'success': True,
                 'item': item,
@@ -2205,6 +2535,20 @@ def create_purchase_item():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    """Drop cached reference data so the next request reloads it from Alegra"""
+    name = (request.get_json(silent=True) or {}).get('name')
+    if name == 'ai':
+        ai_cache.clear()
+    elif name == 'templates':
+        vendor_templates.clear()
+    elif name == 'category_memory':
+        category_memory.clear()
+    else:
+        reference_cache.invalidate(name)
+    return jsonify({'success': True, 'invalidated': name or 'all'})
+
 def get_tax_id_by_percentage(percentage, all_taxes):
     """Get tax ID based on percentage"""
     for tax in all_taxes:
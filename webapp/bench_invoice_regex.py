@@ -0,0 +1,124 @@
+"""Benchmark the regex invoice extractor.
+
+Compares the scanner in invoice_regex with case-insensitive searches of
+each pattern on the raw text (how the fields used to be extracted), checks
+that both return the same fields and prints the time per invoice. Uses the sample texts below, plus any .txt invoice texts
+in the directories given as arguments:
+
+    python bench_invoice_regex.py [texts_dir ...]
+"""
+import os
+import re
+import sys
+import time
+
+from invoice_regex import FIELD_PATTERNS, FLAGS, extract_invoice_data, looks_like_cedula, normalize_date, parse_amount
+
+
+SAMPLE_TEXTS = [
+    """CLARO CR TELECOMUNICACIONES S.A.
+Cédula Jurídica: 3-101-460479
+FACTURA ELECTRONICA
+Factura: 00100001010000012345
+Fecha: 24/05/2025
+Cliente: CHATY S.A.
+Plan Postpago 10,000.00
+Seguro equipo 2,000.00
+Total: ₡12,775.00
+""",
+    """WALMART
+CORPORACION SUPERMERCADOS UNIDOS
+Identificación del Emisor: 3101011234
+No. de documento: 45678
+05-03-2025
+LECHE 2L  1,250.00
+PAN CUADRADO  1,800.00
+ARROZ 1KG  1,100.00
+TOTAL A PAGAR CRC 4,150.00
+""",
+    """Proveedor: Servicios Contables del Este
+Numero de factura 3101123456
+No. 778
+12/1/25
+Honorarios profesionales marzo
+Monto Total 250,000
+""",
+    """Razón Social: ASEGURADORA DEL ISTMO
+RUC: 3-101-555555
+Documento: POL-2025-11
+PRIMA NETA GRAVADA 2%  2,510.08
+PRIMA NETA GRAVADA 13%  1,893.56
+total 4,403.64
+""",
+    """ESTACION DE SERVICIO LA SABANA
+A00123
+36.13 litros combustible Super
+Total 25000
+""",
+]
+
+
+def load_corpus(directories):
+    texts = list(SAMPLE_TEXTS)
+    for directory in directories:
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.txt'):
+                with open(os.path.join(directory, name), encoding='utf-8') as f:
+                    texts.append(f.read())
+    return texts
+
+def separate_searches(text):
+    """Reference implementation: one case-insensitive search per pattern in priority order"""
+    values = {}
+    for field, patterns in FIELD_PATTERNS.items():
+        for pattern in patterns:
+            match = re.search(pattern, text, FLAGS)
+            if not match:
+                continue
+            value = match.group(1).strip()
+            if field == 'invoice_number' and looks_like_cedula(value):
+                continue
+            values[field] = value
+            break
+    total = parse_amount(values.get('total'))
+    return {
+        'vendor_name': values.get('vendor_name') or values.get('known_vendor', '').upper(),
+        'vendor_id': values.get('vendor_id', '').replace('-', ''),
+        'client_name': '',
+        'client_id': '',
+        'invoice_number': values.get('invoice_number', ''),
+        'date': normalize_date(values.get('date')),
+        'total': total,
+        'amount': total
+    }
+
+def bench(fn, texts, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in texts:
+            fn(text)
+    return (time.perf_counter() - start) / (rounds * len(texts))
+
+def main():
+    texts = load_corpus(sys.argv[1:])
+    mismatches = 0
+    for i, text in enumerate(texts):
+        expected, actual = separate_searches(text), extract_invoice_data(text)
+        if expected != actual:
+            mismatches += 1
+            print(f"Text {i} differs:\n  case-insensitive: {expected}\n  scanner:          {actual}")
+
+    # Long statements, where every missing field costs a scan of the whole text
+    long_texts = [text + '\n'.join(f"Linea {n} producto {n}  1,000.00" for n in range(500)) for text in texts]
+    rounds = 200
+    for label, corpus in (('short', texts), ('long', long_texts)):
+        reference = bench(separate_searches, corpus, rounds if label == 'short' else rounds // 10)
+        scanner = bench(extract_invoice_data, corpus, rounds if label == 'short' else rounds // 10)
+        print(f"{label:5} texts: case-insensitive searches {reference * 1e6:8.1f} µs, "
+              f"scanner {scanner * 1e6:8.1f} µs ({reference / scanner:.1f}x)")
+    print(f"{len(texts)} texts, {mismatches} mismatches")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
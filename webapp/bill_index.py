@@ -0,0 +1,190 @@
+import threading
+import time
+
+import alegra
+
+from contact_index import normalize_identification, get_contact_identification, record_id
+from submission_ledger import normalize_invoice_number
+
+
+def bill_key(vendor_id, invoice_number, amount):
+    """Key of a supplier invoice: vendor cédula, invoice number and whole amount
+
+    The amount is rounded to whole units so the bill total Alegra computes
+    from the lines still matches the invoice total.
+    """
+    vendor_id = normalize_identification(vendor_id or '')
+    number = normalize_invoice_number(invoice_number)
+    try:
+        amount = round(float(amount))
+    except (TypeError, ValueError):
+        return None
+    if not vendor_id or not number:
+        return None
+    return vendor_id, number, amount
+
+
+class BillIndex:
+    """In-memory index of the supplier bills registered in Alegra.
+
+    Bills are keyed by vendor cédula, normalized invoice number and amount,
+    so an invoice can be checked for duplicates in O(1) during upload and
+    registration. The index is seeded from the submission ledger, warmed
+    with a full scan of Alegra's bills, kept current with incremental
+    refreshes of the newest bills and updated directly when the app
+    registers a bill. Vendors are resolved from the bill's provider, through
+    ``resolve_identification(provider_id)`` when the bill does not carry
+    the provider's identification; scans first wait up to
+    ``ready_timeout`` seconds for ``wait_ready(timeout)``, e.g. the contact
+    index being warm, once rather than once per bill.
+    """
+
+    def __init__(self, resolve_identification=None, wait_ready=None, ready_timeout=60,
+                 refresh_interval=300, full_refresh_interval=6 * 3600, refresh_max_pages=5):
+        self.resolve_identification = resolve_identification
+        self.wait_ready = wait_ready
+        self.ready_timeout = ready_timeout
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self.refresh_max_pages = refresh_max_pages
+        self._lock = threading.Lock()
+        self._by_key = {}
+        self._high_water = 0  # Highest bill id seen by a scan of Alegra
+        self._last_full_refresh = 0
+        self._thread = None
+
+    def __len__(self):
+        return len(self._by_key)
+
+    def add(self, vendor_id, invoice_number, amount, bill_id, date='', source='app', into=None):
+        """Index a registered bill, in ``into`` when building a new map"""
+        key = bill_key(vendor_id, invoice_number, amount)
+        if key is None:
+            return False
+        entry = {
+            'id': str(bill_id),
+            'invoice_number': str(invoice_number),
+            'date': date,
+            'total': float(amount),
+            'source': source,
+            'added_at': time.time()
+        }
+        if into is not None:
+            into[key] = entry
+            return True
+        with self._lock:
+            self._by_key[key] = entry
+        return True
+
+    def add_bill(self, bill, into=None):
+        """Index a bill as listed by Alegra"""
+        if not isinstance(bill, dict) or 'id' not in bill or bill.get('status') == 'void':
+            return False
+        provider = bill.get('provider') or {}
+        vendor_id = get_contact_identification(provider) if isinstance(provider, dict) else ''
+        if not vendor_id and self.resolve_identification and isinstance(provider, dict) and provider.get('id'):
+            vendor_id = self.resolve_identification(provider['id'])
+        template = bill.get('numberTemplate') or {}
+        numbers = {template.get('number'), template.get('fullNumber')} - {None, ''}
+        added = False
+        for number in numbers:
+            added |= self.add(vendor_id, number, bill.get('total'), bill['id'], bill.get('date', ''), 'alegra', into)
+        return added
+
+    def seed(self, submissions):
+        """Index the registered bills of the submission ledger"""
+        added = 0
+        for entry in submissions:
+            if self.add(entry['vendor_id'], entry['invoice_number'], entry['total'],
+                        entry['bill_id'], entry['date'], 'ledger'):
+                added += 1
+        return added
+
+    def _wait_for_identifications(self):
+        if self.wait_ready and not self.wait_ready(self.ready_timeout):
+            print("Contact index not ready, indexing bills without their provider's identification")
+
+    def find(self, vendor_id, invoice_number, amount):
+        """Find the registered bill of an invoice, or None"""
+        key = bill_key(vendor_id, invoice_number, amount)
+        if key is None:
+            return None
+        with self._lock:
+            bill = self._by_key.get(key)
+        if not bill:
+            return None
+        bill = dict(bill)
+        del bill['added_at']
+        return bill
+
+    def warm(self):
+        """Rebuild the index from every bill in Alegra
+
+        Bills voided or deleted in Alegra drop out. Bills the app or the
+        ledger added while Alegra was being listed are kept, since the
+        listing may have missed them.
+        """
+        started = time.time()
+        bills = alegra.Bill.list_all()
+        self._wait_for_identifications()
+        by_key = {}
+        added = sum(1 for bill in bills if self.add_bill(bill, by_key))
+        with self._lock:
+            for key, entry in self._by_key.items():
+                if entry['source'] != 'alegra' and entry['added_at'] >= started:
+                    by_key.setdefault(key, entry)
+            self._by_key = by_key
+        self._high_water = max([record_id(bill) or 0 for bill in bills if isinstance(bill, dict)] + [0])
+        self._last_full_refresh = time.time()
+        print(f"Bill index warmed with {added} bills")
+
+    def refresh(self):
+        """Index bills created since the last refresh.
+
+        Bills are listed newest first and the scan stops at the highest id
+        a previous scan saw. Bills the app added itself do not stop it, so
+        bills entered in Alegra just before them are still indexed.
+        """
+        added = 0
+        high_water = self._high_water
+        self._wait_for_identifications()
+        bills = alegra.Bill.list_iter(
+            max_pages=self.refresh_max_pages,
+            order_field='id',
+            order_direction='DESC'
+        )
+        for bill in bills:
+            if not isinstance(bill, dict) or 'id' not in bill:
+                continue
+            bill_id = record_id(bill)
+            if bill_id is not None and bill_id <= self._high_water:
+                break
+            if self.add_bill(bill):
+                added += 1
+            high_water = max(high_water, bill_id or 0)
+        self._high_water = high_water
+        if added:
+            print(f"Bill index refreshed with {added} new bills")
+        return added
+
+    def start(self):
+        """Warm the index and keep refreshing it in a background thread"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='bill-index', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                if time.time() - self._last_full_refresh > self.full_refresh_interval:
+                    self.warm()
+                else:
+                    self.refresh()
+            except Exception as e:
+                print(f"Error refreshing bill index: {e}")
+            time.sleep(self.refresh_interval)
+
+    def stats(self):
+        with self._lock:
+            return {'bills': len(self._by_key), 'last_full_refresh': self._last_full_refresh or None}
@@ -0,0 +1,161 @@
+import difflib
+import json
+import os
+import re
+import tempfile
+import threading
+import unicodedata
+from collections import Counter
+
+from vendor_templates import find_cedulas
+
+
+MEMORY_VERSION = 1
+
+
+def normalize_description(description):
+    """Reduce a line description to its words, ignoring case, accents, numbers and punctuation"""
+    text = unicodedata.normalize('NFKD', str(description or '').lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(re.sub(r'[\d\W_]+', ' ', text).split())
+
+def normalize_vendor(vendor_id):
+    return re.sub(r'\D', '', str(vendor_id or ''))
+
+
+class CategoryMemory:
+    """Accounts and taxes chosen for each vendor's line descriptions.
+
+    Every registered bill records, per vendor cédula and normalized line
+    description, the account_id and tax percentage it was registered with.
+    Later invoices from the same vendor get those categories locally: an
+    exact description match first, then the most similar description of
+    that vendor if it is at least ``fuzzy_cutoff`` similar. When a
+    description was registered with different categories, the most
+    frequent one wins.
+    """
+
+    def __init__(self, path, fuzzy_cutoff=0.85):
+        self.path = path
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self._lock = threading.Lock()
+        self._vendors = {}  # vendor id -> description -> {"account|tax|has_tax": count}
+        self.exact_hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Error reading category memory: {e}")
+            return
+        if data.get('version') == MEMORY_VERSION:
+            self._vendors = data.get('vendors', {})
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with self._lock:
+            data = json.dumps({'version': MEMORY_VERSION, 'vendors': self._vendors},
+                              ensure_ascii=False).encode('utf-8')
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Error writing category memory: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def record(self, vendor_id, line_items):
+        """Remember the categories of a registered bill's line items"""
+        vendor_id = normalize_vendor(vendor_id)
+        if not vendor_id:
+            return 0
+        recorded = 0
+        with self._lock:
+            descriptions = self._vendors.setdefault(vendor_id, {})
+            for item in line_items or []:
+                description = normalize_description(item.get('description'))
+                if not description or not item.get('account_id'):
+                    continue
+                tax_percentage = float(item.get('tax_percentage') or 0)
+                has_tax = bool(item.get('has_tax', tax_percentage > 0))
+                choice = f"{item['account_id']}|{tax_percentage:g}|{int(has_tax)}"
+                counts = descriptions.setdefault(description, {})
+                counts[choice] = counts.get(choice, 0) + 1
+                recorded += 1
+            if not descriptions:
+                del self._vendors[vendor_id]
+        if recorded:
+            self._save()
+        return recorded
+
+    def find_vendor(self, text):
+        """Find the cédula of a remembered vendor in an invoice text, or None"""
+        with self._lock:
+            return next((cedula for cedula in find_cedulas(text) if cedula in self._vendors), None)
+
+    def lookup(self, vendor_id, description):
+        """Get the remembered category of a line description, or None"""
+        description = normalize_description(description)
+        with self._lock:
+            descriptions = self._vendors.get(normalize_vendor(vendor_id))
+            if not descriptions or not description:
+                self.misses += 1
+                return None
+            counts = descriptions.get(description)
+            if counts is not None:
+                self.exact_hits += 1
+            else:
+                close = difflib.get_close_matches(description, list(descriptions), n=1, cutoff=self.fuzzy_cutoff)
+                if not close:
+                    self.misses += 1
+                    return None
+                counts = descriptions[close[0]]
+                self.fuzzy_hits += 1
+            choice = Counter(counts).most_common(1)[0][0]
+        account_id, tax_percentage, has_tax = choice.split('|')
+        return {
+            'account_id': account_id,
+            'tax_percentage': float(tax_percentage),
+            'has_tax': has_tax == '1'
+        }
+
+    def apply(self, vendor_id, line_items):
+        """Set the remembered categories on line items
+
+        Returns the line items that had no remembered category.
+        """
+        unmatched = []
+        for item in line_items or []:
+            category = self.lookup(vendor_id, item.get('description')) if vendor_id else None
+            if category is None:
+                unmatched.append(item)
+                continue
+            item.update(category)
+            item['needs_manual_selection'] = False
+            item['confidence_level'] = 'high'
+            item['category_source'] = 'memory'
+        return unmatched
+
+    def clear(self):
+        """Forget every remembered category"""
+        with self._lock:
+            self._vendors = {}
+        self._save()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'vendors': len(self._vendors),
+                'descriptions': sum(len(descriptions) for descriptions in self._vendors.values()),
+                'exact_hits': self.exact_hits,
+                'fuzzy_hits': self.fuzzy_hits,
+                'misses': self.misses
+            }
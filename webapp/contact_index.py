@@ -0,0 +1,213 @@
+import re
+import threading
+import time
+import unicodedata
+
+import alegra
+
+
+def normalize_identification(value):
+    """Remove spaces, dashes and dots from an identification number"""
+    return re.sub(r'[\s\-\.]+', '', str(value).strip())
+
+def get_contact_identification(contact):
+    """Get the identification number of an Alegra contact"""
+    # Handle both formats: string directly or object with 'number'
+    contact_id_info = contact.get('identification', '')
+    if isinstance(contact_id_info, dict):
+        return str(contact_id_info.get('number', ''))
+    return str(contact_id_info)
+
+def record_id(record):
+    """Get the numeric id of an Alegra record, or None"""
+    try:
+        return int(record['id'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def name_tokens(name):
+    """Split a name into lowercase tokens without accents"""
+    folded = unicodedata.normalize('NFKD', str(name)).encode('ascii', 'ignore').decode('ascii')
+    return [token for token in re.split(r'[^a-z0-9]+', folded.lower()) if token]
+
+
+class ContactIndex:
+    """In-memory index of Alegra contacts.
+
+    Contacts are looked up by normalized identification in O(1) and by name
+    through an index of token prefixes, so vendor matching needs no Alegra
+    traffic once the index is warm. The index is warmed with a full scan,
+    kept current with incremental refreshes of the newest contacts and
+    updated directly when the app creates a contact.
+    """
+
+    MIN_PREFIX = 2
+
+    def __init__(self, refresh_interval=300, full_refresh_interval=3600,
+                 miss_refresh_interval=30, refresh_max_pages=5):
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self.miss_refresh_interval = miss_refresh_interval
+        self.refresh_max_pages = refresh_max_pages
+        self._lock = threading.RLock()
+        self._ready = threading.Event()
+        self._by_id = {}
+        self._by_identification = {}
+        self._by_prefix = {}
+        self._last_refresh = 0
+        self._last_full_refresh = 0
+        self._high_water = 0  # Highest contact id seen by a scan of Alegra
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def _summary(self, contact):
+        return {
+            'id': contact['id'],
+            'name': str(contact.get('name', '')),
+            'identification': get_contact_identification(contact),
+            'email': str(contact.get('email', '') or '')
+        }
+
+    def _add(self, summary):
+        """Index a contact summary. Must be called with the lock held."""
+        key = str(summary['id'])
+        previous = self._by_id.get(key)
+        if previous:
+            self._remove(previous)
+        self._by_id[key] = summary
+        clean_id = normalize_identification(summary['identification'])
+        if clean_id:
+            self._by_identification[clean_id] = summary
+        for token in name_tokens(summary['name']):
+            for size in range(self.MIN_PREFIX, len(token) + 1):
+                self._by_prefix.setdefault(token[:size], set()).add(key)
+
+    def _remove(self, summary):
+        """Remove a contact summary from the index. Must be called with the lock held."""
+        key = str(summary['id'])
+        self._by_id.pop(key, None)
+        clean_id = normalize_identification(summary['identification'])
+        if self._by_identification.get(clean_id) is summary:
+            del self._by_identification[clean_id]
+        for token in name_tokens(summary['name']):
+            for size in range(self.MIN_PREFIX, len(token) + 1):
+                ids = self._by_prefix.get(token[:size])
+                if ids:
+                    ids.discard(key)
+
+    def warm(self):
+        """Rebuild the whole index from Alegra"""
+        contacts = alegra.Contact.list_all()
+        summaries = [self._summary(c) for c in contacts if isinstance(c, dict) and 'id' in c]
+        with self._lock:
+            self._by_id = {}
+            self._by_identification = {}
+            self._by_prefix = {}
+            for summary in summaries:
+                self._add(summary)
+            self._high_water = max([record_id(c) or 0 for c in contacts if isinstance(c, dict)] + [0])
+            self._last_refresh = self._last_full_refresh = time.time()
+        self._ready.set()
+        print(f"Contact index warmed with {len(summaries)} contacts")
+
+    def refresh(self):
+        """Index contacts created since the last refresh.
+
+        Contacts are listed newest first and the scan stops at the highest
+        id a previous scan saw. Contacts the app upserted itself do not stop
+        it, so contacts created in Alegra just before them are still found.
+        """
+        added = 0
+        high_water = self._high_water
+        contacts = alegra.Contact.list_iter(
+            max_pages=self.refresh_max_pages,
+            order_field='id',
+            order_direction='DESC'
+        )
+        for contact in contacts:
+            if not isinstance(contact, dict) or 'id' not in contact:
+                continue
+            contact_id = record_id(contact)
+            if contact_id is not None and contact_id <= self._high_water:
+                break
+            self.upsert(contact)
+            high_water = max(high_water, contact_id or 0)
+            added += 1
+        self._high_water = high_water
+        self._last_refresh = time.time()
+        if added:
+            print(f"Contact index refreshed with {added} new contacts")
+        return added
+
+    def upsert(self, contact):
+        """Add or replace a contact, e.g. after creating it in Alegra"""
+        if not isinstance(contact, dict) or 'id' not in contact:
+            return
+        with self._lock:
+            self._add(self._summary(contact))
+
+    def invalidate(self):
+        """Force the next lookup miss to refresh from Alegra"""
+        self._last_refresh = 0
+
+    def find_by_identification(self, identification):
+        """Find a contact by identification, refreshing once on a miss"""
+        clean_id = normalize_identification(identification)
+        if not clean_id:
+            return None
+        contact = self._by_identification.get(clean_id)
+        if contact is None and time.time() - self._last_refresh > self.miss_refresh_interval:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing contact index: {e}")
+            contact = self._by_identification.get(clean_id)
+        return dict(contact) if contact else None
+
+    def find_by_id(self, contact_id):
+        """Find an indexed contact by its Alegra id, without refreshing"""
+        contact = self._by_id.get(str(contact_id))
+        return dict(contact) if contact else None
+
+    def search(self, query, limit=10):
+        """Find contacts by identification or by the prefixes of their name tokens"""
+        results = []
+        contact = self.find_by_identification(query) if normalize_identification(query).isdigit() else None
+        if contact:
+            results.append(contact)
+        tokens = [t for t in name_tokens(query) if len(t) >= self.MIN_PREFIX]
+        if tokens:
+            with self._lock:
+                ids = set.intersection(*(self._by_prefix.get(t, set()) for t in tokens))
+                matches = sorted((self._by_id[i] for i in ids), key=lambda c: c['name'])
+            for match in matches:
+                if not contact or match['id'] != contact['id']:
+                    results.append(dict(match))
+        return results[:limit]
+
+    def start(self):
+        """Warm the index and keep refreshing it in a background thread"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='contact-index', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                if time.time() - self._last_full_refresh > self.full_refresh_interval:
+                    self.warm()
+                else:
+                    self.refresh()
+            except Exception as e:
+                print(f"Error refreshing contact index: {e}")
+            time.sleep(self.refresh_interval)
@@ -0,0 +1,114 @@
+import re
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+
+# Weight of each check in the confidence score
+CHECK_WEIGHTS = {
+    'vendor_id': 0.25,
+    'total': 0.25,
+    'invoice_number': 0.2,
+    'vendor_name': 0.1,
+    'date': 0.1,
+    'line_totals': 0.1
+}
+# Checks that force escalation when they fail, whatever the other checks say:
+# line amounts that do not add up to the total mean the extraction is wrong
+HARD_CHECKS = ('line_totals',)
+
+
+def is_valid_cedula(value):
+    """Check the format of a Costa Rican identification number
+
+    Cédula física: 9 digits; cédula jurídica: 10 digits starting with 3;
+    NITE: 10 digits starting with 4; DIMEX: 11 or 12 digits.
+    """
+    digits = re.sub(r'[\s\-\.]+', '', str(value or ''))
+    if not digits.isdigit():
+        return False
+    if len(digits) == 9:
+        return digits[0] != '0'
+    if len(digits) == 10:
+        return digits[0] in '34'
+    return len(digits) in (11, 12)
+
+def is_plausible_date(value, max_age_days=400):
+    """Check that a YYYY-MM-DD date parses and is not in the future or too old"""
+    try:
+        date = datetime.strptime(str(value), '%Y-%m-%d')
+    except ValueError:
+        return False
+    today = datetime.now()
+    return today - timedelta(days=max_age_days) <= date <= today + timedelta(days=1)
+
+def line_items_total(line_items):
+    """Sum the line amounts plus their tax"""
+    total = 0
+    for item in line_items:
+        amount = float(item.get('amount') or 0)
+        total += amount * (1 + float(item.get('tax_percentage') or 0) / 100) if item.get('has_tax') else amount
+    return total
+
+def score_extraction(data, line_items=None, tolerance=0.02):
+    """Score how much an extraction can be trusted without the AI
+
+    Returns a score between 0 and 1, the weighted share of the checks that
+    passed, and the names of the checks that failed. The line totals check
+    only applies when line items are given; failing a hard check scores 0.
+    """
+    checks = {
+        'vendor_id': is_valid_cedula(data.get('vendor_id')),
+        'total': float(data.get('total') or 0) > 0,
+        # A real invoice number has digits; words like ELECTRONICA are misreads
+        'invoice_number': bool(re.search(r'\d', str(data.get('invoice_number') or ''))),
+        'vendor_name': bool(str(data.get('vendor_name') or '').strip()),
+        'date': is_plausible_date(data.get('date'))
+    }
+    if line_items:
+        total = float(data.get('total') or 0)
+        lines = line_items_total(line_items)
+        checks['line_totals'] = total > 0 and abs(lines - total) <= max(1.0, total * tolerance)
+
+    applicable = sum(CHECK_WEIGHTS[name] for name in checks)
+    passed = sum(CHECK_WEIGHTS[name] for name, ok in checks.items() if ok)
+    failed = [name for name, ok in checks.items() if not ok]
+    if any(name in HARD_CHECKS for name in failed):
+        return 0.0, failed
+    return round(passed / applicable, 3), failed
+
+
+class ExtractionMetrics:
+    """Counts how invoices were extracted and why the AI was needed"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._methods = Counter()
+        self._escalation_reasons = Counter()
+        self._gated = 0
+        self._escalated = 0
+
+    def record(self, method, gated=False, escalated=False, reasons=()):
+        """Record one extraction
+
+        ``method`` is what produced the header (xml, regex or ai); ``gated``
+        marks extractions where the confidence gate decided whether to call
+        the AI.
+        """
+        with self._lock:
+            self._methods[method] += 1
+            if gated:
+                self._gated += 1
+                if escalated:
+                    self._escalated += 1
+                    self._escalation_reasons.update(reasons)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'methods': dict(self._methods),
+                'gated': self._gated,
+                'escalated': self._escalated,
+                'escalation_rate': round(self._escalated / self._gated, 3) if self._gated else None,
+                'escalation_reasons': dict(self._escalation_reasons)
+            }
@@ -0,0 +1,277 @@
+import re
+import threading
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+
+FACTURA_ELECTRONICA_43 = 'https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.3/facturaElectronica'
+
+# Hacienda namespaces look like
+# https://cdn.comprobanteselectronicos.go.cr/xml-schemas/v4.4/facturaElectronica (v4.3, v4.4) or
+# https://tribunet.hacienda.go.cr/docs/esquemas/2017/v4.2/facturaElectronica (v4.2)
+NAMESPACE_PATTERN = re.compile(r'/v(\d+(?:\.\d+)*)/(\w+)$')
+
+DOCUMENT_TYPES = {
+    'facturaElectronica': 'factura',
+    'facturaElectronicaCompra': 'factura_compra',
+    'facturaElectronicaExportacion': 'factura_exportacion',
+    'tiqueteElectronico': 'tiquete',
+    'notaCreditoElectronica': 'nota_credito',
+    'notaDebitoElectronica': 'nota_debito',
+    'mensajeReceptor': 'mensaje_receptor',
+    'mensajeHacienda': 'mensaje_hacienda'
+}
+
+# Messages about an invoice rather than the invoice itself
+MESSAGE_TYPES = ('mensaje_receptor', 'mensaje_hacienda')
+
+
+def parse_date(date_str):
+    """Convert a Hacienda FechaEmision to YYYY-MM-DD, defaulting to today"""
+    date = datetime.now().strftime('%Y-%m-%d')
+    if date_str:
+        try:
+            # Handle both 2025-05-24T03:31:13 and other formats
+            if 'T' in date_str:
+                date_obj = datetime.fromisoformat(date_str.split('.')[0])
+            else:
+                date_obj = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+            date = date_obj.strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+    return date
+
+
+class HaciendaXMLParser:
+    """Streaming parser for Costa Rican electronic invoice XML.
+
+    The document is walked once with iterparse. Header fields are matched
+    against precompiled tag paths as their elements end, and each
+    LineaDetalle is turned into a line item and dropped from the tree as
+    soon as it is complete, so memory stays flat however many lines the
+    invoice has.
+
+    One parser is built per namespace and handles facturas, tiquetes and
+    notas de crédito/débito, which share the comprobante structure.
+    """
+
+    def __init__(self, namespace=FACTURA_ELECTRONICA_43, document_type='factura', version=''):
+        self.namespace = namespace
+        self.document_type = document_type
+        self.version = version
+        q = self.qualify
+        # Tag path suffix -> output field, first match wins like Element.find
+        self.header_paths = self.build_header_paths(q)
+        self.path_lengths = sorted({len(path) for path in self.header_paths})
+        self.line_tag = q('LineaDetalle')
+        self.line_fields = {
+            q('NumeroLinea'): 'line_number',
+            q('Detalle'): 'description',
+            q('Cantidad'): 'quantity',
+            q('PrecioUnitario'): 'unit_price',
+            q('SubTotal'): 'subtotal'
+        }
+        self.discount_tag = q('MontoDescuento')
+        self.tax_tag = q('Impuesto')
+        self.tax_rate_tag = q('Tarifa')
+        self.tax_amount_tag = q('Monto')
+
+    def build_header_paths(self, q):
+        vendor, client = 'Emisor', 'Receptor'
+        if self.document_type == 'factura_compra':
+            # The buyer issues purchase invoices; the vendor is the receptor
+            vendor, client = client, vendor
+        return {
+            (q(vendor), q('Nombre')): 'vendor_name',
+            (q(vendor), q('Identificacion'), q('Numero')): 'vendor_id',
+            (q(client), q('Nombre')): 'client_name',
+            (q(client), q('Identificacion'), q('Numero')): 'client_id',
+            (q('NumeroConsecutivo'),): 'invoice_number',
+            (q('FechaEmision'),): 'date',
+            (q('ResumenFactura'), q('TotalComprobante')): 'total'
+        }
+
+    def qualify(self, name):
+        return f'{{{self.namespace}}}{name}' if self.namespace else name
+
+    def parse(self, source):
+        """Parse an XML file path or file object into the invoice data dict"""
+        events = ET.iterparse(source, events=('start', 'end'))
+        _, root = next(events)
+        return self.parse_events(events, root)
+
+    def parse_events(self, events, root):
+        """Consume the iterparse events that follow the root start event"""
+        header = {}
+        line_items = []
+        path = [root.tag]
+        elements = [root]
+        for event, elem in events:
+            if event == 'start':
+                path.append(elem.tag)
+                elements.append(elem)
+                continue
+
+            if elem.tag == self.line_tag:
+                line_items.append(self.parse_line(elem))
+                elem.clear()
+                if len(elements) > 1:
+                    elements[-2].remove(elem)
+            else:
+                for size in self.path_lengths:
+                    field = self.header_paths.get(tuple(path[-size:]))
+                    if field and field not in header:
+                        header[field] = elem.text or ''
+
+            path.pop()
+            elements.pop()
+            if len(elements) == 1:
+                # A top-level section is complete and its fields are recorded
+                elements[0].clear()
+
+        # Extract totals
+        total = 0
+        try:
+            total = float(header.get('total', 0))
+        except ValueError:
+            pass
+
+        # If total is still 0, calculate from line items
+        if total == 0 and line_items:
+            subtotal = sum(item['amount'] for item in line_items)
+            total_tax = sum(sum(tax['amount'] for tax in item['taxes']) for item in line_items)
+            total = subtotal + total_tax
+
+        return {
+            'vendor_name': header.get('vendor_name', ''),
+            'vendor_id': header.get('vendor_id', ''),
+            'client_name': header.get('client_name', ''),
+            'client_id': header.get('client_id', ''),
+            'invoice_number': header.get('invoice_number', ''),
+            'date': parse_date(header.get('date', '')),
+            'line_items': line_items,
+            'total': total,
+            'is_xml': True,
+            'document_type': self.document_type,
+            'version': self.version
+        }
+
+    def parse_line(self, line):
+        """Build a line item from a complete LineaDetalle element"""
+        values = {}
+        for child in line:
+            field = self.line_fields.get(child.tag)
+            if field and field not in values:
+                values[field] = child.text or ''
+
+        discount = next(line.iter(self.discount_tag), None)
+        item = {
+            'line_number': values.get('line_number', ''),
+            'description': values.get('description', ''),
+            'quantity': float(values['quantity']) if 'quantity' in values else 1,
+            'unit_price': float(values['unit_price']) if 'unit_price' in values else 0,
+            'subtotal': float(values['subtotal']) if 'subtotal' in values else 0,
+            'discount': float(discount.text) if discount is not None else 0,
+            'taxes': []
+        }
+
+        # Extract taxes for this line
+        for tax in line.iter(self.tax_tag):
+            rate = tax.find(self.tax_rate_tag)
+            amount = tax.find(self.tax_amount_tag)
+            item['taxes'].append({
+                'rate': float(rate.text) if rate is not None else 0,
+                'amount': float(amount.text) if amount is not None else 0
+            })
+
+        # Calculate final amount (subtotal - discount)
+        item['amount'] = item['subtotal'] - item['discount']
+        item['has_tax'] = len(item['taxes']) > 0
+        item['tax_percentage'] = item['taxes'][0]['rate'] if item['taxes'] else 0
+        return item
+
+
+class MensajeReceptorParser(HaciendaXMLParser):
+    """Parser for mensajes de receptor (acceptance of a vendor's invoice)
+    and Hacienda's responses about an invoice.
+
+    They only carry the key of the accepted invoice, the identifications and
+    the totals; the invoice number is the consecutive embedded in the key.
+    """
+
+    def build_header_paths(self, q):
+        return {
+            (q('Clave'),): 'key',
+            (q('NumeroCedulaEmisor'),): 'vendor_id',
+            (q('NumeroCedulaReceptor'),): 'client_id',
+            (q('FechaEmisionDoc'),): 'date',
+            (q('TotalFactura'),): 'total'
+        }
+
+    def parse_events(self, events, root):
+        header = {}
+        path = [root.tag]
+        for event, elem in events:
+            if event == 'start':
+                path.append(elem.tag)
+                continue
+            for size in self.path_lengths:
+                field = self.header_paths.get(tuple(path[-size:]))
+                if field and field not in header:
+                    header[field] = elem.text or ''
+            path.pop()
+
+        total = 0
+        try:
+            total = float(header.get('total', 0))
+        except ValueError:
+            pass
+
+        # Clave: country (3), date (6), issuer id (12), consecutive (20), ...
+        key = header.get('key', '').strip()
+        return {
+            'vendor_name': '',
+            'vendor_id': header.get('vendor_id', ''),
+            'client_name': '',
+            'client_id': header.get('client_id', ''),
+            'invoice_number': key[21:41] if len(key) == 50 else '',
+            'date': parse_date(header.get('date', '')),
+            'line_items': [],
+            'total': total,
+            'is_xml': True,
+            'document_type': self.document_type,
+            'version': self.version
+        }
+
+
+_parsers = {}
+_parsers_lock = threading.Lock()
+
+
+def get_parser(root_tag):
+    """Get the parser for a document from the tag of its root element
+
+    The namespace of the root selects the document type and schema version;
+    parsers are built once per namespace and reused.
+    """
+    namespace = root_tag[1:].split('}', 1)[0] if root_tag.startswith('{') else ''
+    with _parsers_lock:
+        parser = _parsers.get(namespace)
+        if parser is None:
+            match = NAMESPACE_PATTERN.search(namespace)
+            version, schema = match.groups() if match else ('', '')
+            document_type = DOCUMENT_TYPES.get(schema)
+            if document_type is None:
+                # Unknown schema: read it as a comprobante named after its root
+                local_name = root_tag.rsplit('}', 1)[-1]
+                document_type = DOCUMENT_TYPES.get(local_name[:1].lower() + local_name[1:], 'factura')
+            parser_class = MensajeReceptorParser if document_type in MESSAGE_TYPES else HaciendaXMLParser
+            parser = _parsers[namespace] = parser_class(namespace, document_type, version)
+    return parser
+
+
+def parse_hacienda_xml(source):
+    """Parse a Hacienda electronic document XML of any supported type and version"""
+    events = ET.iterparse(source, events=('start', 'end'))
+    _, root = next(events)
+    return get_parser(root.tag).parse_events(events, root)
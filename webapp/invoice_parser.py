@@ -0,0 +1,77 @@
+import io
+
+from hacienda_xml import MESSAGE_TYPES, parse_hacienda_xml
+from pdf_extract import PDFTextExtractor, extract_attachments
+
+
+# Fields an XML must provide for a PDF to skip text extraction and AI
+XML_REQUIRED_FIELDS = ('vendor_id', 'vendor_name', 'invoice_number', 'total', 'line_items')
+
+
+def extract_text_from_pdf(pdf_path, extractor=None):
+    """Extract text from PDF file"""
+    try:
+        return (extractor or PDFTextExtractor()).extract(pdf_path)
+    except Exception as e:
+        print(f"Error extracting PDF text: {e}")
+        return ""
+
+def extract_data_from_xml(xml_path):
+    """Extract structured data from Costa Rican electronic invoice XML"""
+    try:
+        return parse_hacienda_xml(xml_path)
+    except Exception as e:
+        print(f"Error parsing XML: {e}")
+        return None
+
+def find_xml_attachment(pdf_path):
+    """Get the data of the electronic invoice XML attached to a PDF, if any"""
+    try:
+        attachments = extract_attachments(pdf_path)
+    except Exception as e:
+        print(f"Error reading PDF attachments: {e}")
+        return None
+    
+    for name, data in attachments:
+        if not name.lower().endswith('.xml'):
+            continue
+        try:
+            xml_data = parse_hacienda_xml(io.BytesIO(data))
+        except Exception as e:
+            print(f"Error parsing attached XML {name}: {e}")
+            continue
+        # Vendors often attach Hacienda's response next to the invoice itself
+        if xml_data['document_type'] not in MESSAGE_TYPES:
+            return xml_data
+    return None
+
+def missing_xml_fields(xml_data):
+    """List the fields an XML invoice does not provide"""
+    return [field for field in XML_REQUIRED_FIELDS if not xml_data.get(field)]
+
+def parse_invoice_file(filepath, filename, pdf_extractor=None, xml_path=None):
+    """Parse a saved invoice file without calling any external service
+
+    Returns a dict with the XML data for XML invoices or the text of PDF
+    invoices. It only does local, CPU-bound work so it can run in a worker
+    process.
+
+    For PDFs the electronic invoice XML is taken from ``xml_path`` when the
+    vendor sent it separately, or from the PDF's attachments. The text is
+    only extracted when there is no XML or it is missing fields.
+    """
+    if filename.lower().endswith('.xml'):
+        return {'is_xml': True, 'xml_data': extract_data_from_xml(filepath)}
+    
+    xml_data, xml_source = None, None
+    if xml_path:
+        xml_data, xml_source = extract_data_from_xml(xml_path), 'file'
+    if xml_data is None:
+        xml_data, xml_source = find_xml_attachment(filepath), 'attachment'
+    if xml_data is None:
+        xml_source = None
+    
+    text = ''
+    if xml_data is None or missing_xml_fields(xml_data):
+        text = extract_text_from_pdf(filepath, pdf_extractor)
+    return {'is_xml': False, 'text': text, 'xml_data': xml_data, 'xml_source': xml_source}
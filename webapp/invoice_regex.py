@@ -0,0 +1,176 @@
+import logging
+import re
+
+
+logger = logging.getLogger(__name__)
+
+# Patterns for each field in priority order, matched case-insensitively. Each
+# has one capturing group with the value; the first pattern of a field that
+# matches anywhere wins.
+FIELD_PATTERNS = {
+    'vendor_name': [
+        r'(?:Emisor|EMISOR|Proveedor|PROVEEDOR|Vendedor|VENDEDOR)[:\s]*([^\n]+)',
+        r'(?:Razón Social|RAZÓN SOCIAL)[:\s]*([^\n]+)',
+        r'(?:Nombre Comercial|NOMBRE COMERCIAL)[:\s]*([^\n]+)'
+    ],
+    # Vendors recognized by name when no label is found, in priority order
+    'known_vendor': [
+        r'(CLARO CR TELECOMUNICACIONES)',
+        r'(CORPORACION SUPERMERCADOS UNIDOS)',
+        r'(WAL MART)',
+        r'(WALMART)'
+    ],
+    'vendor_id': [
+        r'(?:Cédula Jurídica|CÉDULA JURÍDICA|CED\. JURÍDICA)[:\s]*([\d-]+)',
+        r'(?:Identificación del Emisor|IDENTIFICACIÓN DEL EMISOR)[:\s]*([\d-]+)',
+        r'(?:RUC|NIT)[:\s]*([\d-]+)'
+    ],
+    'date': [
+        r'(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})'
+    ],
+    'invoice_number': [
+        # "Factura" followed by number (most common)
+        r'factura\s*[:#]?\s*([A-Z0-9\-]+)',
+        # "# de documento" or "No. de documento" that's NOT a cedula (shorter numbers)
+        r'(?:no\.?\s*de\s*documento|#\s*de\s*documento)\s*[:#]?\s*([A-Z0-9\-]{1,15})',
+        # "Número de factura" or similar
+        r'(?:n[úu]mero\s*(?:de\s*)?factura|no\.?\s*factura)\s*[:#]?\s*([A-Z0-9\-]+)',
+        # "Invoice" or "No." followed by number
+        r'(?:invoice|no\.?)\s*[:#]?\s*([A-Z0-9\-]+)',
+        # Generic document number (but exclude long numbers that look like cedulas)
+        r'(?:documento|doc)\s*[:#]?\s*([A-Z0-9\-]{1,15})',
+        # Standalone number patterns (not too long to avoid cedulas)
+        r'^([A-Z]?\d{3,8}[A-Z]?)$'  # Alphanumeric, 3-8 digits
+    ],
+    'total': [
+        r'(?:total|monto total|total a pagar)[:\s]*(?:₡|CRC)?\s*([\d,]+\.?\d*)'
+    ]
+}
+
+FLAGS = re.IGNORECASE | re.MULTILINE
+
+
+def looks_like_cedula(value):
+    """Check whether a candidate invoice number is really a cédula (9-12 digits)"""
+    digits = value.replace('-', '')
+    return digits.isdigit() and len(digits) >= 9
+
+def fold_pattern(pattern):
+    """Lowercase the literals of a pattern, leaving escapes like \\s untouched"""
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern[i] == '\\':
+            parts.append(pattern[i:i + 2])
+            i += 2
+        else:
+            parts.append(pattern[i].lower())
+            i += 1
+    return ''.join(parts)
+
+
+class InvoiceTextScanner:
+    """Extracts every regex field of an invoice from its text.
+
+    Patterns are compiled once. The text is lowercased once and matched
+    against case-sensitive lowercase versions of the patterns, which lets
+    the regex engine skip ahead to each pattern's literal prefix instead of
+    trying a case-insensitive match at every position. Values are sliced
+    from the original text so they keep their case.
+
+    For each field the patterns are tried in priority order and the first
+    match of the first matching pattern wins. Candidate invoice numbers that
+    look like a cédula are skipped in favour of the next pattern, and known
+    vendor names are only looked for when no labelled vendor name is found.
+    """
+
+    def __init__(self, field_patterns=FIELD_PATTERNS, flags=FLAGS):
+        self.fields = {
+            field: [(re.compile(fold_pattern(pattern), flags & ~re.IGNORECASE), re.compile(pattern, flags))
+                    for pattern in patterns]
+            for field, patterns in field_patterns.items()
+        }
+
+    def scan(self, text):
+        """Return the raw value of each field found in the text"""
+        folded = text.lower()
+        # A few characters change length when lowercased; match those texts as they are
+        use_folded = len(folded) == len(text)
+        values = {}
+        for field, patterns in self.fields.items():
+            if field == 'known_vendor' and 'vendor_name' in values:
+                continue
+            for priority, (folded_regex, regex) in enumerate(patterns):
+                match = folded_regex.search(folded) if use_folded else regex.search(text)
+                if not match:
+                    continue
+                value = text[match.start(1):match.end(1)].strip()
+                logger.debug("Found %s candidate %r with pattern %d", field, value, priority)
+                if field == 'invoice_number' and looks_like_cedula(value):
+                    logger.debug("Skipping %r - looks like a cedula", value)
+                    continue
+                values[field] = value
+                break
+        return values
+
+
+scanner = InvoiceTextScanner()
+
+
+def normalize_date(invoice_date):
+    """Convert a DD/MM/YYYY date to YYYY-MM-DD, or '' when there is no date
+
+    A missing date stays empty rather than defaulting to today, so the
+    confidence check on it fails and the user has to fill it in.
+    """
+    if not invoice_date:
+        return ''
+    # Try to normalize date format
+    if '/' in invoice_date:
+        try:
+            parts = invoice_date.split('/')
+            if len(parts[2]) == 2:
+                parts[2] = '20' + parts[2]
+            invoice_date = f"{parts[2]}-{parts[1].zfill(2)}-{parts[0].zfill(2)}"
+        except IndexError:
+            invoice_date = ''
+    return invoice_date
+
+def parse_amount(value):
+    """Convert an amount like 15,000.00 to a float, or 0"""
+    try:
+        return float(value.replace(',', ''))
+    except (AttributeError, ValueError):
+        return 0
+
+def extract_vendor_info(text, values=None):
+    """Extract vendor information from invoice text"""
+    if values is None:
+        values = scanner.scan(text)
+    return {
+        'name': values.get('vendor_name') or values.get('known_vendor', '').upper(),
+        'id': values.get('vendor_id', '').replace('-', '')
+    }
+
+def extract_invoice_data(pdf_text):
+    """Extract structured invoice data from PDF text with regex patterns"""
+    values = scanner.scan(pdf_text)
+    vendor_info = extract_vendor_info(pdf_text, values)
+
+    invoice_number = values.get('invoice_number', '')
+    if invoice_number:
+        logger.debug("Using invoice number: %r", invoice_number)
+    else:
+        logger.debug("No invoice number found with regex patterns")
+
+    total = parse_amount(values.get('total'))
+    return {
+        'vendor_name': vendor_info.get('name', ''),
+        'vendor_id': vendor_info.get('id', ''),
+        'client_name': '',  # Would need more sophisticated extraction
+        'client_id': '',
+        'invoice_number': invoice_number,
+        'date': normalize_date(values.get('date')),
+        'total': total,
+        'amount': total
+    }
@@ -0,0 +1,169 @@
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import PyPDF2
+
+
+# An invoice header: Hacienda key (50 digits), consecutive number (20 digits)
+# or a labelled invoice/document number
+HEADER_PATTERN = re.compile(
+    r'\b\d{50}\b|\b\d{20}\b|(?:factura|documento|invoice)\s*(?:electr[óo]nica\s*)?'
+    r'(?:n[úuo°º.]*\s*)?[:#]?\s*[A-Z0-9\-]*\d',
+    re.IGNORECASE
+)
+# The grand total, as opposed to the "Total" column of the line items
+TOTALS_PATTERN = re.compile(
+    r'(?:total\s+(?:comprobante|a\s+pagar|factura|general)|monto\s+total)[:\s]*(?:₡|CRC|\$)?\s*[\d,.]*\d',
+    re.IGNORECASE
+)
+
+
+class HeaderTotalsScan:
+    """Tracks whether the pages read so far contain the invoice header and its totals
+
+    Each page is scanned once, when it is added, together with the end of
+    the previous page in case a match straddles the page break.
+    """
+
+    OVERLAP = 200
+
+    def __init__(self):
+        self.seen_header = False
+        self.seen_totals = False
+        self._tail = ''
+
+    def add(self, text):
+        """Scan a new page, returning True once both have been seen"""
+        window = self._tail + text
+        self.seen_header = self.seen_header or bool(HEADER_PATTERN.search(window))
+        self.seen_totals = self.seen_totals or bool(TOTALS_PATTERN.search(window))
+        self._tail = window[-self.OVERLAP:]
+        return self.seen_header and self.seen_totals
+
+def extract_page_range(pdf_path, start, stop):
+    """Extract the text of pages [start, stop) of a PDF
+
+    Runs in a worker process, so it opens the file itself.
+    """
+    with open(pdf_path, 'rb') as file:
+        pages = PyPDF2.PdfReader(file).pages
+        return [pages[i].extract_text() or '' for i in range(start, min(stop, len(pages)))]
+
+def _collect_embedded_files(node, files, depth=0):
+    """Walk an EmbeddedFiles name tree collecting (name, filespec) pairs"""
+    if depth > 10:
+        return
+    names = node.get('/Names')
+    if names:
+        names = names.get_object()
+        for i in range(0, len(names) - 1, 2):
+            files.append((str(names[i]), names[i + 1].get_object()))
+    for kid in node.get('/Kids') or []:
+        _collect_embedded_files(kid.get_object(), files, depth + 1)
+
+def extract_attachments(pdf_path, max_pages=5):
+    """Get the files attached to a PDF as (name, bytes) pairs
+
+    Looks at the document's embedded files and at the file attachment
+    annotations of its first pages.
+    """
+    attachments = []
+    with open(pdf_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        specs = []
+        names = reader.trailer['/Root'].get('/Names')
+        if names and '/EmbeddedFiles' in names.get_object():
+            _collect_embedded_files(names.get_object()['/EmbeddedFiles'].get_object(), specs)
+        for page in reader.pages[:max_pages]:
+            for annotation in page.get('/Annots') or []:
+                annotation = annotation.get_object()
+                if annotation.get('/Subtype') == '/FileAttachment' and '/FS' in annotation:
+                    spec = annotation['/FS'].get_object()
+                    specs.append((str(spec.get('/UF') or spec.get('/F') or ''), spec))
+        for name, spec in specs:
+            embedded = spec.get('/EF')
+            if not embedded:
+                continue
+            embedded = embedded.get_object()
+            stream = embedded.get('/F') or embedded.get('/UF')
+            if stream is not None:
+                attachments.append((name or str(spec.get('/F', '')), stream.get_object().get_data()))
+    return attachments
+
+
+class PDFTextExtractor:
+    """Extracts the text of PDF invoices page by page.
+
+    Documents with at least ``parallel_min_pages`` pages are split into
+    chunks of ``chunk_pages`` pages that are extracted in ``executor``
+    (a process pool), smaller ones are extracted in the calling process.
+    Only the first ``max_pages`` pages are read, extraction gives up after
+    ``timeout`` seconds with the text found so far, and it stops early once
+    the leading pages are enough: ``stop_when`` makes a scan per extraction
+    whose ``add(page_text)`` returns True then. Scans keep their state per
+    extraction because one extractor serves concurrent requests.
+    """
+
+    def __init__(self, executor=None, max_pages=50, timeout=30, chunk_pages=4,
+                 parallel_min_pages=8, stop_when=HeaderTotalsScan):
+        self.executor = executor
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.chunk_pages = chunk_pages
+        self.parallel_min_pages = parallel_min_pages
+        self.stop_when = stop_when
+
+    def extract(self, pdf_path):
+        """Extract the text of a PDF"""
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        with open(pdf_path, 'rb') as file:
+            reader = PyPDF2.PdfReader(file)
+            page_count = len(reader.pages)
+            if self.max_pages and page_count > self.max_pages:
+                print(f"PDF has {page_count} pages, reading only the first {self.max_pages}")
+                page_count = self.max_pages
+            if self.executor is None or page_count < self.parallel_min_pages:
+                return self._extract_serial(reader, page_count, deadline)
+        return self._extract_parallel(pdf_path, page_count, deadline)
+
+    def _should_stop(self, scan, new_parts, deadline):
+        if deadline is not None and time.monotonic() > deadline:
+            print("PDF text extraction timed out, using the pages read so far")
+            return True
+        # Only the new pages are scanned, not everything read so far
+        return scan is not None and any(scan.add(part) for part in new_parts)
+
+    def _extract_serial(self, reader, page_count, deadline):
+        scan = self.stop_when() if self.stop_when else None
+        parts = []
+        for i in range(page_count):
+            parts.append(reader.pages[i].extract_text() or '')
+            if i + 1 < page_count and self._should_stop(scan, parts[-1:], deadline):
+                break
+        return ''.join(parts)
+
+    def _extract_parallel(self, pdf_path, page_count, deadline):
+        futures = [
+            self.executor.submit(extract_page_range, pdf_path, start, start + self.chunk_pages)
+            for start in range(0, page_count, self.chunk_pages)
+        ]
+        scan = self.stop_when() if self.stop_when else None
+        parts = []
+        try:
+            # Chunks finish in any order; consume them in page order
+            for index, future in enumerate(futures):
+                while not future.done():
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        print("PDF text extraction timed out, using the pages read so far")
+                        return ''.join(parts)
+                    wait([future], timeout=remaining, return_when=FIRST_COMPLETED)
+                chunk = future.result()
+                parts.extend(chunk)
+                if index + 1 < len(futures) and self._should_stop(scan, chunk, deadline):
+                    break
+            return ''.join(parts)
+        finally:
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,134 @@
+import hashlib
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+
+
+# Parent categories that are never offered for categorization
+EXCLUDED_ACCOUNT_IDS = ('5066', '5065')
+# Words too common in account names to tell them apart
+STOPWORDS = {'de', 'del', 'la', 'las', 'los', 'el', 'en', 'y', 'por', 'para', 'con', 'otros', 'otras'}
+
+
+def stems(text):
+    """Get the word stems of a text: accent-free, lowercase, first 5 letters"""
+    text = unicodedata.normalize('NFKD', str(text or '').lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return {word[:5] for word in re.findall(r'[a-zñ]{3,}', text) if word not in STOPWORDS}
+
+def count_tokens(text):
+    """Estimate the tokens of a prompt, about 4 characters each"""
+    return math.ceil(len(text) / 4)
+
+
+class CategoryTable:
+    """Compact table of the expense accounts offered to the AI.
+
+    The accounts are deduplicated by name, sorted by code and rendered as
+    one ``id|código|nombre`` row each. The prepared table is cached per
+    chart of accounts (a hash of the ids, codes and names), so it is built
+    once per tenant rather than on every prompt.
+
+    With ``top_k`` set, only the ``top_k`` accounts whose names share the
+    most words with the invoice text are offered, weighting rare words
+    higher, plus the ``always_include`` fallback accounts.
+    """
+
+    def __init__(self, top_k=40, always_include=('5077',), max_tables=8):
+        self.top_k = top_k
+        self.always_include = {str(account_id) for account_id in always_include}
+        self.max_tables = max_tables
+        self._lock = threading.Lock()
+        self._tables = OrderedDict()
+
+    def _prepare(self, expense_accounts):
+        rows = []
+        for acc in expense_accounts or []:
+            if str(acc.get('id')) in EXCLUDED_ACCOUNT_IDS:
+                continue
+            rows.append((str(acc.get('code') or ''), str(acc['id']), str(acc['name']).strip(), acc))
+        fingerprint = hashlib.sha256(
+            '\n'.join(f'{account_id}|{code}|{name}' for code, account_id, name, _ in sorted(rows)).encode('utf-8')
+        ).hexdigest()
+        with self._lock:
+            table = self._tables.get(fingerprint)
+            if table is not None:
+                self._tables.move_to_end(fingerprint)
+                return table
+
+        accounts = []
+        seen = set()
+        for code, account_id, name, acc in sorted(rows, key=lambda row: (row[0], row[1])):
+            if name.lower() in seen:
+                continue
+            seen.add(name.lower())
+            accounts.append({
+                'id': account_id,
+                'code': code,
+                'name': name,
+                'row': f"{account_id}|{code or '-'}|{name}",
+                'stems': stems(f"{name} {acc.get('description') or ''}")
+            })
+        document_frequency = Counter(stem for account in accounts for stem in account['stems'])
+        weights = {stem: math.log(1 + len(accounts) / count) for stem, count in document_frequency.items()}
+        table = {'accounts': accounts, 'weights': weights}
+        with self._lock:
+            self._tables[fingerprint] = table
+            while len(self._tables) > self.max_tables:
+                self._tables.popitem(last=False)
+        return table
+
+    def select(self, expense_accounts, text=None):
+        """Get the deduplicated accounts to offer for an invoice text"""
+        table = self._prepare(expense_accounts)
+        accounts = table['accounts']
+        if not self.top_k or text is None or len(accounts) <= self.top_k:
+            return [self._public(account) for account in accounts]
+
+        text_stems = stems(text)
+        weights = table['weights']
+        scores = {
+            account['id']: sum(weights[stem] for stem in account['stems'] & text_stems)
+            for account in accounts
+        }
+        ranked = sorted(accounts, key=lambda account: -scores[account['id']])
+        chosen = {account['id'] for account in ranked[:self.top_k]}
+        chosen |= self.always_include
+        # Keep the table in code order
+        return [self._public(account) for account in accounts if account['id'] in chosen]
+
+    @staticmethod
+    def _public(account):
+        return {key: account[key] for key in ('id', 'code', 'name', 'row')}
+
+    def render(self, accounts):
+        """Render selected accounts as the compact prompt table"""
+        rows = [acc.get('row') or f"{acc['id']}|{acc.get('code') or '-'}|{acc['name']}" for acc in accounts]
+        return 'ID|Código|Nombre\n' + '\n'.join(rows)
+
+
+class PromptStats:
+    """Estimated prompt sizes sent to the AI, by kind of extraction"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds = {}
+
+    def record(self, kind, *parts):
+        tokens = sum(count_tokens(part or '') for part in parts)
+        with self._lock:
+            stats = self._kinds.setdefault(kind, {'prompts': 0, 'tokens': 0, 'max_tokens': 0})
+            stats['prompts'] += 1
+            stats['tokens'] += tokens
+            stats['max_tokens'] = max(stats['max_tokens'], tokens)
+            stats['last_tokens'] = tokens
+        return tokens
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                kind: dict(stats, avg_tokens=round(stats['tokens'] / stats['prompts']))
+                for kind, stats in self._kinds.items()
+            }
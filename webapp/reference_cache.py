@@ -0,0 +1,100 @@
+import threading
+import time
+
+import alegra
+
+
+class ReferenceCache:
+    """Per-tenant TTL cache for Alegra reference data.
+
+    Each dataset (categories, taxes, items, ...) is registered with a loader.
+    Fresh entries are served from memory; entries older than ``ttl`` but
+    younger than ``ttl + stale_ttl`` are served stale while a background
+    thread reloads them, and anything older is reloaded before returning.
+    Concurrent misses for the same entry share a single load, and a load
+    that started before ``invalidate`` is not stored.
+    """
+
+    def __init__(self, ttl=3600, stale_ttl=86400):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._loaders = {}
+        self._entries = {}  # (tenant, name) -> (loaded_at, value)
+        self._generations = {}  # (tenant, name) -> invalidation count
+        self._locks = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def register(self, name, loader, ttl=None):
+        """Register the loader used to fetch a dataset"""
+        self._loaders[name] = (loader, ttl or self.ttl)
+
+    def _tenant(self, tenant):
+        return tenant if tenant is not None else alegra.user
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _load(self, key):
+        loader, _ = self._loaders[key[1]]
+        with self._lock:
+            generation = self._generations.get(key, 0)
+        value = loader()
+        with self._lock:
+            # Invalidated while loading: the value may predate the change
+            if self._generations.get(key, 0) == generation:
+                self._entries[key] = (time.time(), value)
+        return value
+
+    def _refresh_in_background(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                with self._key_lock(key):
+                    self._load(key)
+            except Exception as e:
+                print(f"Error refreshing cached {key[1]}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name=f'refresh-{key[1]}', daemon=True).start()
+
+    def get(self, name, tenant=None):
+        """Get a dataset, loading it from Alegra only when needed"""
+        key = (self._tenant(tenant), name)
+        _, ttl = self._loaders[name]
+        entry = self._entries.get(key)
+        if entry:
+            age = time.time() - entry[0]
+            if age < ttl:
+                return entry[1]
+            if age < ttl + self.stale_ttl:
+                self._refresh_in_background(key)
+                return entry[1]
+        with self._key_lock(key):
+            # Another request may have loaded it while we waited
+            entry = self._entries.get(key)
+            if entry and time.time() - entry[0] < ttl:
+                return entry[1]
+            try:
+                return self._load(key)
+            except Exception:
+                if entry:
+                    print(f"Error loading {name}, serving stale data")
+                    return entry[1]
+                raise
+
+    def invalidate(self, name=None, tenant=None):
+        """Drop one dataset, or every dataset, for a tenant"""
+        tenant = self._tenant(tenant)
+        with self._lock:
+            for dataset in ([name] if name is not None else list(self._loaders)):
+                key = (tenant, dataset)
+                self._entries.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
@@ -0,0 +1,350 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+
+
+# Submission states
+PENDING = 'pending'                  # Claimed, the bill is being posted
+BILL_FAILED = 'bill_failed'          # Alegra rejected the bill; it can be submitted again
+UNKNOWN = 'unknown'                  # The bill post failed midway; Alegra may have the bill
+BILL_CREATED = 'bill_created'        # The bill exists, its payment is still to be posted
+PAYMENT_PENDING = 'payment_pending'  # Claimed, the payment is being posted
+PAYMENT_FAILED = 'payment_failed'    # Alegra rejected the payment; it is retried in the background
+PAYMENT_UNKNOWN = 'payment_unknown'  # The payment post failed midway; it is looked up in Alegra
+COMPLETED = 'completed'              # The bill and its payment, if any, exist
+
+# States in which the bill may exist in Alegra, so it must not be posted again
+REGISTERED_STATES = (BILL_CREATED, PAYMENT_PENDING, PAYMENT_FAILED, PAYMENT_UNKNOWN, COMPLETED)
+# States from which a payment can be claimed and posted
+PAYABLE_STATES = (BILL_CREATED, PAYMENT_FAILED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    vendor_id TEXT NOT NULL,
+    invoice_number TEXT NOT NULL,
+    date TEXT NOT NULL DEFAULT '',
+    total TEXT NOT NULL,
+    state TEXT NOT NULL,
+    bill_id TEXT,
+    payment_id TEXT,
+    payment_data TEXT,
+    response TEXT,
+    error TEXT,
+    payment_attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (vendor_id, invoice_number, total)
+);
+CREATE TABLE IF NOT EXISTS transitions (
+    submission_id INTEGER NOT NULL REFERENCES submissions (id),
+    state TEXT NOT NULL,
+    detail TEXT,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS submissions_state ON submissions (state);
+"""
+
+
+class PaymentRejected(Exception):
+    """Raised by ``pay`` when Alegra definitely did not record the payment"""
+
+
+def normalize_invoice_number(number):
+    """Reduce an invoice number to its letters and digits, without the leading zeros of its numbers"""
+    number = re.sub(r'[^A-Z0-9]', '', str(number or '').upper())
+    return re.sub(r'(?<!\d)0+(?=\d)', '', number)
+
+def submission_key(vendor_id, invoice_number, total):
+    """Normalize the fields that identify a supplier invoice
+
+    Only the invoice's own fields are used (issuer cédula, number and
+    total), so an invoice gets the same key however its vendor was found.
+    """
+    return (
+        re.sub(r'[\s\-\.]+', '', str(vendor_id or '')),
+        normalize_invoice_number(invoice_number),
+        f"{float(total or 0):.2f}"
+    )
+
+
+class SubmissionLedger:
+    """SQLite ledger of the bills submitted to Alegra.
+
+    Each supplier invoice, identified by (issuer cédula, invoice number,
+    total), is claimed before its bill is posted, so a re-submission of an
+    invoice that is being or was already registered is answered from the
+    ledger without any network call. Every state change is recorded in the
+    transitions table.
+
+    A payment is claimed (``payment_pending``) before it is posted, so it
+    is posted by one caller only. Payments Alegra rejected keep their
+    payment data and the resume worker retries them until
+    ``max_attempts``. Payments whose post failed without an answer, or
+    whose claim went stale, are never posted again blindly: the worker
+    looks them up in Alegra first.
+    """
+
+    def __init__(self, path, stale_after=300):
+        self.path = path
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self._thread = None
+
+    def _row(self, row):
+        if row is None:
+            return None
+        entry = dict(row)
+        for field in ('payment_data', 'response'):
+            entry[field] = json.loads(entry[field]) if entry[field] else None
+        return entry
+
+    def _record(self, submission_id, state, detail=None):
+        self._conn.execute(
+            'INSERT INTO transitions (submission_id, state, detail, at) VALUES (?, ?, ?, ?)',
+            (submission_id, state, detail, time.time())
+        )
+
+    def claim(self, key, date=''):
+        """Claim an invoice for submission
+
+        Returns (entry, claimed). When ``claimed`` is False the invoice is
+        already registered or being registered and ``entry`` tells how.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT * FROM submissions WHERE vendor_id = ? AND invoice_number = ? AND total = ?',
+                    key
+                ).fetchone()
+                claimed = False
+                if row is None:
+                    cursor = self._conn.execute(
+                        'INSERT INTO submissions (vendor_id, invoice_number, total, date, state, created_at, updated_at) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        key + (str(date or ''), PENDING, now, now)
+                    )
+                    submission_id, claimed = cursor.lastrowid, True
+                elif row['state'] == BILL_FAILED:
+                    submission_id, claimed = row['id'], True
+                elif row['state'] == PENDING and now - row['updated_at'] > self.stale_after:
+                    # The process that claimed it never finished; the bill may exist
+                    submission_id = row['id']
+                    self._conn.execute('UPDATE submissions SET state = ?, updated_at = ? WHERE id = ?',
+                                       (UNKNOWN, now, submission_id))
+                    self._record(submission_id, UNKNOWN, 'stale claim')
+                else:
+                    submission_id = row['id']
+                if claimed:
+                    self._conn.execute('UPDATE submissions SET state = ?, error = NULL, updated_at = ? WHERE id = ?',
+                                       (PENDING, now, submission_id))
+                    self._record(submission_id, PENDING)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return self.get(submission_id), claimed
+
+    def transition(self, submission_id, state, detail=None, from_states=None, updated_before=None, **fields):
+        """Move a submission to a new state, updating the given fields
+
+        With ``from_states`` (and ``updated_before``) the submission only
+        moves if it is in one of those states (and was last updated before
+        that time), atomically. Returns whether it moved. Does nothing for
+        submissions made without the ledger (an id of None).
+        """
+        if submission_id is None:
+            return False
+        for field in ('payment_data', 'response'):
+            if field in fields:
+                fields[field] = json.dumps(fields[field], ensure_ascii=False) if fields[field] is not None else None
+        assignments = ''.join(f', {field} = ?' for field in fields)
+        conditions = ''
+        params = (state, time.time(), *fields.values(), submission_id)
+        if from_states:
+            conditions += f" AND state IN ({', '.join('?' for _ in from_states)})"
+            params += tuple(from_states)
+        if updated_before is not None:
+            conditions += ' AND updated_at < ?'
+            params += (updated_before,)
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                cursor = self._conn.execute(
+                    f'UPDATE submissions SET state = ?, updated_at = ?{assignments} WHERE id = ?{conditions}',
+                    params
+                )
+                moved = cursor.rowcount > 0
+                if moved:
+                    self._record(submission_id, state, detail)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return moved
+
+    def get(self, submission_id):
+        with self._lock:
+            return self._row(self._conn.execute('SELECT * FROM submissions WHERE id = ?', (submission_id,)).fetchone())
+
+    def history(self, submission_id):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT state, detail, at FROM transitions WHERE submission_id = ? ORDER BY rowid', (submission_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def list(self, state=None, limit=100):
+        query = 'SELECT * FROM submissions'
+        params = ()
+        if state:
+            query += ' WHERE state = ?'
+            params = (state,)
+        query += ' ORDER BY updated_at DESC LIMIT ?'
+        with self._lock:
+            rows = self._conn.execute(query, params + (limit,)).fetchall()
+        return [self._row(row) for row in rows]
+
+    def registered(self):
+        """Get every submission whose bill exists in Alegra"""
+        placeholders = ', '.join('?' for _ in REGISTERED_STATES)
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT * FROM submissions WHERE state IN ({placeholders}) AND bill_id IS NOT NULL',
+                REGISTERED_STATES
+            ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def release(self, submission_id):
+        """Allow a submission in an unknown state to be submitted again
+
+        For when someone checked in Alegra that the bill was not created.
+        """
+        entry = self.get(submission_id)
+        if entry is None or entry['state'] != UNKNOWN:
+            return False
+        self.transition(submission_id, BILL_FAILED, 'released')
+        return True
+
+    def _select(self, states, updated_before, max_attempts=None):
+        query = (f"SELECT * FROM submissions WHERE state IN ({', '.join('?' for _ in states)}) "
+                 'AND updated_at < ?')
+        params = tuple(states) + (updated_before,)
+        if max_attempts is not None:
+            query += ' AND payment_data IS NOT NULL AND payment_attempts < ?'
+            params += (max_attempts,)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._row(row) for row in rows]
+
+    def payments_to_resume(self, max_attempts, retry_after):
+        """Get the submissions whose payment should be posted again"""
+        return self._select(PAYABLE_STATES, time.time() - retry_after, max_attempts)
+
+    def claim_payment(self, submission_id):
+        """Claim a submission's payment for posting
+
+        Returns False when it is not payable, e.g. because another caller
+        claimed it first.
+        """
+        return self.transition(submission_id, PAYMENT_PENDING, from_states=PAYABLE_STATES)
+
+    def post_payment(self, submission_id, payment_data, pay, response, attempts=1):
+        """Post a claimed payment with ``pay(payment_data)`` and record how it went
+
+        ``pay`` returns the created payment or raises; PaymentRejected means
+        Alegra did not record it and it may be retried, any other error
+        leaves the payment unknown. Returns the updated response data.
+        """
+        response = dict(response or {})
+        try:
+            payment = pay(payment_data)
+        except Exception as e:
+            state = PAYMENT_FAILED if isinstance(e, PaymentRejected) else PAYMENT_UNKNOWN
+            print(f"Payment of submission {submission_id} failed ({state}, attempt {attempts}): {e}")
+            response['warning'] = f'Factura creada pero el pago falló: {e}'
+            response['paymentPending'] = submission_id is not None
+            self.transition(submission_id, state, str(e)[:500], from_states=(PAYMENT_PENDING,),
+                            error=str(e)[:500], payment_attempts=attempts, response=response)
+            return response
+        response.pop('warning', None)
+        response.pop('paymentPending', None)
+        response['payment'] = {'id': payment['id'], 'amount': payment['amount']}
+        self.transition(submission_id, COMPLETED, from_states=(PAYMENT_PENDING,), payment_id=str(payment['id']),
+                        payment_attempts=attempts, error=None, response=response)
+        return response
+
+    def _complete_found_payment(self, entry, payment):
+        response = dict(entry['response'] or {})
+        response.pop('warning', None)
+        response.pop('paymentPending', None)
+        response['payment'] = {'id': payment['id'], 'amount': payment.get('amount')}
+        return self.transition(entry['id'], COMPLETED, 'payment found in Alegra', from_states=(PAYMENT_UNKNOWN,),
+                               payment_id=str(payment['id']), error=None, response=response)
+
+    def resume_payments(self, pay, find_payment, max_attempts=5, retry_after=60):
+        """Settle the payments that are not completed
+
+        Stale payment claims become unknown. Unknown payments are looked up
+        with ``find_payment(entry)``, which returns the bill's payment in
+        Alegra or None: found ones are completed and missing ones become
+        failed, to be posted again on a later run. Failed payments are
+        claimed and posted again with ``pay``. Returns how many payments
+        were completed.
+        """
+        now = time.time()
+        for entry in self._select((PAYMENT_PENDING,), now - self.stale_after):
+            self.transition(entry['id'], PAYMENT_UNKNOWN, 'stale payment claim', from_states=(PAYMENT_PENDING,),
+                            updated_before=now - self.stale_after)
+
+        completed = 0
+        # Includes the claims that just went stale
+        for entry in self._select((PAYMENT_UNKNOWN,), time.time()):
+            try:
+                payment = find_payment(entry)
+            except Exception as e:
+                print(f"Error looking up the payment of bill {entry['bill_id']}: {e}")
+                continue
+            if payment:
+                if self._complete_found_payment(entry, payment):
+                    print(f"Found payment {payment['id']} of bill {entry['bill_id']} in Alegra")
+                    completed += 1
+            else:
+                self.transition(entry['id'], PAYMENT_FAILED, 'no payment in Alegra', from_states=(PAYMENT_UNKNOWN,))
+
+        for entry in self.payments_to_resume(max_attempts, retry_after):
+            if not self.claim_payment(entry['id']):
+                continue
+            response = self.post_payment(entry['id'], entry['payment_data'], pay, entry['response'],
+                                         attempts=entry['payment_attempts'] + 1)
+            if 'payment' in response:
+                print(f"Resumed payment {response['payment']['id']} of bill {entry['bill_id']}")
+                completed += 1
+        return completed
+
+    def start(self, pay, find_payment, interval=60, max_attempts=5):
+        """Settle pending payments in a background thread every ``interval`` seconds"""
+        if self._thread is not None:
+            return
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.resume_payments(pay, find_payment, max_attempts, retry_after=interval)
+                except Exception as e:
+                    print(f"Error resuming payments: {e}")
+        self._thread = threading.Thread(target=run, name='submission-ledger', daemon=True)
+        self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT state, COUNT(*) FROM submissions GROUP BY state').fetchall()
+        return {state: count for state, count in rows}
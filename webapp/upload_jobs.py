@@ -0,0 +1,90 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobQueue:
+    """Runs upload processing jobs in a worker pool.
+
+    Jobs are kept in memory with their status (queued, processing, done or
+    failed) and result so clients can poll them or stream their updates.
+    Finished jobs are forgotten after ``retention`` seconds.
+    """
+
+    FINISHED = ('done', 'failed')
+
+    def __init__(self, max_workers=4, retention=3600):
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upload-job')
+        self._jobs = {}
+        self._changed = threading.Condition()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue a job and return its snapshot"""
+        self._purge()
+        job = {
+            'id': uuid.uuid4().hex,
+            'status': 'queued',
+            'result': None,
+            'error': None,
+            'status_code': None,
+            'created_at': time.time(),
+            'finished_at': None,
+            'version': 0
+        }
+        with self._changed:
+            self._jobs[job['id']] = job
+        self._executor.submit(self._run, job['id'], fn, args, kwargs)
+        return dict(job)
+
+    def _update(self, job_id, **changes):
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(changes)
+            job['version'] += 1
+            self._changed.notify_all()
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, status='processing')
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            print(f"Upload job {job_id} failed: {e}")
+            self._update(job_id, status='failed', error=str(e),
+                         status_code=getattr(e, 'status_code', 500), finished_at=time.time())
+        else:
+            self._update(job_id, status='done', result=result, finished_at=time.time())
+
+    def get(self, job_id):
+        """Return a snapshot of a job, or None if it is unknown"""
+        with self._changed:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait_for_change(self, job_id, version, timeout=15):
+        """Block until the job moves past ``version`` or the timeout expires"""
+        with self._changed:
+            self._changed.wait_for(
+                lambda: job_id not in self._jobs or self._jobs[job_id]['version'] != version,
+                timeout=timeout
+            )
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def stats(self):
+        """Count jobs by status"""
+        counts = {}
+        with self._changed:
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        return counts
+
+    def _purge(self):
+        cutoff = time.time() - self.retention
+        with self._changed:
+            for job_id in [j['id'] for j in self._jobs.values()
+                           if j['status'] in self.FINISHED and j['finished_at'] < cutoff]:
+                del self._jobs[job_id]
@@ -0,0 +1,433 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from extraction_confidence import is_valid_cedula, score_extraction
+
+
+TEMPLATE_VERSION = 1
+
+NUMBER_PATTERN = re.compile(r'\d[\d.,]*\d|\d')
+DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}|\d{1,2}[/-]\d{1,2}[/-]\d{2,4}')
+INVOICE_NUMBER_PATTERN = re.compile(r'[A-Za-z0-9][A-Za-z0-9\-]*')
+CEDULA_PATTERN = re.compile(r'\d(?:[\d-]*\d)?')
+# Tokens that may follow the amounts of a line item row
+SYMBOL_TOKENS = {'₡', 'CRC', '$', 'USD', '%'}
+
+VALUE_PATTERNS = {
+    'invoice_number': INVOICE_NUMBER_PATTERN,
+    'date': DATE_PATTERN,
+    'total': NUMBER_PATTERN
+}
+
+
+def normalize_text(text):
+    return ' '.join(str(text or '').lower().split())
+
+def parse_number(token):
+    """Parse an amount written as 1,234.56, 1.234,56, 1234,5 or 1234"""
+    token = token.strip('.,')
+    if not token:
+        return None
+    if ',' in token and '.' in token:
+        decimal = ',' if token.rfind(',') > token.rfind('.') else '.'
+    elif ',' in token:
+        # A single comma followed by three digits is a thousands separator
+        parts = token.split(',')
+        decimal = ',' if len(parts) == 2 and len(parts[1]) != 3 else None
+    elif token.count('.') > 1:
+        decimal = None
+    else:
+        decimal = '.'
+    thousands = {',': '.', '.': ','}.get(decimal, ',.')
+    for separator in thousands:
+        token = token.replace(separator, '')
+    if decimal:
+        token = token.replace(decimal, '.')
+    try:
+        return float(token)
+    except ValueError:
+        return None
+
+def parse_date(token):
+    """Convert a DD/MM/YYYY, DD-MM-YY or YYYY-MM-DD date to YYYY-MM-DD"""
+    if re.match(r'\d{4}-', token):
+        return token
+    day, month, year = re.split(r'[/-]', token)
+    if len(year) == 2:
+        year = '20' + year
+    try:
+        return datetime(int(year), int(month), int(day)).strftime('%Y-%m-%d')
+    except ValueError:
+        return None
+
+def parse_value(field, token):
+    if field == 'total':
+        return parse_number(token)
+    if field == 'date':
+        return parse_date(token)
+    return token
+
+def same_value(field, expected, actual):
+    if actual is None:
+        return False
+    if field == 'total':
+        try:
+            return abs(float(expected) - actual) < 0.01
+        except (TypeError, ValueError):
+            return False
+    return str(expected).strip() == actual
+
+def split_row(line):
+    """Split a table row into its description and the amounts that end it"""
+    tokens = line.split()
+    amounts = []
+    while tokens:
+        token = tokens[-1]
+        if token in SYMBOL_TOKENS:
+            tokens.pop()
+            continue
+        value = parse_number(token.lstrip('₡$')) if NUMBER_PATTERN.fullmatch(token.lstrip('₡$')) else None
+        if value is None:
+            break
+        amounts.insert(0, value)
+        tokens.pop()
+    return ' '.join(tokens), amounts
+
+def row_label(line):
+    """The text of a line without its trailing amounts, to recognize it in other invoices"""
+    return normalize_text(split_row(line)[0])
+
+def find_cedulas(text):
+    """Find every number in the text shaped like a cédula, without dashes"""
+    found = []
+    for match in CEDULA_PATTERN.finditer(text):
+        digits = match.group().replace('-', '')
+        if 9 <= len(digits) <= 12 and digits not in found:
+            found.append(digits)
+    return found
+
+
+def learn_field(text, field, value):
+    """Find the label that precedes a known value in the text
+
+    Returns the rule {'label', 'nth', 'same_line'} that finds the value
+    again, or None. The label is the text before the value on its line, or
+    the previous line when the value stands alone.
+    """
+    pattern = VALUE_PATTERNS[field]
+    for match in pattern.finditer(text):
+        if not same_value(field, value, parse_value(field, match.group())):
+            continue
+        line_start = text.rfind('\n', 0, match.start()) + 1
+        label = text[line_start:match.start()].strip()[-40:].strip()
+        same_line = True
+        if not re.search(r'[^\W\d_]', label):
+            previous = text[:line_start].rstrip('\n').rsplit('\n', 1)[-1]
+            label = previous.strip()[-40:].strip()
+            same_line = False
+        if not re.search(r'[^\W\d_]', label):
+            continue
+        rule = {'label': label, 'nth': 0, 'same_line': same_line}
+        # Use the occurrence of the label that is followed by this value
+        for nth in range(text.count(label)):
+            rule['nth'] = nth
+            if same_value(field, value, apply_field(text, field, rule)):
+                return rule
+    return None
+
+def apply_field(text, field, rule):
+    """Read a field from the text with a learned rule, or return None"""
+    label = re.compile(r'\s+'.join(re.escape(word) for word in rule['label'].split()))
+    matches = list(label.finditer(text))
+    if rule['nth'] >= len(matches):
+        return None
+    start = matches[rule['nth']].end()
+    end = text.find('\n', start)
+    if not rule['same_line'] and end != -1:
+        end = text.find('\n', end + 1)
+    value = VALUE_PATTERNS[field].search(text, start, end if end != -1 else len(text))
+    return parse_value(field, value.group()) if value else None
+
+
+class VendorTemplateStore:
+    """Extraction layouts learned per vendor, keyed by the vendor's cédula.
+
+    After a successful AI extraction the store learns where the invoice
+    number, date and total appear (the label before each value) and how the
+    line item table is laid out (the lines around it and which trailing
+    column holds the line amount), keeping the accounts and taxes the AI
+    chose for each description. A template is only kept if replaying it on
+    the same text reproduces the AI result.
+
+    Later invoices that mention a known vendor's cédula are extracted by
+    replaying its template without calling the AI. Replayed results must
+    pass the extraction confidence checks, including the line totals adding
+    up to the invoice total; a template that fails
+    ``max_failures`` times in a row is dropped so it can be learned again.
+
+    The file is written when a template is learned or dropped; the use and
+    failure counters of replays are kept in memory and written by
+    ``flush()``, which ``start()`` runs periodically.
+    """
+
+    def __init__(self, path, min_confidence=0.9, max_failures=3):
+        self.path = path
+        self.min_confidence = min_confidence
+        self.max_failures = max_failures
+        self._lock = threading.Lock()
+        self._templates = {}
+        self._dirty = False
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Error reading vendor templates: {e}")
+            return
+        if data.get('version') == TEMPLATE_VERSION:
+            self._templates = data.get('templates', {})
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with self._lock:
+            data = json.dumps({'version': TEMPLATE_VERSION, 'templates': self._templates},
+                              ensure_ascii=False, indent=1).encode('utf-8')
+            self._dirty = False
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Error writing vendor templates: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def learn(self, text, header, line_items):
+        """Learn a vendor's template from an AI extraction of its invoice text
+
+        Returns True if a template was stored.
+        """
+        vendor_id = str(header.get('vendor_id') or '').replace('-', '').strip()
+        if not is_valid_cedula(vendor_id) or not line_items:
+            return False
+        template = {
+            'vendor_id': vendor_id,
+            'vendor_name': header.get('vendor_name', ''),
+            'fields': {},
+            'uses': 0,
+            'failures': 0,
+            'learned_at': datetime.now().isoformat(timespec='seconds')
+        }
+        for field in VALUE_PATTERNS:
+            rule = learn_field(text, field, header.get(field))
+            if rule is None:
+                return False
+            template['fields'][field] = rule
+
+        table = self._learn_table(text, line_items)
+        if table is None:
+            return False
+        template['table'] = table
+
+        # Only keep templates that reproduce what the AI found
+        replayed = self._replay(template, text)
+        if replayed is None:
+            return False
+        data, items = replayed
+        if (data['invoice_number'] != str(header.get('invoice_number')).strip()
+                or data['date'] != header.get('date')
+                or not same_value('total', header.get('total'), data['total'])
+                or len(items) != len(line_items)
+                or any(not same_value('total', a.get('amount'), b['amount'])
+                       for a, b in zip(line_items, items))):
+            return False
+
+        with self._lock:
+            self._templates[vendor_id] = template
+        self._save()
+        print(f"📐 Learned extraction template for vendor {vendor_id}")
+        return True
+
+    def _learn_table(self, text, line_items):
+        lines = text.split('\n')
+        rows = []
+        columns = Counter()
+        start = 0
+        for item in line_items:
+            description = normalize_text(item.get('description'))[:25]
+            if not description:
+                return None
+            for index in range(start, len(lines)):
+                amounts = split_row(lines[index])[1]
+                if description in normalize_text(lines[index]) and amounts:
+                    break
+            else:
+                return None
+            positions = [len(amounts) - i for i, value in enumerate(amounts)
+                         if same_value('total', item.get('amount'), value)]
+            if not positions:
+                return None
+            columns.update(positions)
+            rows.append(index)
+            start = index + 1
+
+        before = [row_label(line) for line in lines[:rows[0]] if row_label(line)]
+        after = [row_label(line) for line in lines[rows[-1] + 1:] if row_label(line)]
+        if not before or not after:
+            return None
+
+        accounts = {}
+        taxes = {}
+        for item in line_items:
+            key = normalize_text(item.get('description'))
+            accounts[key] = item.get('account_id')
+            taxes[key] = [bool(item.get('has_tax')), item.get('tax_percentage', 0)]
+        return {
+            'start': before[-1],
+            'end': after[0],
+            'amount_column': columns.most_common(1)[0][0],
+            'accounts': accounts,
+            'taxes': taxes,
+            'default_account': Counter(accounts.values()).most_common(1)[0][0],
+            'default_tax': Counter(tuple(tax) for tax in taxes.values()).most_common(1)[0][0]
+        }
+
+    def _replay(self, template, text):
+        data = {}
+        for field, rule in template['fields'].items():
+            value = apply_field(text, field, rule)
+            if value is None:
+                return None
+            data[field] = value
+
+        table = template['table']
+        lines = text.split('\n')
+        start = next((i for i, line in enumerate(lines) if row_label(line) == table['start']), None)
+        if start is None:
+            return None
+        items = []
+        for line in lines[start + 1:]:
+            if row_label(line) == table['end']:
+                break
+            description, amounts = split_row(line)
+            if not description or len(amounts) < table['amount_column']:
+                continue
+            amount = amounts[-table['amount_column']]
+            key = normalize_text(description)
+            has_tax, tax_percentage = table['taxes'].get(key, table['default_tax'])
+            items.append({
+                'description': description,
+                'quantity': 1,
+                'unit_price': amount,
+                'amount': amount,
+                'account_id': table['accounts'].get(key, table['default_account']),
+                'has_tax': has_tax,
+                'tax_percentage': tax_percentage,
+                'needs_manual_selection': False,
+                'confidence_level': 'high' if key in table['taxes'] else 'medium'
+            })
+        else:
+            return None
+        if not items:
+            return None
+        return data, items
+
+    def apply(self, text):
+        """Extract an invoice with the template of a vendor found in the text
+
+        Returns the invoice data with its line items, shaped like the AI
+        extraction, or None when no template applies.
+        """
+        with self._lock:
+            candidates = [self._templates[cedula] for cedula in find_cedulas(text)
+                          if cedula in self._templates]
+        for template in candidates:
+            replayed = self._replay(template, text)
+            confidence, issues = 0, ['template']
+            if replayed is not None:
+                data, items = replayed
+                data.update(vendor_id=template['vendor_id'], vendor_name=template['vendor_name'])
+                confidence, issues = score_extraction(data, items)
+            # The line amounts must add up to the total; otherwise the layout changed
+            if confidence >= self.min_confidence and 'line_totals' not in issues:
+                with self._lock:
+                    template['uses'] += 1
+                    template['failures'] = 0
+                    self.hits += 1
+                    self._dirty = True
+                return {
+                    'amount': data['total'],
+                    'total': data['total'],
+                    'description': data['invoice_number'],
+                    'invoice_number': data['invoice_number'],
+                    'client_name': '',
+                    'client_id': '',
+                    'vendor_name': data['vendor_name'],
+                    'vendor_id': data['vendor_id'],
+                    'date': data['date'],
+                    'auto_matched': False,
+                    'line_items': items,
+                    'extraction_confidence': confidence,
+                    'template_vendor': template['vendor_id']
+                }
+            print(f"Template for vendor {template['vendor_id']} did not fit (failed: {', '.join(issues)})")
+            with self._lock:
+                template['failures'] += 1
+                dropped = template['failures'] >= self.max_failures
+                if dropped:
+                    self._templates.pop(template['vendor_id'], None)
+                    print(f"Dropping template for vendor {template['vendor_id']}")
+                else:
+                    self._dirty = True
+            if dropped:
+                self._save()
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def flush(self):
+        """Write the template counters updated since the last save"""
+        if self._dirty:
+            self._save()
+
+    def start(self, interval=60):
+        """Flush the template counters in a background thread every ``interval`` seconds"""
+        if self._thread is not None:
+            return
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Error saving vendor templates: {e}")
+        self._thread = threading.Thread(target=run, name='vendor-templates', daemon=True)
+        self._thread.start()
+
+    def clear(self):
+        """Forget every learned template"""
+        with self._lock:
+            self._templates = {}
+        self._save()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'vendors': len(self._templates),
+                'hits': self.hits,
+                'misses': self.misses
+            }